@@ -3,91 +3,137 @@ Dashboard API Endpoints
 Provides all data endpoints for the admin dashboard
 """
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from typing import Optional
-from datetime import datetime, timedelta
+from cachetools import TTLCache
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from pymongo.errors import BulkWriteError
 from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from asyncpg import PostgresError
+from uuid6 import uuid7
+import asyncio
+import orjson
 import uuid
 import hashlib
 import io
 import csv
 import re
 
-from app.db.postgres import async_session_factory
+from app.db.postgres import async_session_factory, read_only_session_factory
 from app.db.mongodb import mongodb
-from app.db.redis import redis_client
-from app.core.security import verify_password, hash_password
+from app.db.redis import redis_client, QR_TOKEN_INDEX, SESSION_INDEX
+from app.core.security import hash_password, hash_password_async, verify_password_async
+from app.core.logging import audit_log
+from app.core.validators import validate_saudi_phone
 
 router = APIRouter(prefix="/dashboard", tags=["dashboard"])
 
 
-# ==================== PHONE VALIDATION ====================
+# ==================== RESPONSE CACHE ====================
+
+# Short-lived Redis cache for the read-heavy dashboard panels. Every open
+# dashboard polls these, so one backend hit per TTL window serves them all.
+STATS_CACHE_KEY = "cache:dashboard:stats"
+TELEMETRY_CACHE_KEY = "cache:dashboard:telemetry"
+TRENDS_TX_CACHE_KEY = "cache:dashboard:trends:tx"
+TRENDS_ATTENDANCE_CACHE_KEY = "cache:dashboard:trends:attendance"
+
+STATS_CACHE_TTL = 15
+TELEMETRY_CACHE_TTL = 60
+TRENDS_CACHE_TTL = 300
+
+# Responses that change when users, programs or allowances are written
+DASHBOARD_CACHE_KEYS = (STATS_CACHE_KEY, TELEMETRY_CACHE_KEY)
+
+
+async def read_cache(key: str):
+    """Return a cached response, or None on a miss or if Redis is unavailable."""
+    try:
+        if redis_client.client is not None:
+            return await redis_client.get_cached(key)
+    except Exception:
+        pass
+    return None
 
-def validate_saudi_phone(phone: str) -> tuple[bool, str]:
-    """
-    Validate Saudi Arabian phone number.
-    Accepted formats:
-    - +966XXXXXXXXX (9 digits after country code)
-    - 05XXXXXXXX (10 digits starting with 05)
-    Returns normalized format: +966XXXXXXXXX
-    """
-    if not phone or phone.strip() == "":
-        return True, ""  # Empty phone is allowed
-    
-    phone = phone.strip().replace(" ", "").replace("-", "")
-    
-    # Pattern for +966 format
-    if phone.startswith("+966"):
-        digits = phone[4:]
-        if len(digits) == 9 and digits.isdigit() and digits[0] == "5":
-            return True, phone
-        return False, "Invalid Saudi phone: must be +966 followed by 9 digits starting with 5"
-    
-    # Pattern for 05 format
-    if phone.startswith("05"):
-        if len(phone) == 10 and phone.isdigit():
-            return True, "+966" + phone[1:]  # Convert to international format
-        return False, "Invalid Saudi phone: must be 10 digits starting with 05"
-    
-    # Pattern for 5 format (without leading 0)
-    if phone.startswith("5") and len(phone) == 9 and phone.isdigit():
-        return True, "+966" + phone
-    
-    return False, "Invalid Saudi phone format. Use +966XXXXXXXXX or 05XXXXXXXX"
+
+async def write_cache(key: str, value, ttl: int) -> None:
+    """Cache a response; caching is best-effort and never fails the request."""
+    try:
+        if redis_client.client is not None:
+            await redis_client.set_cached(key, value, ttl)
+    except Exception:
+        pass
+
+
+async def invalidate_cache(*keys: str) -> None:
+    """Drop cached responses after a write; a stale entry still expires on its TTL."""
+    try:
+        if redis_client.client is not None:
+            await redis_client.client.delete(*keys)
+    except Exception:
+        pass
+
+
+async def invalidate_teacher_classes(*teacher_ids: str) -> None:
+    """Drop the teacher app's cached class lists after a class write (best-effort)."""
+    try:
+        if redis_client.client is not None:
+            await redis_client.delete_teacher_classes(*teacher_ids)
+    except Exception as e:
+        # The write has already committed; a stale list expires with TEACHER_CLASSES_TTL
+        audit_log.error("teacher_classes_invalidate_failed", str(e), actor_role="admin", details={"teacher_ids": list(teacher_ids)})
 
 
 # ==================== HEALTH & TELEMETRY ====================
 
+# Upper bound on each backend probe so one hung service cannot stall the health check
+HEALTH_CHECK_TIMEOUT = 2.0
+
+
+async def probe_service(check, configured: bool = True) -> dict:
+    """Run a single health probe with a timeout and describe the outcome."""
+    if not configured:
+        return {"status": "unknown", "connected": False}
+    try:
+        await asyncio.wait_for(check(), timeout=HEALTH_CHECK_TIMEOUT)
+        return {"status": "healthy", "connected": True}
+    except asyncio.TimeoutError:
+        return {"status": "unhealthy", "connected": False, "error": f"Timed out after {HEALTH_CHECK_TIMEOUT}s"}
+    except Exception as e:
+        return {"status": "unhealthy", "connected": False, "error": str(e)}
+
+
+HEALTH_CHECK_SQL = text("SELECT 1")
+
+
 @router.get("/api/health")
 async def get_health_status():
     """Get health status of all services."""
-    result = {
-        "postgres": {"status": "unknown", "connected": False},
-        "mongodb": {"status": "unknown", "connected": False},
-        "redis": {"status": "unknown", "connected": False},
-        "timestamp": datetime.utcnow().isoformat()
-    }
-    
-    try:
+    async def check_postgres():
         async with async_session_factory() as session:
-            await session.execute(text("SELECT 1"))
-            result["postgres"] = {"status": "healthy", "connected": True}
-    except Exception as e:
-        result["postgres"] = {"status": "unhealthy", "connected": False, "error": str(e)}
+            await session.execute(HEALTH_CHECK_SQL)
     
-    try:
-        if mongodb.db is not None:
-            await mongodb.client.admin.command("ping")
-            result["mongodb"] = {"status": "healthy", "connected": True}
-    except Exception as e:
-        result["mongodb"] = {"status": "unhealthy", "connected": False, "error": str(e)}
+    async def check_mongodb():
+        await mongodb.client.admin.command("ping")
     
-    try:
-        if redis_client.client is not None:
-            await redis_client.client.ping()
-            result["redis"] = {"status": "healthy", "connected": True}
-    except Exception as e:
-        result["redis"] = {"status": "unhealthy", "connected": False, "error": str(e)}
+    async def check_redis():
+        await redis_client.client.ping()
+    
+    # Probes are independent, so total latency is the slowest one, not the sum
+    postgres, mongo, redis = await asyncio.gather(
+        probe_service(check_postgres),
+        probe_service(check_mongodb, configured=mongodb.db is not None),
+        probe_service(check_redis, configured=redis_client.client is not None)
+    )
+    
+    result = {
+        "postgres": postgres,
+        "mongodb": mongo,
+        "redis": redis,
+        "timestamp": datetime.utcnow().isoformat()
+    }
     
     all_healthy = all([
         result["postgres"]["connected"],
@@ -99,9 +145,85 @@ async def get_health_status():
     return result
 
 
+async def read_rollup(rollup_sql, raw_sql) -> list:
+    """
+    Run a daily_stats query, recounting the raw tables instead when the rollup is
+    unavailable (migrations/add_daily_stats_rollup.sql has not been applied).
+    """
+    try:
+        async with read_only_session_factory() as session:
+            result = await session.execute(rollup_sql)
+            return result.all()
+    except DBAPIError:
+        async with read_only_session_factory() as session:
+            result = await session.execute(raw_sql)
+            return result.all()
+
+
+# How often the daily_stats view is rebuilt; dashboard counts lag by at most this much
+DAILY_STATS_REFRESH_INTERVAL = 60
+
+DAILY_STATS_EXISTS_SQL = text("SELECT to_regclass('daily_stats') IS NOT NULL")
+
+# Held until the refresh commits, so workers never queue up behind each other's refresh
+DAILY_STATS_LOCK_SQL = text("SELECT pg_try_advisory_xact_lock(hashtext('daily_stats'))")
+
+REFRESH_DAILY_STATS_SQL = text("REFRESH MATERIALIZED VIEW CONCURRENTLY daily_stats")
+
+
+async def refresh_daily_stats() -> None:
+    """Rebuild the daily_stats view unless another worker is already doing so."""
+    async with async_session_factory() as session, session.begin():
+        locked = (await session.execute(DAILY_STATS_LOCK_SQL)).scalar()
+        if locked:
+            await session.execute(REFRESH_DAILY_STATS_SQL)
+
+
+async def refresh_daily_stats_periodically() -> None:
+    """
+    Background task started with the app: keeps daily_stats current off the request path.
+    Exits straight away if the rollup migration has not been applied (read_rollup falls back).
+    """
+    async with read_only_session_factory() as session:
+        if not (await session.execute(DAILY_STATS_EXISTS_SQL)).scalar():
+            return
+    
+    while True:
+        try:
+            await refresh_daily_stats()
+        except Exception as e:
+            audit_log.error("daily_stats_refresh_failed", str(e))
+        await asyncio.sleep(DAILY_STATS_REFRESH_INTERVAL)
+
+
+DASHBOARD_COUNTS_SQL = text("""
+    SELECT
+        (SELECT COUNT(*) FROM students WHERE is_active = true),
+        (SELECT COUNT(*) FROM teachers WHERE is_active = true),
+        (SELECT COUNT(*) FROM programs WHERE is_active = true)
+""")
+
+DASHBOARD_TODAY_SQL = text("""
+    SELECT transaction_count, transaction_total, attendance_count
+    FROM daily_stats WHERE stat_date = CURRENT_DATE
+""")
+
+DASHBOARD_TODAY_RAW_SQL = text("""
+    SELECT
+        (SELECT COUNT(*) FROM store_transactions WHERE created_at >= CURRENT_DATE),
+        (SELECT COALESCE(SUM(amount), 0) FROM store_transactions WHERE created_at >= CURRENT_DATE),
+        (SELECT COUNT(*) FROM attendance_records WHERE scanned_at >= CURRENT_DATE)
+""")
+
+
 @router.get("/api/stats")
-async def get_dashboard_stats():
-    """Get dashboard statistics."""
+async def get_dashboard_stats(fresh: bool = False):
+    """Get dashboard statistics. Pass fresh=1 to bypass the cache."""
+    if not fresh:
+        cached = await read_cache(STATS_CACHE_KEY)
+        if cached is not None:
+            return cached
+    
     stats = {
         "total_students": 0,
         "total_teachers": 0,
@@ -113,58 +235,87 @@ async def get_dashboard_stats():
         "active_sessions": 0
     }
     
-    try:
-        async with async_session_factory() as session:
-            result = await session.execute(text(
-                "SELECT COUNT(*) FROM students WHERE is_active = true"
-            ))
-            stats["total_students"] = result.scalar() or 0
-            
-            result = await session.execute(text(
-                "SELECT COUNT(*) FROM teachers WHERE is_active = true"
-            ))
-            stats["total_teachers"] = result.scalar() or 0
-            
-            result = await session.execute(text(
-                "SELECT COUNT(*) FROM programs WHERE is_active = true"
-            ))
-            stats["total_programs"] = result.scalar() or 0
-            
-            result = await session.execute(text("""
-                SELECT COUNT(*) FROM store_transactions 
-                WHERE DATE(transaction_time) = CURRENT_DATE
-            """))
-            stats["transactions_today"] = result.scalar() or 0
-            
-            result = await session.execute(text("""
-                SELECT COALESCE(SUM(total_amount), 0) FROM store_transactions 
-                WHERE DATE(transaction_time) = CURRENT_DATE
-            """))
-            stats["revenue_today"] = float(result.scalar() or 0)
-            
-            result = await session.execute(text("""
-                SELECT COUNT(*) FROM attendance_records 
-                WHERE DATE(scanned_at) = CURRENT_DATE
-            """))
-            stats["attendance_today"] = result.scalar() or 0
-    except:
-        pass
+    async def postgres_counts():
+        async with read_only_session_factory() as session:
+            result = await session.execute(DASHBOARD_COUNTS_SQL)
+            return result.one()
     
-    try:
-        if redis_client.client is not None:
-            qr_keys = await redis_client.client.keys("qr:*")
-            stats["active_qr_tokens"] = len(qr_keys) if qr_keys else 0
-            session_keys = await redis_client.client.keys("session:*")
-            stats["active_sessions"] = len(session_keys) if session_keys else 0
-    except:
-        pass
+    async def postgres_today():
+        rows = await read_rollup(DASHBOARD_TODAY_SQL, DASHBOARD_TODAY_RAW_SQL)
+        return rows[0] if rows else None
+    
+    async def redis_counts():
+        if redis_client.client is None:
+            return None
+        return await asyncio.gather(
+            redis_client.count_indexed(QR_TOKEN_INDEX),
+            redis_client.count_indexed(SESSION_INDEX)
+        )
+    
+    # Entity counts, today's activity and Redis are fetched independently;
+    # a failure in one leaves only its own figures at zero
+    counts, today, live = await asyncio.gather(
+        postgres_counts(),
+        postgres_today(),
+        redis_counts(),
+        return_exceptions=True
+    )
+    
+    if not isinstance(counts, BaseException):
+        stats["total_students"] = counts[0] or 0
+        stats["total_teachers"] = counts[1] or 0
+        stats["total_programs"] = counts[2] or 0
+    
+    if today is not None and not isinstance(today, BaseException):
+        stats["transactions_today"] = today[0] or 0
+        stats["revenue_today"] = float(today[1] or 0)
+        stats["attendance_today"] = today[2] or 0
     
+    if live is not None and not isinstance(live, BaseException):
+        stats["active_qr_tokens"], stats["active_sessions"] = live
+    
+    # Zeros from a failed lookup are served but not cached
+    if not any(isinstance(part, BaseException) for part in (counts, today, live)):
+        await write_cache(STATS_CACHE_KEY, stats, STATS_CACHE_TTL)
     return stats
 
 
+TELEMETRY_DATABASE_SIZE_SQL = text("SELECT pg_size_pretty(pg_database_size(current_database()))")
+
+TELEMETRY_ACTIVITY_SQL = text("""
+    SELECT
+        COALESCE(SUM(transaction_count) FILTER (WHERE stat_date = CURRENT_DATE), 0),
+        COALESCE(SUM(transaction_count) FILTER (WHERE stat_date >= CURRENT_DATE - 7), 0),
+        COALESCE(SUM(transaction_count), 0),
+        COALESCE(SUM(attendance_count) FILTER (WHERE stat_date = CURRENT_DATE), 0),
+        COALESCE(SUM(attendance_count) FILTER (WHERE stat_date >= CURRENT_DATE - 7), 0)
+    FROM daily_stats
+    WHERE stat_date >= CURRENT_DATE - 30
+""")
+
+TELEMETRY_ACTIVITY_RAW_SQL = text("""
+    SELECT
+        (SELECT COUNT(*) FROM store_transactions WHERE created_at >= CURRENT_DATE),
+        (SELECT COUNT(*) FROM store_transactions WHERE created_at >= CURRENT_DATE - 7),
+        (SELECT COUNT(*) FROM store_transactions WHERE created_at >= CURRENT_DATE - 30),
+        (SELECT COUNT(*) FROM attendance_records WHERE scanned_at >= CURRENT_DATE),
+        (SELECT COUNT(*) FROM attendance_records WHERE scanned_at >= CURRENT_DATE - 7)
+""")
+
+TELEMETRY_TABLE_COUNTS_SQL = text("""
+    SELECT relname as table_name, n_live_tup as row_count
+    FROM pg_stat_user_tables ORDER BY n_live_tup DESC LIMIT 10
+""")
+
+
 @router.get("/api/telemetry")
-async def get_telemetry():
-    """Get key telemetry metrics."""
+async def get_telemetry(fresh: bool = False):
+    """Get key telemetry metrics. Pass fresh=1 to bypass the cache."""
+    if not fresh:
+        cached = await read_cache(TELEMETRY_CACHE_KEY)
+        if cached is not None:
+            return cached
+    
     metrics = {
         "postgres": {"database_size": "N/A", "table_counts": {}},
         "mongodb": {"total_documents": 0, "collections": {}},
@@ -173,117 +324,164 @@ async def get_telemetry():
         "attendance": {"today": 0, "week": 0}
     }
     
-    try:
-        async with async_session_factory() as session:
-            result = await session.execute(text(
-                "SELECT pg_size_pretty(pg_database_size(current_database()))"
-            ))
-            metrics["postgres"]["database_size"] = result.scalar()
-            
-            result = await session.execute(text("""
-                SELECT relname as table_name, n_live_tup as row_count
-                FROM pg_stat_user_tables ORDER BY n_live_tup DESC LIMIT 10
-            """))
-            rows = result.fetchall()
-            metrics["postgres"]["table_counts"] = {r[0]: r[1] for r in rows}
-            
-            result = await session.execute(text("""
-                SELECT COUNT(*) FROM store_transactions WHERE DATE(transaction_time) = CURRENT_DATE
-            """))
-            metrics["transactions"]["today"] = result.scalar() or 0
-            
-            result = await session.execute(text("""
-                SELECT COUNT(*) FROM store_transactions WHERE transaction_time >= CURRENT_DATE - INTERVAL '7 days'
-            """))
-            metrics["transactions"]["week"] = result.scalar() or 0
-            
-            result = await session.execute(text("""
-                SELECT COUNT(*) FROM store_transactions WHERE transaction_time >= CURRENT_DATE - INTERVAL '30 days'
-            """))
-            metrics["transactions"]["month"] = result.scalar() or 0
-            
-            result = await session.execute(text("""
-                SELECT COUNT(*) FROM attendance_records WHERE DATE(scanned_at) = CURRENT_DATE
-            """))
-            metrics["attendance"]["today"] = result.scalar() or 0
-            
-            result = await session.execute(text("""
-                SELECT COUNT(*) FROM attendance_records WHERE scanned_at >= CURRENT_DATE - INTERVAL '7 days'
-            """))
-            metrics["attendance"]["week"] = result.scalar() or 0
-    except:
-        pass
+    # Each block fills its own section of metrics, so run them concurrently.
+    # They report whether they succeeded, so partial metrics are never cached.
+    async def collect_postgres():
+        try:
+            async with read_only_session_factory() as session:
+                result = await session.execute(TELEMETRY_DATABASE_SIZE_SQL)
+                metrics["postgres"]["database_size"] = result.scalar()
+                
+                result = await session.execute(TELEMETRY_TABLE_COUNTS_SQL)
+                rows = result.fetchall()
+                metrics["postgres"]["table_counts"] = {r[0]: r[1] for r in rows}
+            return True
+        except:
+            return False
     
-    try:
-        if mongodb.db is not None:
-            collections = await mongodb.db.list_collection_names()
-            for coll_name in collections:
-                count = await mongodb.db[coll_name].count_documents({})
-                metrics["mongodb"]["collections"][coll_name] = count
-                metrics["mongodb"]["total_documents"] += count
-    except:
-        pass
+    async def collect_activity():
+        try:
+            # Activity counters come from the periodically refreshed daily_stats rollup
+            row = (await read_rollup(TELEMETRY_ACTIVITY_SQL, TELEMETRY_ACTIVITY_RAW_SQL))[0]
+            metrics["transactions"]["today"] = row[0] or 0
+            metrics["transactions"]["week"] = row[1] or 0
+            metrics["transactions"]["month"] = row[2] or 0
+            metrics["attendance"]["today"] = row[3] or 0
+            metrics["attendance"]["week"] = row[4] or 0
+            return True
+        except:
+            return False
     
-    try:
-        if redis_client.client is not None:
-            info = await redis_client.client.info()
-            metrics["redis"]["memory"] = info.get("used_memory_human", "N/A")
-            metrics["redis"]["keys"] = await redis_client.client.dbsize()
-    except:
-        pass
+    async def collect_mongodb():
+        try:
+            if mongodb.db is not None:
+                collections = await mongodb.db.list_collection_names()
+                # Metadata-only counts (no collection scan), fetched concurrently
+                counts = await asyncio.gather(*[
+                    mongodb.db[coll_name].estimated_document_count()
+                    for coll_name in collections
+                ])
+                for coll_name, count in zip(collections, counts):
+                    metrics["mongodb"]["collections"][coll_name] = count
+                    metrics["mongodb"]["total_documents"] += count
+            return True
+        except:
+            return False
+    
+    async def collect_redis():
+        try:
+            if redis_client.client is not None:
+                # Only the memory section of INFO, pipelined with DBSIZE (one round trip)
+                pipe = redis_client.client.pipeline(transaction=False)
+                pipe.info("memory")
+                pipe.dbsize()
+                info, keys = await pipe.execute()
+                metrics["redis"]["memory"] = info.get("used_memory_human", "N/A")
+                metrics["redis"]["keys"] = keys
+            return True
+        except:
+            return False
+    
+    collected = await asyncio.gather(collect_postgres(), collect_activity(), collect_mongodb(), collect_redis())
     
+    if all(collected):
+        await write_cache(TELEMETRY_CACHE_KEY, metrics, TELEMETRY_CACHE_TTL)
     return metrics
 
 
+# Both trend queries read the periodically refreshed daily_stats rollup (one row per day);
+# days without activity are skipped, as they are when grouping the raw tables
+TRANSACTION_TRENDS_SQL = text("""
+    SELECT stat_date as date, transaction_count as count, transaction_total::float8 as total
+    FROM daily_stats
+    WHERE stat_date >= CURRENT_DATE - 7 AND transaction_count > 0
+    ORDER BY stat_date
+""")
+
+TRANSACTION_TRENDS_RAW_SQL = text("""
+    SELECT created_at::date as date, COUNT(*) as count, COALESCE(SUM(amount), 0)::float8 as total
+    FROM store_transactions
+    WHERE created_at >= CURRENT_DATE - 7
+    GROUP BY 1 ORDER BY 1
+""")
+
+
 @router.get("/api/trends/transactions")
-async def get_transaction_trends():
-    """Get 7-day transaction trends."""
+async def get_transaction_trends(fresh: bool = False):
+    """Get 7-day transaction trends. Pass fresh=1 to bypass the cache."""
+    if not fresh:
+        cached = await read_cache(TRENDS_TX_CACHE_KEY)
+        if cached is not None:
+            return cached
+    
     try:
-        async with async_session_factory() as session:
-            result = await session.execute(text("""
-                SELECT DATE(transaction_time) as date, COUNT(*) as count,
-                       COALESCE(SUM(total_amount), 0) as total
-                FROM store_transactions
-                WHERE transaction_time >= CURRENT_DATE - INTERVAL '7 days'
-                GROUP BY DATE(transaction_time) ORDER BY date
-            """))
-            rows = result.fetchall()
-            return [{"date": str(r[0]), "count": r[1], "total": float(r[2])} for r in rows]
+        rows = await read_rollup(TRANSACTION_TRENDS_SQL, TRANSACTION_TRENDS_RAW_SQL)
+        # Columns are named and typed in SQL, so rows map straight to the response
+        trends = [dict(r._mapping) for r in rows]
     except:
         return []
+    
+    await write_cache(TRENDS_TX_CACHE_KEY, trends, TRENDS_CACHE_TTL)
+    return trends
+
+
+ATTENDANCE_TRENDS_SQL = text("""
+    SELECT stat_date as date, attendance_count as count
+    FROM daily_stats
+    WHERE stat_date >= CURRENT_DATE - 7 AND attendance_count > 0
+    ORDER BY stat_date
+""")
+
+ATTENDANCE_TRENDS_RAW_SQL = text("""
+    SELECT scanned_at::date as date, COUNT(*) as count
+    FROM attendance_records
+    WHERE scanned_at >= CURRENT_DATE - 7
+    GROUP BY 1 ORDER BY 1
+""")
 
 
 @router.get("/api/trends/attendance")
-async def get_attendance_trends():
-    """Get 7-day attendance trends."""
+async def get_attendance_trends(fresh: bool = False):
+    """Get 7-day attendance trends. Pass fresh=1 to bypass the cache."""
+    if not fresh:
+        cached = await read_cache(TRENDS_ATTENDANCE_CACHE_KEY)
+        if cached is not None:
+            return cached
+    
     try:
-        async with async_session_factory() as session:
-            result = await session.execute(text("""
-                SELECT DATE(scanned_at) as date, COUNT(*) as count
-                FROM attendance_records
-                WHERE scanned_at >= CURRENT_DATE - INTERVAL '7 days'
-                GROUP BY DATE(scanned_at) ORDER BY date
-            """))
-            rows = result.fetchall()
-            return [{"date": str(r[0]), "count": r[1]} for r in rows]
+        rows = await read_rollup(ATTENDANCE_TRENDS_SQL, ATTENDANCE_TRENDS_RAW_SQL)
+        trends = [dict(r._mapping) for r in rows]
     except:
         return []
+    
+    await write_cache(TRENDS_ATTENDANCE_CACHE_KEY, trends, TRENDS_CACHE_TTL)
+    return trends
 
 
 # ==================== USER MANAGEMENT ====================
 
 @router.get("/api/users")
-async def get_all_users(role: Optional[str] = None):
-    """Get users from MongoDB."""
+async def get_all_users(
+    role: Optional[str] = None,
+    limit: int = 1000,
+    offset: int = 0,
+    q: Optional[str] = None
+):
+    """Get a page of users from MongoDB."""
     try:
         if mongodb.db is None:
             raise HTTPException(status_code=503, detail="MongoDB not connected")
         query = {"role": role} if role else {}
-        cursor = mongodb.db.users.find(query)
-        users = await cursor.to_list(length=1000)
+        if q:
+            pattern = {"$regex": re.escape(q), "$options": "i"}
+            query["$or"] = [{"full_name": pattern}, {"email": pattern}]
+        # Password hashes are excluded by the server and never leave MongoDB
+        cursor = mongodb.db.users.find(
+            query, projection={"password_hash": 0, "auth.password_hash": 0}
+        ).skip(offset).limit(limit)
+        users = await cursor.to_list(length=limit)
         for user in users:
             user["_id"] = str(user["_id"])
-            user.pop("password_hash", None)
         return users
     except HTTPException:
         raise
@@ -292,61 +490,91 @@ async def get_all_users(role: Optional[str] = None):
 
 
 @router.get("/api/students")
-async def get_all_students():
-    """Get all students with their class enrollments."""
+async def get_all_students(
+    limit: Optional[int] = None,
+    offset: int = 0,
+    after: Optional[str] = None,
+    q: Optional[str] = None
+):
+    """Get students with their class enrollments (all of them unless a limit is given)."""
     try:
+        # `after` is the last student_id of the previous page (keyset pagination)
+        filters = []
+        params = {"limit": limit, "offset": offset}
+        if q:
+            filters.append("(s.full_name ILIKE :q OR s.phone_number ILIKE :q)")
+            params["q"] = f"%{q}%"
+        if after:
+            filters.append("""(s.full_name, s.student_id) > (
+                SELECT full_name, student_id FROM students WHERE student_id = :after
+            )""")
+            params["after"] = after
+        where = f"WHERE {' AND '.join(filters)}" if filters else ""
+        
         async with async_session_factory() as session:
-            result = await session.execute(text("""
-                SELECT s.student_id, s.user_id, s.full_name, s.phone_number,
-                       s.program_id, s.is_active, p.name as program_name,
-                       c.class_id, c.name as class_name
-                FROM students s
-                LEFT JOIN programs p ON s.program_id = p.program_id
-                LEFT JOIN class_enrollments ce ON s.student_id = ce.student_id
-                LEFT JOIN classes c ON ce.class_id = c.class_id
-                ORDER BY s.full_name
-            """))
-            rows = result.fetchall()
-            columns = ["student_id", "user_id", "full_name", "phone_number", "program_id", "is_active", "program_name", "class_id", "class_name"]
-            return [dict(zip(columns, row)) for row in rows]
+            # Page over students first so enrollment rows never split a page
+            result = await session.execute(text(f"""
+                WITH page AS (
+                    SELECT s.student_id FROM students s
+                    {where}
+                    ORDER BY s.full_name, s.student_id
+                    LIMIT :limit OFFSET :offset
+                ),
+                listing AS (
+                    SELECT s.student_id, s.user_id, s.full_name, s.phone_number,
+                           s.program_id, s.is_active, p.name as program_name,
+                           c.class_id, c.name as class_name
+                    FROM page
+                    JOIN students s ON s.student_id = page.student_id
+                    LEFT JOIN programs p ON s.program_id = p.program_id
+                    LEFT JOIN class_enrollments ce ON s.student_id = ce.student_id
+                    LEFT JOIN classes c ON ce.class_id = c.class_id
+                )
+                SELECT COALESCE(json_agg(l ORDER BY l.full_name, l.student_id), '[]')::text
+                FROM listing l
+            """), params)
+            # PostgreSQL renders the JSON array; pass it through untouched
+            return Response(content=result.scalar(), media_type="application/json")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+STUDENT_EXISTS_SQL = text("SELECT student_id FROM students WHERE student_id = :student_id")
+
+DELETE_STUDENT_ENROLLMENTS_SQL = text("DELETE FROM class_enrollments WHERE student_id = :student_id")
+
+CLASS_EXISTS_SQL = text("SELECT class_id FROM classes WHERE class_id = :class_id")
+
+INSERT_ENROLLMENT_SQL = text("""
+    INSERT INTO class_enrollments (class_id, student_id)
+    VALUES (:class_id, :student_id)
+""")
+
+
 @router.put("/api/students/{student_id}/class")
 async def update_student_class(student_id: str, data: dict):
     """Update the class enrollment for a student."""
     try:
         class_id = data.get("class_id")
         
-        async with async_session_factory() as session:
+        async with async_session_factory() as session, session.begin():
             # Verify student exists
-            result = await session.execute(text(
-                "SELECT student_id FROM students WHERE student_id = :student_id"
-            ), {"student_id": student_id})
+            result = await session.execute(STUDENT_EXISTS_SQL, {"student_id": student_id})
             if not result.scalar():
                 raise HTTPException(status_code=404, detail="Student not found")
             
             # Remove existing class enrollments for this student
-            await session.execute(text(
-                "DELETE FROM class_enrollments WHERE student_id = :student_id"
-            ), {"student_id": student_id})
+            await session.execute(DELETE_STUDENT_ENROLLMENTS_SQL, {"student_id": student_id})
             
             # Add new enrollment if class_id provided
             if class_id:
                 # Verify class exists
-                result = await session.execute(text(
-                    "SELECT class_id FROM classes WHERE class_id = :class_id"
-                ), {"class_id": class_id})
+                result = await session.execute(CLASS_EXISTS_SQL, {"class_id": class_id})
                 if not result.scalar():
                     raise HTTPException(status_code=404, detail="Class not found")
                 
-                await session.execute(text("""
-                    INSERT INTO class_enrollments (class_id, student_id)
-                    VALUES (:class_id, :student_id)
-                """), {"class_id": class_id, "student_id": student_id})
+                await session.execute(INSERT_ENROLLMENT_SQL, {"class_id": class_id, "student_id": student_id})
             
-            await session.commit()
             return {"success": True, "message": "Class enrollment updated"}
     except HTTPException:
         raise
@@ -354,6 +582,26 @@ async def update_student_class(student_id: str, data: dict):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+CLASS_PROGRAM_SQL = text("SELECT class_id, program_id FROM classes WHERE class_id = :class_id")
+
+UPSERT_ENROLLMENT_SQL = text("""
+    INSERT INTO class_enrollments (class_id, student_id)
+    VALUES (:class_id, :student_id)
+    ON CONFLICT (class_id, student_id) DO NOTHING
+""")
+
+DELETE_ENROLLMENTS_FOR_STUDENTS_SQL = text("""
+    DELETE FROM class_enrollments WHERE student_id = ANY(CAST(:student_ids AS uuid[]))
+""")
+
+ENROLL_STUDENTS_SQL = text("""
+    INSERT INTO class_enrollments (class_id, student_id)
+    SELECT CAST(:class_id AS uuid), student_id
+    FROM unnest(CAST(:student_ids AS uuid[])) AS student_id
+    ON CONFLICT (class_id, student_id) DO NOTHING
+""")
+
+
 @router.post("/api/students/bulk-class-change")
 async def bulk_change_student_classes(data: dict):
     """Bulk change class enrollment for multiple students."""
@@ -364,33 +612,22 @@ async def bulk_change_student_classes(data: dict):
         if not student_ids:
             raise HTTPException(status_code=400, detail="No students selected")
         
-        async with async_session_factory() as session:
+        async with async_session_factory() as session, session.begin():
             # Verify class exists if provided
             if class_id:
-                result = await session.execute(text(
-                    "SELECT class_id, program_id FROM classes WHERE class_id = :class_id"
-                ), {"class_id": class_id})
+                result = await session.execute(CLASS_PROGRAM_SQL, {"class_id": class_id})
                 class_row = result.fetchone()
                 if not class_row:
                     raise HTTPException(status_code=404, detail="Class not found")
             
-            updated = 0
-            for student_id in student_ids:
-                # Remove existing enrollments
-                await session.execute(text(
-                    "DELETE FROM class_enrollments WHERE student_id = :student_id"
-                ), {"student_id": student_id})
-                
-                # Add new enrollment if class_id provided
-                if class_id:
-                    await session.execute(text("""
-                        INSERT INTO class_enrollments (class_id, student_id)
-                        VALUES (:class_id, :student_id)
-                        ON CONFLICT (class_id, student_id) DO NOTHING
-                    """), {"class_id": class_id, "student_id": student_id})
-                updated += 1
+            # Remove existing enrollments for the whole selection
+            await session.execute(DELETE_ENROLLMENTS_FOR_STUDENTS_SQL, {"student_ids": student_ids})
+            
+            # Add new enrollments if class_id provided
+            if class_id:
+                await session.execute(ENROLL_STUDENTS_SQL, {"class_id": class_id, "student_ids": student_ids})
+            updated = len(student_ids)
             
-            await session.commit()
             action = f"enrolled in class" if class_id else "removed from all classes"
             return {"success": True, "message": f"{updated} students {action}"}
     except HTTPException:
@@ -399,99 +636,106 @@ async def bulk_change_student_classes(data: dict):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+CLASSES_BY_PROGRAM_SQL = text("""
+    SELECT c.class_id, c.name, c.teacher_id, c.active, t.full_name as teacher_name
+    FROM classes c
+    LEFT JOIN teachers t ON c.teacher_id = t.user_id
+    WHERE c.program_id = :program_id AND c.active = true
+    ORDER BY c.name
+""")
+
+
 @router.get("/api/classes/by-program/{program_id}")
 async def get_classes_by_program(program_id: str):
     """Get all classes for a specific program."""
     try:
         async with async_session_factory() as session:
-            result = await session.execute(text("""
-                SELECT c.class_id, c.name, c.teacher_id, c.active, t.full_name as teacher_name
-                FROM classes c
-                LEFT JOIN teachers t ON c.teacher_id = t.user_id
-                WHERE c.program_id = :program_id AND c.active = true
-                ORDER BY c.name
-            """), {"program_id": program_id})
-            rows = result.fetchall()
-            columns = ["class_id", "name", "teacher_id", "active", "teacher_name"]
-            return [dict(zip(columns, row)) for row in rows]
+            result = await session.execute(CLASSES_BY_PROGRAM_SQL, {"program_id": program_id})
+            # Column labels come straight from the SELECT list
+            return [dict(row) for row in result.mappings()]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+TEACHERS_WITH_PROGRAMS_SQL = text("""
+    SELECT COALESCE(json_agg(x ORDER BY x.full_name), '[]')::text
+    FROM (
+        SELECT t.teacher_id, t.user_id, t.full_name, t.is_active,
+               COALESCE(json_agg(json_build_object('program_id', p.program_id, 'name', p.name)
+                                 ORDER BY p.name)
+                        FILTER (WHERE p.program_id IS NOT NULL), '[]') as programs,
+               COALESCE(string_agg(p.name, ', ' ORDER BY p.name), 'No programs') as program_name
+        FROM teachers t
+        LEFT JOIN teacher_programs tp ON tp.teacher_id = t.teacher_id
+        LEFT JOIN programs p ON p.program_id = tp.program_id
+        GROUP BY t.teacher_id
+    ) x
+""")
+
+
 @router.get("/api/teachers")
 async def get_all_teachers():
     """Get all teachers with their program assignments."""
     try:
         async with async_session_factory() as session:
-            # Get basic teacher info
-            result = await session.execute(text("""
-                SELECT t.teacher_id, t.user_id, t.full_name, t.is_active
-                FROM teachers t ORDER BY t.full_name
-            """))
-            rows = result.fetchall()
-            teachers = []
-            
-            for row in rows:
-                teacher_id = str(row[0])
-                # Get all programs for this teacher from junction table
-                prog_result = await session.execute(text("""
-                    SELECT p.program_id, p.name 
-                    FROM teacher_programs tp
-                    JOIN programs p ON tp.program_id = p.program_id
-                    WHERE tp.teacher_id = :teacher_id
-                """), {"teacher_id": teacher_id})
-                prog_rows = prog_result.fetchall()
-                
-                programs = [{"program_id": str(pr[0]), "name": pr[1]} for pr in prog_rows]
-                program_names = ", ".join([p["name"] for p in programs]) if programs else "No programs"
-                
-                teachers.append({
-                    "teacher_id": teacher_id,
-                    "user_id": str(row[1]),
-                    "full_name": row[2],
-                    "is_active": row[3],
-                    "programs": programs,
-                    "program_name": program_names  # For backward compatibility with UI
-                })
-            
-            return teachers
+            # Teachers with all their programs from the junction table in one query
+            result = await session.execute(TEACHERS_WITH_PROGRAMS_SQL)
+            # PostgreSQL renders the JSON array; pass it through untouched
+            # (program_name is the comma-joined label the UI shows)
+            return Response(content=result.scalar(), media_type="application/json")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Each count is an index probe per program (idx_students_active_program,
+# idx_teacher_programs_program_teacher); no join fans out before counting
+PROGRAMS_WITH_COUNTS_SQL = text("""
+    SELECT COALESCE(json_agg(x ORDER BY x.name), '[]')::text
+    FROM (
+        SELECT p.program_id, p.name, p.cost_center, 
+               p.default_daily_allowance, p.is_active,
+               p.start_date, p.end_date,
+               (SELECT COUNT(*) FROM students s
+                WHERE s.program_id = p.program_id AND s.is_active = true) as student_count,
+               (SELECT COUNT(*) FROM teacher_programs tp
+                JOIN teachers t ON t.teacher_id = tp.teacher_id AND t.is_active = true
+                WHERE tp.program_id = p.program_id) as teacher_count
+        FROM programs p
+    ) x
+""")
+
+
 @router.get("/api/programs")
 async def get_all_programs():
     """Get all programs."""
     try:
         async with async_session_factory() as session:
-            result = await session.execute(text("""
-                SELECT p.program_id, p.name, p.cost_center, 
-                       p.default_daily_allowance, p.is_active,
-                       p.start_date, p.end_date,
-                       COUNT(DISTINCT s.student_id) as student_count,
-                       COUNT(DISTINCT tp.teacher_id) as teacher_count
-                FROM programs p
-                LEFT JOIN students s ON p.program_id = s.program_id AND s.is_active = true
-                LEFT JOIN teacher_programs tp ON p.program_id = tp.program_id
-                LEFT JOIN teachers t ON tp.teacher_id = t.teacher_id AND t.is_active = true
-                GROUP BY p.program_id ORDER BY p.name
-            """))
-            rows = result.fetchall()
-            columns = ["program_id", "name", "cost_center", "default_daily_allowance", "is_active", "start_date", "end_date", "student_count", "teacher_count"]
-            programs_list = []
-            for row in rows:
-                prog = dict(zip(columns, row))
-                # Convert dates to strings for JSON serialization
-                if prog.get("start_date"):
-                    prog["start_date"] = str(prog["start_date"])
-                if prog.get("end_date"):
-                    prog["end_date"] = str(prog["end_date"])
-                programs_list.append(prog)
-            return programs_list
+            result = await session.execute(PROGRAMS_WITH_COUNTS_SQL)
+            # PostgreSQL renders the JSON array; pass it through untouched
+            return Response(content=result.scalar(), media_type="application/json")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+INSERT_STUDENT_SQL = text("""
+    INSERT INTO students (student_id, user_id, full_name, phone_number, program_id, is_active)
+    VALUES (:student_id, :user_id, :full_name, :phone_number, :program_id, true)
+""")
+
+INSERT_TEACHER_SQL = text("""
+    INSERT INTO teachers (teacher_id, user_id, full_name, program_id, is_active, created_at)
+    VALUES (:teacher_id, :user_id, :full_name, :program_id, true, NOW())
+""")
+
+UPSERT_TEACHER_PROGRAM_SQL = text("""
+    INSERT INTO teacher_programs (teacher_id, program_id)
+    VALUES (:teacher_id, :program_id)
+    ON CONFLICT (teacher_id, program_id) DO NOTHING
+""")
+
+STUDENT_BY_PHONE_SQL = text("SELECT student_id FROM students WHERE phone_number = :phone")
+
+
 @router.post("/api/users")
 async def create_user(data: dict):
     """Create a new user."""
@@ -508,21 +752,13 @@ async def create_user(data: dict):
             if not is_valid:
                 raise HTTPException(status_code=400, detail=normalized)
             phone_number = normalized
-            
-            # Check uniqueness
-            async with async_session_factory() as session:
-                result = await session.execute(text(
-                    "SELECT student_id FROM students WHERE phone_number = :phone"
-                ), {"phone": phone_number})
-                if result.scalar():
-                    raise HTTPException(status_code=400, detail="Phone number already registered")
-            
-        user_id = str(uuid.uuid4())
+        
+        user_id = str(uuid7())
         # Use temp123 as default if password is empty or not provided
         password = data.get("password", "").strip() or "temp123"
-        password_hash = hash_password(password)
+        password_hash = await hash_password_async(password)
         
-        await mongodb.db.users.insert_one({
+        user_doc = {
             "_id": user_id,
             "user_id": user_id,
             "email": data["email"],
@@ -539,15 +775,12 @@ async def create_user(data: dict):
                 "created_at": datetime.utcnow(),
                 "updated_at": datetime.utcnow()
             }
-        })
+        }
         
-        async with async_session_factory() as session:
+        async def insert_postgres(session):
             if role == "student":
-                student_id = str(uuid.uuid4())
-                await session.execute(text("""
-                    INSERT INTO students (student_id, user_id, full_name, phone_number, program_id, is_active)
-                    VALUES (:student_id, :user_id, :full_name, :phone_number, :program_id, true)
-                """), {
+                student_id = str(uuid7())
+                await session.execute(INSERT_STUDENT_SQL, {
                     "student_id": student_id,
                     "user_id": user_id,
                     "full_name": data["full_name"],
@@ -558,24 +791,17 @@ async def create_user(data: dict):
                 # Enroll student in class if class_id provided
                 class_id = data.get("class_id")
                 if class_id:
-                    await session.execute(text("""
-                        INSERT INTO class_enrollments (class_id, student_id)
-                        VALUES (:class_id, :student_id)
-                        ON CONFLICT (class_id, student_id) DO NOTHING
-                    """), {
+                    await session.execute(UPSERT_ENROLLMENT_SQL, {
                         "class_id": class_id,
                         "student_id": student_id
                     })
             elif role == "teacher":
-                teacher_id = str(uuid.uuid4())
+                teacher_id = str(uuid7())
                 # Get first program_id for backward compatibility (legacy column)
                 program_ids = data.get("program_ids", [])
                 primary_program_id = program_ids[0] if program_ids else data.get("program_id")
                 
-                await session.execute(text("""
-                    INSERT INTO teachers (teacher_id, user_id, full_name, program_id, is_active, created_at)
-                    VALUES (:teacher_id, :user_id, :full_name, :program_id, true, NOW())
-                """), {
+                await session.execute(INSERT_TEACHER_SQL, {
                     "teacher_id": teacher_id,
                     "user_id": user_id,
                     "full_name": data["full_name"],
@@ -583,18 +809,40 @@ async def create_user(data: dict):
                 })
                 
                 # Insert into teacher_programs junction table for all selected programs
-                for program_id in program_ids:
-                    await session.execute(text("""
-                        INSERT INTO teacher_programs (teacher_id, program_id)
-                        VALUES (:teacher_id, :program_id)
-                        ON CONFLICT (teacher_id, program_id) DO NOTHING
-                    """), {
-                        "teacher_id": teacher_id,
-                        "program_id": program_id
-                    })
+                # (one executemany instead of a round trip per program)
+                if program_ids:
+                    await session.execute(UPSERT_TEACHER_PROGRAM_SQL, [
+                        {"teacher_id": teacher_id, "program_id": program_id}
+                        for program_id in program_ids
+                    ])
             # Store users only get MongoDB entry, no PostgreSQL record needed
-            await session.commit()
         
+        # One session covers the uniqueness check, the inserts and the commit
+        async with async_session_factory() as session:
+            if role == "student" and phone_number:
+                result = await session.execute(STUDENT_BY_PHONE_SQL, {"phone": phone_number})
+                if result.scalar():
+                    raise HTTPException(status_code=400, detail="Phone number already registered")
+            
+            # Write both stores concurrently; PostgreSQL only commits once the
+            # MongoDB insert has landed, and the MongoDB document is removed again
+            # if the PostgreSQL side fails
+            mongo_result, pg_result = await asyncio.gather(
+                mongodb.db.users.insert_one(user_doc),
+                insert_postgres(session),
+                return_exceptions=True
+            )
+            if isinstance(mongo_result, Exception):
+                raise mongo_result
+            try:
+                if isinstance(pg_result, Exception):
+                    raise pg_result
+                await session.commit()
+            except Exception:
+                await mongodb.db.users.delete_one({"_id": user_id})
+                raise
+        
+        await invalidate_cache(*DASHBOARD_CACHE_KEYS)
         return {"success": True, "user_id": user_id}
     except HTTPException:
         raise
@@ -602,6 +850,14 @@ async def create_user(data: dict):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+SET_USER_ACTIVE_SQL = text("""
+    WITH s AS (
+        UPDATE students SET is_active = :is_active WHERE user_id = :user_id
+    )
+    UPDATE teachers SET is_active = :is_active WHERE user_id = :user_id
+""")
+
+
 @router.put("/api/users/{user_id}/status")
 async def update_user_status(user_id: str, data: dict):
     """Update user status."""
@@ -611,17 +867,17 @@ async def update_user_status(user_id: str, data: dict):
             
         is_active = data.get("is_active", True)
         
-        await mongodb.db.users.update_one({"user_id": user_id}, {"$set": {"is_active": is_active}})
+        async def update_postgres():
+            async with async_session_factory() as session, session.begin():
+                # Student and teacher rows in one round trip
+                await session.execute(SET_USER_ACTIVE_SQL, {"is_active": is_active, "user_id": user_id})
         
-        async with async_session_factory() as session:
-            await session.execute(text(
-                "UPDATE students SET is_active = :is_active WHERE user_id = :user_id"
-            ), {"is_active": is_active, "user_id": user_id})
-            await session.execute(text(
-                "UPDATE teachers SET is_active = :is_active WHERE user_id = :user_id"
-            ), {"is_active": is_active, "user_id": user_id})
-            await session.commit()
+        await asyncio.gather(
+            mongodb.db.users.update_one({"user_id": user_id}, {"$set": {"is_active": is_active}}),
+            update_postgres()
+        )
         
+        await invalidate_cache(*DASHBOARD_CACHE_KEYS)
         return {"success": True}
     except HTTPException:
         raise
@@ -652,7 +908,7 @@ async def reset_user_password(user_id: str, data: dict = None):
                 raise HTTPException(status_code=400, detail="Password must be at least 6 characters")
         
         # Hash and update password
-        password_hash = hash_password(new_password)
+        password_hash = await hash_password_async(new_password)
         
         await mongodb.db.users.update_one(
             {"user_id": user_id},
@@ -673,6 +929,58 @@ async def reset_user_password(user_id: str, data: dict = None):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+DELETE_USER_SQL = text("""
+    WITH s AS (
+        SELECT student_id FROM students WHERE user_id = :user_id
+    ),
+    t AS (
+        SELECT teacher_id FROM teachers WHERE user_id = :user_id
+    ),
+    teacher_sessions AS (
+        SELECT session_id FROM attendance_sessions
+        WHERE created_by = :user_id AND EXISTS (SELECT 1 FROM t)
+    ),
+    teacher_classes AS (
+        SELECT class_id FROM classes WHERE teacher_id IN (SELECT teacher_id FROM t)
+    ),
+    del_attendance AS (
+        DELETE FROM attendance_records
+        WHERE student_id IN (SELECT student_id FROM s)
+           OR session_id IN (SELECT session_id FROM teacher_sessions)
+    ),
+    del_enrollments AS (
+        DELETE FROM class_enrollments
+        WHERE student_id IN (SELECT student_id FROM s)
+           OR class_id IN (SELECT class_id FROM teacher_classes)
+    ),
+    del_transactions AS (
+        DELETE FROM store_transactions WHERE student_id IN (SELECT student_id FROM s)
+    ),
+    del_allowances AS (
+        DELETE FROM daily_allowances WHERE student_id IN (SELECT student_id FROM s)
+    ),
+    del_student AS (
+        DELETE FROM students WHERE user_id = :user_id
+    ),
+    del_meal_transactions AS (
+        DELETE FROM teacher_meal_transactions WHERE teacher_id IN (SELECT teacher_id FROM t)
+    ),
+    del_teacher_allowances AS (
+        DELETE FROM teacher_daily_allowances WHERE teacher_id IN (SELECT teacher_id FROM t)
+    ),
+    del_teacher_programs AS (
+        DELETE FROM teacher_programs WHERE teacher_id IN (SELECT teacher_id FROM t)
+    ),
+    del_sessions AS (
+        DELETE FROM attendance_sessions WHERE session_id IN (SELECT session_id FROM teacher_sessions)
+    ),
+    del_classes AS (
+        DELETE FROM classes WHERE class_id IN (SELECT class_id FROM teacher_classes)
+    )
+    DELETE FROM teachers WHERE user_id = :user_id
+""")
+
+
 @router.delete("/api/users/{user_id}")
 async def delete_user(user_id: str):
     """Delete a user and all related records."""
@@ -680,93 +988,22 @@ async def delete_user(user_id: str):
         if mongodb.db is None:
             raise HTTPException(status_code=503, detail="MongoDB not connected")
         
-        async with async_session_factory() as session:
-            # First get the student_id if this is a student
-            result = await session.execute(text(
-                "SELECT student_id FROM students WHERE user_id = :user_id"
-            ), {"user_id": user_id})
-            student_row = result.fetchone()
-            
-            if student_row:
-                student_id = str(student_row[0])
-                
-                # Delete in FK-safe order for student-related tables
-                # 1. Delete attendance records (references students via session, but also directly)
-                await session.execute(text(
-                    "DELETE FROM attendance_records WHERE student_id = :student_id"
-                ), {"student_id": student_id})
-                
-                # 2. Delete class enrollments
-                await session.execute(text(
-                    "DELETE FROM class_enrollments WHERE student_id = :student_id"
-                ), {"student_id": student_id})
-                
-                # 3. Delete store transactions
-                await session.execute(text(
-                    "DELETE FROM store_transactions WHERE student_id = :student_id"
-                ), {"student_id": student_id})
-                
-                # 4. Delete daily allowances
-                await session.execute(text(
-                    "DELETE FROM daily_allowances WHERE student_id = :student_id"
-                ), {"student_id": student_id})
-                
-                # 5. Finally delete the student record
-                await session.execute(text(
-                    "DELETE FROM students WHERE user_id = :user_id"
-                ), {"user_id": user_id})
-            
-            # Check if this is a teacher
-            result = await session.execute(text(
-                "SELECT teacher_id FROM teachers WHERE user_id = :user_id"
-            ), {"user_id": user_id})
-            teacher_row = result.fetchone()
-            
-            if teacher_row:
-                teacher_id = str(teacher_row[0])
-                
-                # Delete teacher-related records
-                # 1. Delete teacher meal transactions
-                await session.execute(text(
-                    "DELETE FROM teacher_meal_transactions WHERE teacher_id = :teacher_id"
-                ), {"teacher_id": teacher_id})
-                
-                # 2. Delete teacher daily allowances
-                await session.execute(text(
-                    "DELETE FROM teacher_daily_allowances WHERE teacher_id = :teacher_id"
-                ), {"teacher_id": teacher_id})
-                
-                # 3. Delete teacher program associations
-                await session.execute(text(
-                    "DELETE FROM teacher_programs WHERE teacher_id = :teacher_id"
-                ), {"teacher_id": teacher_id})
-                
-                # 4. Delete attendance sessions created by this teacher
-                await session.execute(text(
-                    "DELETE FROM attendance_records WHERE session_id IN (SELECT session_id FROM attendance_sessions WHERE created_by = :user_id)"
-                ), {"user_id": user_id})
-                await session.execute(text(
-                    "DELETE FROM attendance_sessions WHERE created_by = :user_id"
-                ), {"user_id": user_id})
-                
-                # 5. Update classes to remove teacher reference or delete them
-                await session.execute(text(
-                    "DELETE FROM class_enrollments WHERE class_id IN (SELECT class_id FROM classes WHERE teacher_id = :teacher_id)"
-                ), {"teacher_id": teacher_id})
-                await session.execute(text(
-                    "DELETE FROM classes WHERE teacher_id = :teacher_id"
-                ), {"teacher_id": teacher_id})
-                
-                # 6. Finally delete the teacher record
-                await session.execute(text(
-                    "DELETE FROM teachers WHERE user_id = :user_id"
-                ), {"user_id": user_id})
-            
-            await session.commit()
-        
-        # Delete from MongoDB
-        await mongodb.db.users.delete_one({"user_id": user_id})
+        async def delete_postgres():
+            async with async_session_factory() as session, session.begin():
+                # Remove the student and/or teacher rows and everything that references
+                # them in one statement. Data-modifying CTEs share a snapshot and FK
+                # checks run at statement end, so child and parent rows go together.
+                await session.execute(DELETE_USER_SQL, {"user_id": user_id})
+        
+        # The PostgreSQL delete is idempotent, so both stores are cleared
+        # concurrently and a failed request can simply be retried
+        await asyncio.gather(
+            delete_postgres(),
+            mongodb.db.users.delete_one({"user_id": user_id})
+        )
         
+        await invalidate_cache(*DASHBOARD_CACHE_KEYS)
+        await invalidate_teacher_classes(user_id)
         return {"success": True}
     except HTTPException:
         raise
@@ -776,12 +1013,18 @@ async def delete_user(user_id: str):
 
 # ==================== PROGRAMS ====================
 
+INSERT_PROGRAM_SQL = text("""
+    INSERT INTO programs (program_id, name, cost_center_code, cost_center, default_daily_allowance, is_active, active, start_date, end_date)
+    VALUES (:program_id, :name, :cost_center_code, :cost_center, :default_daily_allowance, true, true, :start_date, :end_date)
+""")
+
+
 @router.post("/api/programs")
 async def create_program(data: dict):
     """Create a program."""
     from datetime import datetime
     try:
-        program_id = str(uuid.uuid4())
+        program_id = str(uuid7())
         cost_center = data.get("cost_center", data.get("cost_center_code", "GEN-001"))
         
         # Handle empty strings for dates - convert to Python date objects
@@ -803,11 +1046,8 @@ async def create_program(data: dict):
         except (ValueError, TypeError):
             default_allowance = 50.0
         
-        async with async_session_factory() as session:
-            await session.execute(text("""
-                INSERT INTO programs (program_id, name, cost_center_code, cost_center, default_daily_allowance, is_active, active, start_date, end_date)
-                VALUES (:program_id, :name, :cost_center_code, :cost_center, :default_daily_allowance, true, true, :start_date, :end_date)
-            """), {
+        async with async_session_factory() as session, session.begin():
+            await session.execute(INSERT_PROGRAM_SQL, {
                 "program_id": program_id,
                 "name": data["name"],
                 "cost_center_code": cost_center,
@@ -816,8 +1056,8 @@ async def create_program(data: dict):
                 "start_date": start_date,
                 "end_date": end_date
             })
-            await session.commit()
         
+        await invalidate_cache(*DASHBOARD_CACHE_KEYS)
         return {"success": True, "program_id": program_id}
     except KeyError as e:
         raise HTTPException(status_code=400, detail=f"Missing required field: {str(e)}")
@@ -828,6 +1068,16 @@ async def create_program(data: dict):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+UPDATE_PROGRAM_SQL = text("""
+    UPDATE programs p SET name = :name, cost_center = :cost_center, cost_center_code = :cost_center_code,
+    default_daily_allowance = :default_daily_allowance, is_active = :is_active, active = :active,
+    start_date = :start_date, end_date = :end_date
+    FROM (SELECT is_active FROM programs WHERE program_id = :program_id) AS previous
+    WHERE p.program_id = :program_id
+    RETURNING previous.is_active
+""")
+
+
 @router.put("/api/programs/{program_id}")
 async def update_program(program_id: str, data: dict):
     """Update a program."""
@@ -856,19 +1106,9 @@ async def update_program(program_id: str, data: dict):
             default_allowance = 50.0
         
         async with async_session_factory() as session:
-            # Get current program active state to check if deactivating
-            result = await session.execute(text(
-                "SELECT is_active FROM programs WHERE program_id = :program_id"
-            ), {"program_id": program_id})
-            row = result.fetchone()
-            was_active = row[0] if row else True
-            
-            await session.execute(text("""
-                UPDATE programs SET name = :name, cost_center = :cost_center, cost_center_code = :cost_center_code,
-                default_daily_allowance = :default_daily_allowance, is_active = :is_active, active = :active,
-                start_date = :start_date, end_date = :end_date
-                WHERE program_id = :program_id
-            """), {
+            # Update and return the previous active state to check if deactivating
+            # (the FROM subquery still sees the row as it was before the update)
+            result = await session.execute(UPDATE_PROGRAM_SQL, {
                 "name": data["name"],
                 "cost_center": cost_center,
                 "cost_center_code": cost_center,
@@ -879,100 +1119,104 @@ async def update_program(program_id: str, data: dict):
                 "end_date": end_date,
                 "program_id": program_id
             })
+            row = result.fetchone()
+            was_active = row[0] if row else False
             
             # If program is being deactivated, cascade to students and teachers
+            user_ids = []
             if was_active and not is_active:
-                await cascade_program_deactivation(session, program_id)
+                user_ids = await cascade_program_deactivation(session, [program_id])
             
             await session.commit()
+            # MongoDB follows only once PostgreSQL has committed, so a failed commit changes nothing
+            await deactivate_mongo_users(user_ids)
+        await invalidate_cache(*DASHBOARD_CACHE_KEYS)
         return {"success": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-async def cascade_program_deactivation(session, program_id: str):
-    """Deactivate all students and teachers associated with a program."""
-    # Deactivate students in this program
-    await session.execute(text(
-        "UPDATE students SET is_active = false WHERE program_id = :program_id"
-    ), {"program_id": program_id})
+DEACTIVATE_PROGRAM_STUDENTS_SQL = text("""
+    UPDATE students SET is_active = false
+    WHERE program_id = ANY(:program_ids)
+    RETURNING user_id
+""")
+
+DEACTIVATE_PROGRAM_TEACHERS_SQL = text("""
+    UPDATE teachers t SET is_active = false
+    WHERE t.teacher_id IN (
+        SELECT tp.teacher_id FROM teacher_programs tp WHERE tp.program_id = ANY(:program_ids)
+    )
+    AND NOT EXISTS (
+        SELECT 1 FROM teacher_programs tp
+        JOIN programs p ON tp.program_id = p.program_id
+        WHERE tp.teacher_id = t.teacher_id
+          AND p.program_id != ALL(:program_ids) AND p.is_active = true
+    )
+    RETURNING t.user_id
+""")
+
+
+async def cascade_program_deactivation(session, program_ids: list[str]) -> list[str]:
+    """Deactivate all students and teachers associated with the given programs.
     
-    # Get student user_ids to update in MongoDB
-    result = await session.execute(text(
-        "SELECT user_id FROM students WHERE program_id = :program_id"
-    ), {"program_id": program_id})
+    Returns the affected user_ids; pass them to deactivate_mongo_users after committing.
+    """
+    # Deactivate students in these programs, collecting user_ids for MongoDB
+    result = await session.execute(DEACTIVATE_PROGRAM_STUDENTS_SQL, {"program_ids": program_ids})
     student_user_ids = [str(row[0]) for row in result.fetchall()]
     
-    # Deactivate teachers linked to this program via teacher_programs junction table
-    result = await session.execute(text("""
-        SELECT DISTINCT t.teacher_id, t.user_id FROM teachers t
-        JOIN teacher_programs tp ON t.teacher_id = tp.teacher_id
-        WHERE tp.program_id = :program_id
-    """), {"program_id": program_id})
-    teacher_rows = result.fetchall()
+    # Deactivate teachers linked to these programs via teacher_programs junction table,
+    # but only those with no OTHER active program (one set-based statement)
+    result = await session.execute(DEACTIVATE_PROGRAM_TEACHERS_SQL, {"program_ids": program_ids})
+    teacher_user_ids = [str(row[0]) for row in result.fetchall()]
     
-    for teacher_row in teacher_rows:
-        teacher_id = str(teacher_row[0])
-        teacher_user_id = str(teacher_row[1])
-        
-        # Check if teacher has any OTHER active programs
-        other_prog_result = await session.execute(text("""
-            SELECT COUNT(*) FROM teacher_programs tp
-            JOIN programs p ON tp.program_id = p.program_id
-            WHERE tp.teacher_id = :teacher_id AND p.program_id != :program_id AND p.is_active = true
-        """), {"teacher_id": teacher_id, "program_id": program_id})
-        other_active_programs = other_prog_result.scalar() or 0
-        
-        # Only deactivate teacher if they have no other active programs
-        if other_active_programs == 0:
-            await session.execute(text(
-                "UPDATE teachers SET is_active = false WHERE teacher_id = :teacher_id"
-            ), {"teacher_id": teacher_id})
-            
-            # Update in MongoDB
-            if mongodb.db is not None:
-                await mongodb.db.users.update_one(
-                    {"user_id": teacher_user_id},
-                    {"$set": {"status": "inactive"}}
-                )
-    
-    # Update students in MongoDB
-    if mongodb.db is not None and student_user_ids:
+    return student_user_ids + teacher_user_ids
+
+
+async def deactivate_mongo_users(user_ids: list[str]):
+    """Mark users inactive in MongoDB."""
+    if mongodb.db is not None and user_ids:
         await mongodb.db.users.update_many(
-            {"user_id": {"$in": student_user_ids}},
+            {"user_id": {"$in": user_ids}},
             {"$set": {"status": "inactive"}}
         )
 
 
+DEACTIVATE_PROGRAM_SQL = text("""
+    UPDATE programs SET is_active = false, active = false
+    WHERE program_id = :program_id AND is_active = true
+    RETURNING name
+""")
+
+PROGRAM_EXISTS_SQL = text("SELECT 1 FROM programs WHERE program_id = :program_id")
+
+
 @router.post("/api/programs/{program_id}/deactivate")
 async def deactivate_program(program_id: str):
     """Deactivate a program and cascade to associated students/teachers."""
     try:
         async with async_session_factory() as session:
-            # Check if program exists
-            result = await session.execute(text(
-                "SELECT name, is_active FROM programs WHERE program_id = :program_id"
-            ), {"program_id": program_id})
+            # Deactivate the program if it is active, returning its name
+            result = await session.execute(DEACTIVATE_PROGRAM_SQL, {"program_id": program_id})
             row = result.fetchone()
             if not row:
-                raise HTTPException(status_code=404, detail="Program not found")
-            
-            program_name = row[0]
-            is_already_inactive = not row[1]
-            
-            if is_already_inactive:
+                # Either missing or already inactive
+                result = await session.execute(PROGRAM_EXISTS_SQL, {"program_id": program_id})
+                if not result.scalar():
+                    raise HTTPException(status_code=404, detail="Program not found")
                 return {"success": True, "message": "Program is already inactive"}
             
-            # Deactivate the program
-            await session.execute(text(
-                "UPDATE programs SET is_active = false, active = false WHERE program_id = :program_id"
-            ), {"program_id": program_id})
+            program_name = row[0]
             
             # Cascade deactivation to students and teachers
-            await cascade_program_deactivation(session, program_id)
+            user_ids = await cascade_program_deactivation(session, [program_id])
             
             await session.commit()
+            # MongoDB follows only once PostgreSQL has committed, so a failed commit changes nothing
+            await deactivate_mongo_users(user_ids)
         
+        await invalidate_cache(*DASHBOARD_CACHE_KEYS)
         return {"success": True, "message": f"Program '{program_name}' and associated users have been deactivated"}
     except HTTPException:
         raise
@@ -980,35 +1224,41 @@ async def deactivate_program(program_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# SKIP LOCKED lets concurrent callers (cron and the dashboard) split the expired
+# set instead of queueing behind each other; each program is cascaded exactly once
+DEACTIVATE_EXPIRED_PROGRAMS_SQL = text("""
+    UPDATE programs SET is_active = false, active = false
+    WHERE program_id IN (
+        SELECT program_id FROM programs
+        WHERE is_active = true AND end_date IS NOT NULL AND end_date < :today
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING program_id
+""")
+
+
 @router.post("/api/programs/check-expired")
 async def check_and_deactivate_expired_programs():
     """Check for programs past their end_date and deactivate them with cascade."""
     try:
         from datetime import date as date_type
         today = date_type.today()
-        deactivated_count = 0
         
+        # Deactivate every expired program and cascade to all of their
+        # students and teachers in one transaction, whatever the count
         async with async_session_factory() as session:
-            # Find active programs that have passed their end_date
-            result = await session.execute(text("""
-                SELECT program_id, name FROM programs 
-                WHERE is_active = true AND end_date IS NOT NULL AND end_date < :today
-            """), {"today": today})
-            expired_programs = result.fetchall()
+            result = await session.execute(DEACTIVATE_EXPIRED_PROGRAMS_SQL, {"today": today})
+            expired_program_ids = [str(row[0]) for row in result.fetchall()]
             
-            for prog_row in expired_programs:
-                program_id = str(prog_row[0])
-                
-                # Deactivate the program
-                await session.execute(text(
-                    "UPDATE programs SET is_active = false, active = false WHERE program_id = :program_id"
-                ), {"program_id": program_id})
-                
-                # Cascade deactivation
-                await cascade_program_deactivation(session, program_id)
-                deactivated_count += 1
+            user_ids = []
+            if expired_program_ids:
+                user_ids = await cascade_program_deactivation(session, expired_program_ids)
             
             await session.commit()
+            # MongoDB follows only once PostgreSQL has committed, so a failed commit changes nothing
+            await deactivate_mongo_users(user_ids)
+        
+        deactivated_count = len(expired_program_ids)
         
         return {
             "success": True,
@@ -1019,23 +1269,24 @@ async def check_and_deactivate_expired_programs():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+COUNT_PROGRAM_STUDENTS_SQL = text("SELECT COUNT(*) FROM students WHERE program_id = :program_id")
+
+DELETE_PROGRAM_SQL = text("DELETE FROM programs WHERE program_id = :program_id")
+
+
 @router.delete("/api/programs/{program_id}")
 async def delete_program(program_id: str):
     """Delete a program."""
     try:
-        async with async_session_factory() as session:
-            result = await session.execute(text(
-                "SELECT COUNT(*) FROM students WHERE program_id = :program_id"
-            ), {"program_id": program_id})
+        async with async_session_factory() as session, session.begin():
+            result = await session.execute(COUNT_PROGRAM_STUDENTS_SQL, {"program_id": program_id})
             count = result.scalar() or 0
             
             if count > 0:
                 raise HTTPException(status_code=400, detail="Program has assigned students")
             
-            await session.execute(text(
-                "DELETE FROM programs WHERE program_id = :program_id"
-            ), {"program_id": program_id})
-            await session.commit()
+            await session.execute(DELETE_PROGRAM_SQL, {"program_id": program_id})
+        await invalidate_cache(*DASHBOARD_CACHE_KEYS)
         return {"success": True}
     except HTTPException:
         raise
@@ -1045,86 +1296,101 @@ async def delete_program(program_id: str):
 
 # ==================== CLASSES ====================
 
+CLASSES_FOR_PROGRAM_SQL = text("""
+    SELECT c.class_id, c.name, c.program_id, c.teacher_id, c.active,
+           p.name as program_name, t.full_name as teacher_name
+    FROM classes c
+    LEFT JOIN programs p ON c.program_id = p.program_id
+    LEFT JOIN teachers t ON c.teacher_id = t.user_id
+    WHERE c.program_id = :program_id
+    ORDER BY p.name, c.name
+""")
+
+ALL_CLASSES_SQL = text("""
+    SELECT c.class_id, c.name, c.program_id, c.teacher_id, c.active,
+           p.name as program_name, t.full_name as teacher_name
+    FROM classes c
+    LEFT JOIN programs p ON c.program_id = p.program_id
+    LEFT JOIN teachers t ON c.teacher_id = t.user_id
+    ORDER BY p.name, c.name
+""")
+
+
 @router.get("/api/classes")
 async def get_all_classes(program_id: Optional[str] = None):
     """Get all classes, optionally filtered by program."""
     try:
         async with async_session_factory() as session:
             if program_id:
-                result = await session.execute(text("""
-                    SELECT c.class_id, c.name, c.program_id, c.teacher_id, c.active,
-                           p.name as program_name, t.full_name as teacher_name
-                    FROM classes c
-                    LEFT JOIN programs p ON c.program_id = p.program_id
-                    LEFT JOIN teachers t ON c.teacher_id = t.user_id
-                    WHERE c.program_id = :program_id
-                    ORDER BY p.name, c.name
-                """), {"program_id": program_id})
+                result = await session.execute(CLASSES_FOR_PROGRAM_SQL, {"program_id": program_id})
             else:
-                result = await session.execute(text("""
-                    SELECT c.class_id, c.name, c.program_id, c.teacher_id, c.active,
-                           p.name as program_name, t.full_name as teacher_name
-                    FROM classes c
-                    LEFT JOIN programs p ON c.program_id = p.program_id
-                    LEFT JOIN teachers t ON c.teacher_id = t.user_id
-                    ORDER BY p.name, c.name
-                """))
-            rows = result.fetchall()
-            columns = ["class_id", "name", "program_id", "teacher_id", "active", "program_name", "teacher_name"]
-            return [dict(zip(columns, row)) for row in rows]
+                result = await session.execute(ALL_CLASSES_SQL)
+            # Column labels come straight from the SELECT list
+            return [dict(row) for row in result.mappings()]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+INSERT_CLASS_SQL = text("""
+    INSERT INTO classes (class_id, name, program_id, teacher_id, active)
+    VALUES (:class_id, :name, :program_id, :teacher_id, true)
+""")
+
+
 @router.post("/api/classes")
 async def create_class(data: dict):
     """Create a new class."""
     try:
         class_id = str(uuid.uuid4())
-        async with async_session_factory() as session:
-            await session.execute(text("""
-                INSERT INTO classes (class_id, name, program_id, teacher_id, active)
-                VALUES (:class_id, :name, :program_id, :teacher_id, true)
-            """), {
+        async with async_session_factory() as session, session.begin():
+            await session.execute(INSERT_CLASS_SQL, {
                 "class_id": class_id,
                 "name": data["name"],
                 "program_id": data["program_id"],
                 "teacher_id": data["teacher_id"]
             })
-            await session.commit()
+        await invalidate_teacher_classes(data["teacher_id"])
         return {"success": True, "class_id": class_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Deletes the class and its enrollments only when it has no attendance sessions,
+# and reports the session count either way (FK checks run at statement end)
+DELETE_CLASS_SQL = text("""
+    WITH sessions AS (
+        SELECT COUNT(*) AS session_count FROM attendance_sessions WHERE class_id = :class_id
+    ),
+    del_enrollments AS (
+        DELETE FROM class_enrollments
+        WHERE class_id = :class_id AND (SELECT session_count FROM sessions) = 0
+    ),
+    del_class AS (
+        DELETE FROM classes
+        WHERE class_id = :class_id AND (SELECT session_count FROM sessions) = 0
+        RETURNING teacher_id
+    )
+    SELECT session_count, (SELECT teacher_id::text FROM del_class) FROM sessions
+""")
+
+
 @router.delete("/api/classes/{class_id}")
 async def delete_class(class_id: str):
     """Delete a class (including any enrollments)."""
     try:
-        async with async_session_factory() as session:
-            # Check for attendance sessions
-            result = await session.execute(text(
-                "SELECT COUNT(*) FROM attendance_sessions WHERE class_id = :class_id"
-            ), {"class_id": class_id})
-            session_count = result.scalar()
+        async with async_session_factory() as session, session.begin():
+            # Check for attendance sessions and delete in one round trip
+            result = await session.execute(DELETE_CLASS_SQL, {"class_id": class_id})
+            session_count, teacher_id = result.one()
             
             if session_count > 0:
                 raise HTTPException(
                     status_code=400, 
                     detail=f"Cannot delete class with {session_count} attendance sessions. Archive it instead."
                 )
-            
-            # Delete enrollments first
-            await session.execute(text(
-                "DELETE FROM class_enrollments WHERE class_id = :class_id"
-            ), {"class_id": class_id})
-            
-            # Delete the class
-            await session.execute(text(
-                "DELETE FROM classes WHERE class_id = :class_id"
-            ), {"class_id": class_id})
-            await session.commit()
         
+        if teacher_id:
+            await invalidate_teacher_classes(teacher_id)
         return {"success": True}
     except HTTPException:
         raise
@@ -1140,8 +1406,6 @@ async def get_allowances(filter_date: Optional[str] = None, user_type: Optional[
     from datetime import datetime as dt
     
     try:
-        results = []
-        
         # Convert filter_date string to date object if provided
         date_filter = None
         if filter_date:
@@ -1150,77 +1414,43 @@ async def get_allowances(filter_date: Optional[str] = None, user_type: Optional[
             except ValueError:
                 raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
         
+        # Student and teacher allowances share one column list (NULL where a
+        # branch has no such column) so PostgreSQL can merge, sort and limit.
+        # Columns are cast to JSON-ready types so asyncpg decodes them natively.
+        branches = []
+        # Get student allowances (unless user_type is 'teacher')
+        if user_type != 'teacher':
+            branches.append("""
+                SELECT da.allowance_id::text, da.student_id::text as user_id, NULL::text as teacher_id,
+                       da.date::text, da.base_amount::float8, da.bonus_amount::float8,
+                       da.total_amount::float8, s.full_name,
+                       'student' as user_type, NULL::text as program_name
+                FROM daily_allowances da
+                JOIN students s ON da.student_id = s.student_id
+            """ + ("WHERE da.date = :filter_date" if date_filter else ""))
+        # Get teacher allowances (unless user_type is 'student')
+        if user_type != 'student':
+            branches.append("""
+                SELECT tda.allowance_id::text, tda.teacher_id::text as user_id, tda.teacher_id::text,
+                       tda.date::text, tda.base_amount::float8, tda.bonus_amount::float8,
+                       tda.total_amount::float8, t.full_name,
+                       'teacher' as user_type, COALESCE(p.name, 'N/A') as program_name
+                FROM teacher_daily_allowances tda
+                JOIN teachers t ON tda.teacher_id = t.teacher_id
+                LEFT JOIN programs p ON t.program_id = p.program_id
+            """ + ("WHERE tda.date = :filter_date" if date_filter else ""))
+        
+        # Same order the combined list always had: newest date first, names
+        # descending within a date (codepoint order, as the Python sort was).
+        query = f"""
+            SELECT * FROM ({" UNION ALL ".join(branches)}) u
+            ORDER BY date DESC, full_name COLLATE "C" DESC LIMIT 100
+        """
+        params = {"filter_date": date_filter} if date_filter else {}
+        
         async with async_session_factory() as session:
-            # Get student allowances (unless user_type is 'teacher')
-            if user_type != 'teacher':
-                if date_filter:
-                    result = await session.execute(text("""
-                        SELECT da.allowance_id, da.student_id as user_id, da.date, da.base_amount, 
-                               da.bonus_amount, da.total_amount, s.full_name, 'student' as user_type
-                        FROM daily_allowances da
-                        JOIN students s ON da.student_id = s.student_id
-                        WHERE da.date = :filter_date ORDER BY s.full_name
-                    """), {"filter_date": date_filter})
-                else:
-                    result = await session.execute(text("""
-                        SELECT da.allowance_id, da.student_id as user_id, da.date, da.base_amount, 
-                               da.bonus_amount, da.total_amount, s.full_name, 'student' as user_type
-                        FROM daily_allowances da
-                        JOIN students s ON da.student_id = s.student_id
-                        ORDER BY da.date DESC, s.full_name LIMIT 100
-                    """))
-                rows = result.fetchall()
-                columns = ["allowance_id", "user_id", "date", "base_amount", "bonus_amount", "total_amount", "full_name", "user_type"]
-                for row in rows:
-                    row_dict = dict(zip(columns, row))
-                    # Convert date to string for JSON serialization
-                    row_dict["date"] = str(row_dict["date"])
-                    row_dict["allowance_id"] = str(row_dict["allowance_id"])
-                    row_dict["user_id"] = str(row_dict["user_id"])
-                    row_dict["base_amount"] = float(row_dict["base_amount"])
-                    row_dict["bonus_amount"] = float(row_dict["bonus_amount"])
-                    row_dict["total_amount"] = float(row_dict["total_amount"])
-                    results.append(row_dict)
-            
-            # Get teacher allowances (unless user_type is 'student')
-            if user_type != 'student':
-                if date_filter:
-                    result = await session.execute(text("""
-                        SELECT tda.allowance_id, tda.teacher_id as user_id, tda.teacher_id, tda.date, tda.base_amount, 
-                               tda.bonus_amount, tda.total_amount, t.full_name, 'teacher' as user_type,
-                               COALESCE(p.name, 'N/A') as program_name
-                        FROM teacher_daily_allowances tda
-                        JOIN teachers t ON tda.teacher_id = t.teacher_id
-                        LEFT JOIN programs p ON t.program_id = p.program_id
-                        WHERE tda.date = :filter_date ORDER BY t.full_name
-                    """), {"filter_date": date_filter})
-                else:
-                    result = await session.execute(text("""
-                        SELECT tda.allowance_id, tda.teacher_id as user_id, tda.teacher_id, tda.date, tda.base_amount, 
-                               tda.bonus_amount, tda.total_amount, t.full_name, 'teacher' as user_type,
-                               COALESCE(p.name, 'N/A') as program_name
-                        FROM teacher_daily_allowances tda
-                        JOIN teachers t ON tda.teacher_id = t.teacher_id
-                        LEFT JOIN programs p ON t.program_id = p.program_id
-                        ORDER BY tda.date DESC, t.full_name LIMIT 100
-                    """))
-                rows = result.fetchall()
-                columns = ["allowance_id", "user_id", "teacher_id", "date", "base_amount", "bonus_amount", "total_amount", "full_name", "user_type", "program_name"]
-                for row in rows:
-                    row_dict = dict(zip(columns, row))
-                    # Convert types for JSON serialization
-                    row_dict["date"] = str(row_dict["date"])
-                    row_dict["allowance_id"] = str(row_dict["allowance_id"])
-                    row_dict["user_id"] = str(row_dict["user_id"])
-                    row_dict["teacher_id"] = str(row_dict["teacher_id"])
-                    row_dict["base_amount"] = float(row_dict["base_amount"])
-                    row_dict["bonus_amount"] = float(row_dict["bonus_amount"])
-                    row_dict["total_amount"] = float(row_dict["total_amount"])
-                    results.append(row_dict)
-            
-            # Sort combined results by date desc, then name
-            results.sort(key=lambda x: (x['date'], x['full_name']), reverse=True)
-            return results[:100]  # Limit to 100 total
+            result = await session.execute(text(query), params)
+            return [dict(row) for row in result.mappings()]
     except HTTPException:
         raise
     except Exception as e:
@@ -1229,6 +1459,16 @@ async def get_allowances(filter_date: Optional[str] = None, user_type: Optional[
         raise HTTPException(status_code=500, detail=str(e))
 
 
+UPSERT_ALLOWANCE_SQL = text("""
+    INSERT INTO daily_allowances (student_id, date, base_amount, bonus_amount, total_amount)
+    VALUES (:student_id, :date, :base, :bonus, :total)
+    ON CONFLICT (student_id, date) DO UPDATE SET
+        base_amount = EXCLUDED.base_amount,
+        bonus_amount = EXCLUDED.bonus_amount,
+        total_amount = EXCLUDED.total_amount
+""")
+
+
 @router.post("/api/allowances")
 async def set_allowance(data: dict):
     """Set allowance."""
@@ -1241,93 +1481,96 @@ async def set_allowance(data: dict):
             from datetime import date as date_type
             allowance_date = date_type.fromisoformat(allowance_date)
         
-        async with async_session_factory() as session:
-            result = await session.execute(text("""
-                SELECT allowance_id FROM daily_allowances 
-                WHERE student_id = :student_id AND date = :date
-            """), {"student_id": data["student_id"], "date": allowance_date})
-            existing = result.scalar()
-            
-            if existing:
-                await session.execute(text("""
-                    UPDATE daily_allowances SET base_amount=:base, bonus_amount=:bonus, total_amount=:total
-                    WHERE student_id=:student_id AND date=:date
-                """), {
-                    "base": base, "bonus": bonus, "total": base + bonus,
-                    "student_id": data["student_id"], "date": allowance_date
-                })
-            else:
-                await session.execute(text("""
-                    INSERT INTO daily_allowances (allowance_id, student_id, date, base_amount, bonus_amount, total_amount)
-                    VALUES (:allowance_id, :student_id, :date, :base, :bonus, :total)
-                """), {
-                    "allowance_id": str(uuid.uuid4()),
-                    "student_id": data["student_id"],
-                    "date": allowance_date,
-                    "base": base, "bonus": bonus, "total": base + bonus
-                })
-            await session.commit()
+        async with async_session_factory() as session, session.begin():
+            await session.execute(UPSERT_ALLOWANCE_SQL, {
+                "student_id": data["student_id"],
+                "date": allowance_date,
+                "base": base, "bonus": bonus, "total": base + bonus
+            })
         
+        await invalidate_cache(*DASHBOARD_CACHE_KEYS)
         return {"success": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+UPSERT_PROGRAM_ALLOWANCES_SQL = text("""
+    INSERT INTO daily_allowances (student_id, date, base_amount, bonus_amount, total_amount)
+    SELECT s.student_id, :date, :base, :bonus, :total
+    FROM students s
+    WHERE s.program_id = :program_id AND s.is_active = true
+    ON CONFLICT (student_id, date) DO UPDATE SET
+        base_amount = EXCLUDED.base_amount,
+        bonus_amount = EXCLUDED.bonus_amount,
+        total_amount = EXCLUDED.total_amount
+""")
+
+UPSERT_STUDENT_ALLOWANCES_SQL = text("""
+    INSERT INTO daily_allowances (student_id, date, base_amount, bonus_amount, total_amount)
+    SELECT s.student_id, :date, :base, :bonus, :total
+    FROM students s
+    WHERE s.student_id = ANY(CAST(:student_ids AS uuid[]))
+    ON CONFLICT (student_id, date) DO UPDATE SET
+        base_amount = EXCLUDED.base_amount,
+        bonus_amount = EXCLUDED.bonus_amount,
+        total_amount = EXCLUDED.total_amount
+""")
+
+
 @router.post("/api/allowances/bulk")
 async def bulk_allowances(data: dict):
-    """Set allowances for all students in a program."""
+    """Set allowances for all students in a program, or for an explicit student_ids list."""
     try:
         base = float(data["base_amount"])
         bonus = float(data.get("bonus_amount", 0))
-        count = 0
         # Convert date string to date object if needed
         allowance_date = data["date"]
         if isinstance(allowance_date, str):
             from datetime import date as date_type
             allowance_date = date_type.fromisoformat(allowance_date)
         
-        async with async_session_factory() as session:
-            result = await session.execute(text(
-                "SELECT student_id FROM students WHERE program_id = :program_id AND is_active = true"
-            ), {"program_id": data["program_id"]})
-            students = result.fetchall()
-            
-            for s in students:
-                student_id = s[0]
-                
-                result = await session.execute(text("""
-                    SELECT allowance_id FROM daily_allowances 
-                    WHERE student_id = :student_id AND date = :date
-                """), {"student_id": student_id, "date": allowance_date})
-                existing = result.scalar()
-                
-                if existing:
-                    await session.execute(text("""
-                        UPDATE daily_allowances SET base_amount=:base, bonus_amount=:bonus, total_amount=:total
-                        WHERE student_id=:student_id AND date=:date
-                    """), {
-                        "base": base, "bonus": bonus, "total": base + bonus,
-                        "student_id": student_id, "date": allowance_date
-                    })
-                else:
-                    await session.execute(text("""
-                        INSERT INTO daily_allowances (allowance_id, student_id, date, base_amount, bonus_amount, total_amount)
-                        VALUES (:allowance_id, :student_id, :date, :base, :bonus, :total)
-                    """), {
-                        "allowance_id": str(uuid.uuid4()),
-                        "student_id": student_id,
-                        "date": allowance_date,
-                        "base": base, "bonus": bonus, "total": base + bonus
-                    })
-                count += 1
-            
-            await session.commit()
+        params = {
+            "date": allowance_date,
+            "base": base, "bonus": bonus, "total": base + bonus
+        }
         
+        async with async_session_factory() as session, session.begin():
+            # One UPSERT for the whole set (uq_student_date); an explicit list is
+            # bound as a single uuid[] parameter rather than one row per student
+            student_ids = data.get("student_ids")
+            if student_ids:
+                result = await session.execute(UPSERT_STUDENT_ALLOWANCES_SQL, {
+                    **params, "student_ids": student_ids
+                })
+            else:
+                result = await session.execute(UPSERT_PROGRAM_ALLOWANCES_SQL, {
+                    **params, "program_id": data["program_id"]
+                })
+            count = result.rowcount
+        
+        await invalidate_cache(*DASHBOARD_CACHE_KEYS)
         return {"success": True, "count": count}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+ADD_STUDENT_SUPPLEMENT_SQL = text("""
+    INSERT INTO daily_allowances (student_id, date, base_amount, bonus_amount, total_amount)
+    VALUES (:target_id, :date, 0, :bonus, :bonus)
+    ON CONFLICT (student_id, date) DO UPDATE SET
+        bonus_amount = daily_allowances.bonus_amount + EXCLUDED.bonus_amount,
+        total_amount = daily_allowances.base_amount + daily_allowances.bonus_amount + EXCLUDED.bonus_amount
+""")
+
+ADD_TEACHER_SUPPLEMENT_SQL = text("""
+    INSERT INTO teacher_daily_allowances (teacher_id, date, base_amount, bonus_amount, total_amount)
+    VALUES (:target_id, :date, 0, :bonus, :bonus)
+    ON CONFLICT (teacher_id, date) DO UPDATE SET
+        bonus_amount = teacher_daily_allowances.bonus_amount + EXCLUDED.bonus_amount,
+        total_amount = teacher_daily_allowances.base_amount + teacher_daily_allowances.bonus_amount + EXCLUDED.bonus_amount
+""")
+
+
 @router.post("/api/supplements")
 async def add_supplement(data: dict):
     """
@@ -1346,69 +1589,18 @@ async def add_supplement(data: dict):
         if isinstance(supplement_date, str):
             supplement_date = date_type.fromisoformat(supplement_date)
         
-        async with async_session_factory() as session:
+        # Add to the existing bonus, or create a supplement-only allowance
+        params = {
+            "target_id": target_id,
+            "date": supplement_date,
+            "bonus": supplement_amount
+        }
+        
+        async with async_session_factory() as session, session.begin():
             if target_type == "student":
-                # Check if allowance exists for this date
-                result = await session.execute(text("""
-                    SELECT allowance_id, base_amount, bonus_amount 
-                    FROM daily_allowances 
-                    WHERE student_id = :target_id AND date = :date
-                """), {"target_id": target_id, "date": supplement_date})
-                existing = result.fetchone()
-                
-                if existing:
-                    new_bonus = float(existing[2]) + supplement_amount
-                    new_total = float(existing[1]) + new_bonus
-                    await session.execute(text("""
-                        UPDATE daily_allowances 
-                        SET bonus_amount = :bonus, total_amount = :total
-                        WHERE student_id = :target_id AND date = :date
-                    """), {
-                        "bonus": new_bonus, "total": new_total,
-                        "target_id": target_id, "date": supplement_date
-                    })
-                else:
-                    # Create new allowance with supplement only
-                    await session.execute(text("""
-                        INSERT INTO daily_allowances (allowance_id, student_id, date, base_amount, bonus_amount, total_amount)
-                        VALUES (:allowance_id, :target_id, :date, 0, :bonus, :bonus)
-                    """), {
-                        "allowance_id": str(uuid.uuid4()),
-                        "target_id": target_id,
-                        "date": supplement_date,
-                        "bonus": supplement_amount
-                    })
+                await session.execute(ADD_STUDENT_SUPPLEMENT_SQL, params)
             else:  # teacher
-                result = await session.execute(text("""
-                    SELECT allowance_id, base_amount, bonus_amount 
-                    FROM teacher_daily_allowances 
-                    WHERE teacher_id = :target_id AND date = :date
-                """), {"target_id": target_id, "date": supplement_date})
-                existing = result.fetchone()
-                
-                if existing:
-                    new_bonus = float(existing[2]) + supplement_amount
-                    new_total = float(existing[1]) + new_bonus
-                    await session.execute(text("""
-                        UPDATE teacher_daily_allowances 
-                        SET bonus_amount = :bonus, total_amount = :total
-                        WHERE teacher_id = :target_id AND date = :date
-                    """), {
-                        "bonus": new_bonus, "total": new_total,
-                        "target_id": target_id, "date": supplement_date
-                    })
-                else:
-                    await session.execute(text("""
-                        INSERT INTO teacher_daily_allowances (allowance_id, teacher_id, date, base_amount, bonus_amount, total_amount)
-                        VALUES (:allowance_id, :target_id, :date, 0, :bonus, :bonus)
-                    """), {
-                        "allowance_id": str(uuid.uuid4()),
-                        "target_id": target_id,
-                        "date": supplement_date,
-                        "bonus": supplement_amount
-                    })
-            
-            await session.commit()
+                await session.execute(ADD_TEACHER_SUPPLEMENT_SQL, params)
         
         return {"success": True, "message": f"Supplement of {supplement_amount} SAR added"}
     except Exception as e:
@@ -1440,12 +1632,13 @@ async def get_all_attendance(
                 p.program_id,
                 asess.date as attendance_date,
                 asess.session_id,
-                asess.created_by as teacher_user_id
+                COALESCE(t.full_name, 'Unknown') as teacher_name
             FROM attendance_records ar
             JOIN attendance_sessions asess ON ar.session_id = asess.session_id
             JOIN students s ON ar.student_id = s.student_id
             JOIN classes c ON asess.class_id = c.class_id
             JOIN programs p ON c.program_id = p.program_id
+            LEFT JOIN teachers t ON asess.created_by = t.user_id
             WHERE 1=1
         """
         params = {}
@@ -1469,40 +1662,12 @@ async def get_all_attendance(
         query += " ORDER BY ar.scanned_at DESC LIMIT 500"
         
         async with async_session_factory() as session:
-            result = await session.execute(text(query), params)
-            records = result.fetchall()
-            
-            # Get teacher names
-            teacher_ids = list(set([str(r[12]) for r in records if r[12]]))
-            teacher_names = {}
-            
-            if teacher_ids and mongodb.db is not None:
-                teachers = await mongodb.db.users.find(
-                    {"user_id": {"$in": teacher_ids}}
-                ).to_list(length=100)
-                teacher_names = {t["user_id"]: t.get("full_name", t.get("name", "Unknown")) for t in teachers}
+            # Server-side cursor: rows are consumed as they arrive instead of
+            # being buffered in full first
+            result = await session.stream(text(query), params)
+            records = [dict(row) async for row in result.mappings()]
         
-        return {
-            "records": [
-                {
-                    "record_id": str(r[0]),
-                    "scanned_at": r[1].isoformat() if r[1] else None,
-                    "status": r[2],
-                    "scanned_by": str(r[3]) if r[3] else None,
-                    "student_name": r[4],
-                    "student_id": str(r[5]),
-                    "class_name": r[6],
-                    "class_id": str(r[7]),
-                    "program_name": r[8],
-                    "program_id": str(r[9]),
-                    "attendance_date": str(r[10]),
-                    "session_id": str(r[11]),
-                    "teacher_name": teacher_names.get(str(r[12]), "Unknown") if r[12] else "Unknown"
-                }
-                for r in records
-            ],
-            "total": len(records)
-        }
+        return {"records": records, "total": len(records)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1511,46 +1676,50 @@ async def get_all_attendance(
 async def get_attendance_summary(program_id: Optional[str] = None):
     """Get attendance summary by class and date."""
     try:
-        query = """
-            SELECT 
-                c.class_id,
-                c.name as class_name,
-                p.name as program_name,
-                asess.date as attendance_date,
-                COUNT(ar.record_id) as present_count,
-                (SELECT COUNT(*) FROM class_enrollments ce WHERE ce.class_id = c.class_id) as enrolled_count
-            FROM classes c
-            JOIN programs p ON c.program_id = p.program_id
-            LEFT JOIN attendance_sessions asess ON c.class_id = asess.class_id
-            LEFT JOIN attendance_records ar ON asess.session_id = ar.session_id
-            WHERE asess.date IS NOT NULL
-        """
+        # Count attendance per (class, date) first on the narrow session/record
+        # tables, then join the descriptive columns onto the aggregated rows
+        program_filter = ""
         params = {}
         
         if program_id:
-            query += " AND p.program_id = :program_id"
+            program_filter = "AND asess.class_id IN (SELECT class_id FROM classes WHERE program_id = :program_id)"
             params["program_id"] = program_id
         
-        query += """
-            GROUP BY c.class_id, c.name, p.name, asess.date
-            ORDER BY asess.date DESC, c.name
+        query = f"""
+            WITH per_day AS (
+                SELECT asess.class_id, asess.date, COUNT(ar.record_id) as present_count
+                FROM attendance_sessions asess
+                LEFT JOIN attendance_records ar ON ar.session_id = asess.session_id
+                WHERE asess.date IS NOT NULL {program_filter}
+                GROUP BY asess.class_id, asess.date
+            )
+            SELECT 
+                c.class_id,
+                c.name as class_name,
+                p.name as program_name,
+                pd.date,
+                pd.present_count,
+                COALESCE(enr.enrolled_count, 0) as enrolled_count
+            FROM per_day pd
+            JOIN classes c ON c.class_id = pd.class_id
+            JOIN programs p ON c.program_id = p.program_id
+            LEFT JOIN (
+                SELECT class_id, COUNT(*) as enrolled_count
+                FROM class_enrollments GROUP BY class_id
+            ) enr ON enr.class_id = c.class_id
+            ORDER BY pd.date DESC, c.name
             LIMIT 100
         """
         
         async with async_session_factory() as session:
             result = await session.execute(text(query), params)
-            rows = result.fetchall()
+            rows = result.mappings().all()
         
         return {
             "summary": [
                 {
-                    "class_id": str(r[0]),
-                    "class_name": r[1],
-                    "program_name": r[2],
-                    "date": str(r[3]),
-                    "present_count": r[4],
-                    "enrolled_count": r[5],
-                    "attendance_rate": round((r[4] / r[5] * 100) if r[5] > 0 else 0, 1)
+                    **r,
+                    "attendance_rate": round((r["present_count"] / r["enrolled_count"] * 100) if r["enrolled_count"] > 0 else 0, 1)
                 }
                 for r in rows
             ]
@@ -1587,19 +1756,33 @@ def parse_bulk_upload_error(error_str: str, email: str = "") -> str:
     # Return original if no match
     return error_str
 
-def try_decode_csv(content: bytes) -> str:
-    """Try multiple encodings to decode CSV content."""
+def read_csv_upload(upload) -> tuple:
+    """
+    Parse CSV rows straight from the spooled upload file, trying multiple encodings.
+    Returns the reader (for its fieldnames) and the rows.
+    """
     # Try encodings in order of likelihood
     encodings = ['utf-8-sig', 'utf-8', 'latin-1', 'cp1252', 'iso-8859-1']
     
     for encoding in encodings:
+        upload.seek(0)
+        stream = io.TextIOWrapper(upload, encoding=encoding, newline="")
         try:
-            return content.decode(encoding)
+            reader = csv.DictReader(stream)
+            return reader, list(reader)
         except (UnicodeDecodeError, LookupError):
             continue
+        finally:
+            # Leave the upload file itself open
+            stream.detach()
     
     # Last resort: decode with errors='replace'
-    return content.decode('utf-8', errors='replace')
+    upload.seek(0)
+    stream = io.TextIOWrapper(upload, encoding='utf-8', errors='replace', newline="")
+    reader = csv.DictReader(stream)
+    rows = list(reader)
+    stream.detach()
+    return reader, rows
 
 def validate_csv_columns(reader, required_columns: list) -> tuple:
     """Validate that required columns exist in CSV."""
@@ -1620,22 +1803,191 @@ def validate_csv_columns(reader, required_columns: list) -> tuple:
     return True, None
 
 
+# Documents per insert_many call; keeps each batch well under the 16MB BSON limit
+BULK_INSERT_CHUNK = 1000
+
+
+async def insert_user_docs(user_docs: list) -> dict:
+    """Insert user documents in unordered batches. Returns {user_id: write error} for rejected docs."""
+    failed = {}
+    docs = iter(user_docs)
+    while chunk := list(islice(docs, BULK_INSERT_CHUNK)):
+        try:
+            await mongodb.db.users.insert_many(chunk, ordered=False)
+        except BulkWriteError as bwe:
+            for write_error in bwe.details.get("writeErrors", []):
+                failed[chunk[write_error["index"]]["_id"]] = write_error
+    return failed
+
+
+# Imports with at least this many rows COPY their PostgreSQL rows instead of INSERTing them
+BULK_COPY_THRESHOLD = 5000
+
+STUDENT_COPY_COLUMNS = ("student_id", "user_id", "full_name", "phone_number", "program_id", "is_active")
+
+TEACHER_COPY_COLUMNS = ("teacher_id", "user_id", "full_name", "program_id", "is_active", "created_at")
+
+DELETE_UPLOADED_ROWS_SQL = {
+    "students": text("DELETE FROM students WHERE user_id = ANY(CAST(:user_ids AS uuid[]))"),
+    "teachers": text("DELETE FROM teachers WHERE user_id = ANY(CAST(:user_ids AS uuid[]))"),
+}
+
+
+# Errors that send a bulk upload to the per-row fallback. COPY runs on the raw
+# asyncpg connection, so its failures arrive unwrapped by SQLAlchemy.
+BULK_WRITE_ERRORS = (DBAPIError, PostgresError)
+
+
+async def copy_records(session, table: str, columns: tuple, records: list) -> None:
+    """COPY records into table over the session's asyncpg connection (inside its transaction)."""
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(table, records=records, columns=columns)
+
+
+async def write_with_user_docs(session, table: str, write, user_docs: list) -> dict:
+    """
+    Await a PostgreSQL write while the matching user documents are inserted.
+    Returns {user_id: write error} for rejected docs; their rows are deleted again in the same transaction.
+    """
+    failed, written = await asyncio.gather(insert_user_docs(user_docs), write, return_exceptions=True)
+    for outcome in (failed, written):
+        if isinstance(outcome, Exception):
+            raise outcome
+    
+    if failed:
+        await session.execute(DELETE_UPLOADED_ROWS_SQL[table], {"user_ids": list(failed)})
+    return failed
+
+
+async def write_student_batch(session, batch: list) -> dict:
+    """Write a batch of uploaded students and their class enrollments."""
+    student_rows = [p["sql_row"] for p in batch]
+    if len(batch) >= BULK_COPY_THRESHOLD:
+        write = copy_records(session, "students", STUDENT_COPY_COLUMNS, [
+            (*row.values(), True) for row in student_rows
+        ])
+    else:
+        write = session.execute(INSERT_STUDENT_SQL, student_rows)
+    failed = await write_with_user_docs(session, "students", write, [p["user_doc"] for p in batch])
+    
+    # Enroll in class if class_id provided
+    enrollment_rows = [
+        {"class_id": p["class_id"], "student_id": p["sql_row"]["student_id"]}
+        for p in batch if p["class_id"] and p["sql_row"]["user_id"] not in failed
+    ]
+    if enrollment_rows:
+        await session.execute(UPSERT_ENROLLMENT_SQL, enrollment_rows)
+    return failed
+
+
+async def write_teacher_batch(session, batch: list) -> dict:
+    """Write a batch of uploaded teachers."""
+    if len(batch) >= BULK_COPY_THRESHOLD:
+        now = datetime.now(timezone.utc)
+        write = copy_records(session, "teachers", TEACHER_COPY_COLUMNS, [
+            (*p["sql_row"].values(), True, now) for p in batch
+        ])
+    else:
+        write = session.execute(INSERT_TEACHER_SQL, [p["sql_row"] for p in batch])
+    return await write_with_user_docs(session, "teachers", write, [p["user_doc"] for p in batch])
+
+
+async def store_user_batch(session, batch: list, write_batch, errors: list) -> int:
+    """Write a batch to MongoDB and PostgreSQL under a savepoint; returns how many were created."""
+    try:
+        async with session.begin_nested():
+            failed = await write_batch(session, batch)
+    except Exception:
+        # The savepoint rolled back; remove the documents written alongside it
+        await mongodb.db.users.delete_many({"_id": {"$in": [p["user_doc"]["_id"] for p in batch]}})
+        raise
+    
+    for p in batch:
+        user_id = p["user_doc"]["_id"]
+        if user_id in failed:
+            # 11000: the unique email index caught a user created since the upfront check
+            errors.append({
+                "row": p["row"],
+                "row_num": p["row_num"],
+                "error": parse_bulk_upload_error(failed[user_id]["errmsg"], p["email"]),
+                "type": "duplicate" if failed[user_id].get("code") == 11000 else "error"
+            })
+    return len(batch) - len(failed)
+
+
+async def store_bulk_users(pending: list, write_batch, errors: list) -> int:
+    """
+    Store validated upload rows as a single batch on one session.
+    If PostgreSQL rejects the batch, retry row by row so the failing rows can be reported.
+    """
+    if not pending:
+        return 0
+    
+    try:
+        async with async_session_factory() as session, session.begin():
+            try:
+                return await store_user_batch(session, pending, write_batch, errors)
+            except BULK_WRITE_ERRORS:
+                pass
+            
+            created = 0
+            for p in pending:
+                try:
+                    created += await store_user_batch(session, [p], write_batch, errors)
+                except Exception as e:
+                    errors.append({
+                        "row": p["row"],
+                        "row_num": p["row_num"],
+                        "error": parse_bulk_upload_error(str(e), p["email"]),
+                        "type": "error"
+                    })
+            return created
+    except Exception:
+        # The transaction did not commit; none of the rows were kept
+        await mongodb.db.users.delete_many({"_id": {"$in": [p["user_doc"]["_id"] for p in pending]}})
+        raise
+
+
+async def stream_bulk_upload(pending: list, write_batch, errors: list, skipped: list):
+    """
+    NDJSON progress for a bulk upload: the validation results as soon as the file
+    has been checked, then the outcome of the write.
+    """
+    yield orjson.dumps({
+        "stage": "validated",
+        "valid": len(pending),
+        "errors": errors,
+        "skipped": skipped
+    }) + b"\n"
+    
+    store_errors = []
+    try:
+        created = await store_bulk_users(pending, write_batch, store_errors)
+        await invalidate_cache(*DASHBOARD_CACHE_KEYS)
+    except Exception as e:
+        yield orjson.dumps({"stage": "error", "error": str(e)}) + b"\n"
+        return
+    yield orjson.dumps({"stage": "stored", "created": created, "errors": store_errors}) + b"\n"
+
+
 @router.post("/api/bulk/students")
 async def bulk_upload_students(
     file: UploadFile = File(...), 
     program_id: str = Form(...),
-    class_id: Optional[str] = Form(None)
+    class_id: Optional[str] = Form(None),
+    stream: bool = Form(False)
 ):
-    """Bulk upload students from CSV. Optionally enroll all in a class."""
+    """
+    Bulk upload students from CSV. Optionally enroll all in a class.
+    With stream=true the result is sent as NDJSON progress lines.
+    """
     try:
         if mongodb.db is None:
             raise HTTPException(status_code=503, detail="MongoDB not connected")
             
-        content = await file.read()
-        
-        # Try multiple encodings
-        decoded_content = try_decode_csv(content)
-        reader = csv.DictReader(io.StringIO(decoded_content))
+        # Parse from the spooled file without holding the raw and decoded copies in memory
+        reader, rows = await asyncio.to_thread(read_csv_upload, file.file)
         
         # Validate required columns
         required_cols = ["full_name", "email"]
@@ -1649,13 +2001,20 @@ async def bulk_upload_students(
                 "message": error_msg
             }
         
-        # Reset reader to start
-        reader = csv.DictReader(io.StringIO(decoded_content))
+        # One lookup for every email in the file that is already registered
+        emails = list({(row.get("email") or "").strip() for row in rows} - {""})
+        seen_emails = {
+            user["email"] async for user in mongodb.db.users.find({"email": {"$in": emails}}, {"email": 1})
+        }
         
-        created, errors, skipped = 0, [], []
+        errors, skipped = [], []
+        pending = []
         row_num = 1  # Start at 1 for data rows (after header)
         
-        for row in reader:
+        # Every uploaded account starts with the same temporary password; hash it once
+        password_hash = await hash_password_async("temp123")
+        
+        for row in rows:
             row_num += 1
             row_identifier = row.get("email", "").strip() or row.get("full_name", "").strip() or f"Row {row_num}"
             
@@ -1684,9 +2043,8 @@ async def bulk_upload_students(
                     })
                     continue
                 
-                # Check if email already exists
-                existing_user = await mongodb.db.users.find_one({"email": email})
-                if existing_user:
+                # Check if email already exists (in the database or earlier in this file)
+                if email in seen_emails:
                     skipped.append({
                         "row": row_identifier,
                         "row_num": row_num,
@@ -1709,56 +2067,42 @@ async def bulk_upload_students(
                     phone_number = result
                 
                 user_id = str(uuid.uuid4())
-                student_id = str(uuid.uuid4())
-                password_hash = hash_password("temp123")
                 
                 # Check if CSV row has a class_id column (overrides form class_id)
                 row_class_id = row.get("class_id", "").strip() or class_id
                 
-                await mongodb.db.users.insert_one({
-                    "_id": user_id,
-                    "user_id": user_id,
+                seen_emails.add(email)
+                pending.append({
+                    "row": row_identifier,
+                    "row_num": row_num,
                     "email": email,
-                    "name": full_name,
-                    "full_name": full_name,
-                    "role": "student",
-                    "status": "active",
-                    "auth": {
-                        "password_hash": password_hash,
-                        "password_last_changed": datetime.utcnow()
+                    "user_doc": {
+                        "_id": user_id,
+                        "user_id": user_id,
+                        "email": email,
+                        "name": full_name,
+                        "full_name": full_name,
+                        "role": "student",
+                        "status": "active",
+                        "auth": {
+                            "password_hash": password_hash,
+                            "password_last_changed": datetime.utcnow()
+                        },
+                        "associations": {"program_id": program_id},
+                        "metadata": {
+                            "created_at": datetime.utcnow(),
+                            "updated_at": datetime.utcnow()
+                        }
                     },
-                    "associations": {"program_id": program_id},
-                    "metadata": {
-                        "created_at": datetime.utcnow(),
-                        "updated_at": datetime.utcnow()
-                    }
-                })
-                
-                async with async_session_factory() as session:
-                    await session.execute(text("""
-                        INSERT INTO students (student_id, user_id, full_name, phone_number, program_id, is_active)
-                        VALUES (:student_id, :user_id, :full_name, :phone_number, :program_id, true)
-                    """), {
-                        "student_id": student_id,
+                    "sql_row": {
+                        "student_id": str(uuid.uuid4()),
                         "user_id": user_id,
                         "full_name": full_name,
                         "phone_number": phone_number or None,
                         "program_id": program_id
-                    })
-                    
-                    # Enroll in class if class_id provided
-                    if row_class_id:
-                        await session.execute(text("""
-                            INSERT INTO class_enrollments (class_id, student_id)
-                            VALUES (:class_id, :student_id)
-                            ON CONFLICT (class_id, student_id) DO NOTHING
-                        """), {
-                            "class_id": row_class_id,
-                            "student_id": student_id
-                        })
-                    
-                    await session.commit()
-                created += 1
+                    },
+                    "class_id": row_class_id
+                })
                 
             except KeyError as e:
                 errors.append({
@@ -1775,6 +2119,16 @@ async def bulk_upload_students(
                     "type": "error"
                 })
         
+        if stream:
+            return StreamingResponse(
+                stream_bulk_upload(pending, write_student_batch, errors, skipped),
+                media_type="application/x-ndjson"
+            )
+        
+        # MongoDB and PostgreSQL take the batch concurrently, in one transaction
+        created = await store_bulk_users(pending, write_student_batch, errors)
+        await invalidate_cache(*DASHBOARD_CACHE_KEYS)
+        
         # Build summary message
         total_processed = created + len(errors) + len(skipped)
         message_parts = [f"Processed {total_processed} rows:"]
@@ -1802,17 +2156,21 @@ async def bulk_upload_students(
 
 
 @router.post("/api/bulk/teachers")
-async def bulk_upload_teachers(file: UploadFile = File(...), program_id: str = Form(...)):
-    """Bulk upload teachers from CSV."""
+async def bulk_upload_teachers(
+    file: UploadFile = File(...),
+    program_id: str = Form(...),
+    stream: bool = Form(False)
+):
+    """
+    Bulk upload teachers from CSV.
+    With stream=true the result is sent as NDJSON progress lines.
+    """
     try:
         if mongodb.db is None:
             raise HTTPException(status_code=503, detail="MongoDB not connected")
             
-        content = await file.read()
-        
-        # Try multiple encodings
-        decoded_content = try_decode_csv(content)
-        reader = csv.DictReader(io.StringIO(decoded_content))
+        # Parse from the spooled file without holding the raw and decoded copies in memory
+        reader, rows = await asyncio.to_thread(read_csv_upload, file.file)
         
         # Validate required columns
         required_cols = ["full_name", "email"]
@@ -1826,13 +2184,20 @@ async def bulk_upload_teachers(file: UploadFile = File(...), program_id: str = F
                 "message": error_msg
             }
         
-        # Reset reader to start
-        reader = csv.DictReader(io.StringIO(decoded_content))
+        # One lookup for every email in the file that is already registered
+        emails = list({(row.get("email") or "").strip() for row in rows} - {""})
+        seen_emails = {
+            user["email"] async for user in mongodb.db.users.find({"email": {"$in": emails}}, {"email": 1})
+        }
         
-        created, errors, skipped = 0, [], []
+        errors, skipped = [], []
+        pending = []
         row_num = 1
         
-        for row in reader:
+        # Every uploaded account starts with the same temporary password; hash it once
+        password_hash = await hash_password_async("temp123")
+        
+        for row in rows:
             row_num += 1
             row_identifier = row.get("email", "").strip() or row.get("full_name", "").strip() or f"Row {row_num}"
             
@@ -1860,9 +2225,8 @@ async def bulk_upload_teachers(file: UploadFile = File(...), program_id: str = F
                     })
                     continue
                 
-                # Check if email already exists
-                existing_user = await mongodb.db.users.find_one({"email": email})
-                if existing_user:
+                # Check if email already exists (in the database or earlier in this file)
+                if email in seen_emails:
                     skipped.append({
                         "row": row_identifier,
                         "row_num": row_num,
@@ -1872,39 +2236,37 @@ async def bulk_upload_teachers(file: UploadFile = File(...), program_id: str = F
                     continue
                 
                 user_id = str(uuid.uuid4())
-                password_hash = hash_password("temp123")
                 
-                await mongodb.db.users.insert_one({
-                    "_id": user_id,
-                    "user_id": user_id,
+                seen_emails.add(email)
+                pending.append({
+                    "row": row_identifier,
+                    "row_num": row_num,
                     "email": email,
-                    "name": full_name,
-                    "full_name": full_name,
-                    "role": "teacher",
-                    "status": "active",
-                    "auth": {
-                        "password_hash": password_hash,
-                        "password_last_changed": datetime.utcnow()
+                    "user_doc": {
+                        "_id": user_id,
+                        "user_id": user_id,
+                        "email": email,
+                        "name": full_name,
+                        "full_name": full_name,
+                        "role": "teacher",
+                        "status": "active",
+                        "auth": {
+                            "password_hash": password_hash,
+                            "password_last_changed": datetime.utcnow()
+                        },
+                        "associations": {},
+                        "metadata": {
+                            "created_at": datetime.utcnow(),
+                            "updated_at": datetime.utcnow()
+                        }
                     },
-                    "associations": {},
-                    "metadata": {
-                        "created_at": datetime.utcnow(),
-                        "updated_at": datetime.utcnow()
-                    }
-                })
-                
-                async with async_session_factory() as session:
-                    await session.execute(text("""
-                        INSERT INTO teachers (teacher_id, user_id, full_name, program_id, is_active, created_at)
-                        VALUES (:teacher_id, :user_id, :full_name, :program_id, true, NOW())
-                    """), {
+                    "sql_row": {
                         "teacher_id": str(uuid.uuid4()),
                         "user_id": user_id,
                         "full_name": full_name,
                         "program_id": program_id
-                    })
-                    await session.commit()
-                created += 1
+                    }
+                })
                 
             except KeyError as e:
                 errors.append({
@@ -1921,6 +2283,16 @@ async def bulk_upload_teachers(file: UploadFile = File(...), program_id: str = F
                     "type": "error"
                 })
         
+        if stream:
+            return StreamingResponse(
+                stream_bulk_upload(pending, write_teacher_batch, errors, skipped),
+                media_type="application/x-ndjson"
+            )
+        
+        # MongoDB and PostgreSQL take the batch concurrently, in one transaction
+        created = await store_bulk_users(pending, write_teacher_batch, errors)
+        await invalidate_cache(*DASHBOARD_CACHE_KEYS)
+        
         # Build summary message
         total_processed = created + len(errors) + len(skipped)
         message_parts = [f"Processed {total_processed} rows:"]
@@ -1949,6 +2321,35 @@ async def bulk_upload_teachers(file: UploadFile = File(...), program_id: str = F
 
 # ==================== AUTH ====================
 
+# Recently verified admin tokens -> email. Kept short so a session that
+# expires in Redis stops verifying within 30 seconds.
+_session_cache = TTLCache(maxsize=10000, ttl=30)
+
+# Checked against when the email is unknown, so a failed lookup costs the same
+# bcrypt round as a wrong password
+_DUMMY_HASH = hash_password("dummy-constant")
+
+# In-flight background session writes, referenced so they are not garbage collected
+_background_tasks: set = set()
+
+# Only what admin_login reads from the user document
+ADMIN_LOGIN_PROJECTION = {
+    "auth.password_hash": 1,
+    "password_hash": 1,
+    "status": 1,
+    "is_active": 1,
+    "name": 1,
+    "full_name": 1
+}
+
+async def store_admin_session(token: str, email: str, ttl: int) -> None:
+    """Persist an admin session to Redis, logging instead of raising on failure."""
+    try:
+        await redis_client.set_admin_session(token, email, ttl)
+    except Exception as e:
+        audit_log.error("admin_session_store_failed", str(e), actor_role="admin", details={"email": email})
+
+
 @router.post("/api/auth/login")
 async def admin_login(data: dict):
     """Admin login."""
@@ -1959,9 +2360,10 @@ async def admin_login(data: dict):
         user = await mongodb.db.users.find_one({
             "email": data.get("email"),
             "role": "admin"
-        })
+        }, ADMIN_LOGIN_PROJECTION)
         
         if not user:
+            await verify_password_async(data.get("password", ""), _DUMMY_HASH)
             raise HTTPException(status_code=401, detail="Invalid credentials")
         
         # Check if user is active (handle both old 'is_active' and new 'status' field)
@@ -1972,13 +2374,17 @@ async def admin_login(data: dict):
         # Get password hash from nested auth object or top level
         stored_hash = user.get("auth", {}).get("password_hash") if "auth" in user else user.get("password_hash")
         
-        if not stored_hash or not verify_password(data.get("password", ""), stored_hash):
+        if not stored_hash or not await verify_password_async(data.get("password", ""), stored_hash):
             raise HTTPException(status_code=401, detail="Invalid credentials")
         
         token = str(uuid.uuid4())
         
         if redis_client.client is not None:
-            await redis_client.client.setex(f"admin_session:{token}", 86400, data.get("email"))
+            # This worker can verify the token straight away; Redis is written in the background
+            _session_cache[token] = data.get("email")
+            task = asyncio.create_task(store_admin_session(token, data.get("email"), 86400))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
         
         return {
             "success": True,
@@ -1996,10 +2402,16 @@ async def admin_login(data: dict):
 async def verify_session(token: str):
     """Verify admin session."""
     try:
+        email = _session_cache.get(token)
+        if email:
+            return {"valid": True, "email": email}
+        
         if redis_client.client is not None:
-            email = await redis_client.client.get(f"admin_session:{token}")
+            email = await redis_client.get_admin_session(token)
             if email:
-                return {"valid": True, "email": email if isinstance(email, str) else email.decode()}
+                email = email if isinstance(email, str) else email.decode()
+                _session_cache[token] = email
+                return {"valid": True, "email": email}
         return {"valid": False}
     except:
         return {"valid": False}
@@ -2017,7 +2429,6 @@ async def cron_reset_allowances(secret: str = None):
     For security, pass a secret key matching the CRON_SECRET environment variable.
     """
     import os
-    from decimal import Decimal
     from datetime import date
     from app.services.allowance_service import AllowanceService
     from app.db.redis import redis_client as redis
@@ -2029,10 +2440,9 @@ async def cron_reset_allowances(secret: str = None):
         raise HTTPException(status_code=403, detail="Invalid cron secret")
     
     try:
-        async with async_session_factory() as session:
+        async with async_session_factory() as session, session.begin():
             service = AllowanceService(session, redis)
             result = await service.reset_program_allowances(admin_id="system")
-            await session.commit()
             
             return {
                 "success": True,
@@ -2043,6 +2453,13 @@ async def cron_reset_allowances(secret: str = None):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+ALLOWANCES_SET_TODAY_SQL = text("""
+    SELECT
+        (SELECT COUNT(*) FROM daily_allowances WHERE date = :today) AS student_count,
+        (SELECT COUNT(*) FROM teacher_daily_allowances WHERE date = :today) AS teacher_count
+""")
+
+
 @router.get("/api/cron/status")
 async def cron_status():
     """Check if daily allowance reset was run today."""
@@ -2051,17 +2468,10 @@ async def cron_status():
     try:
         today = date.today()
         today_str = str(today)
-        async with async_session_factory() as session:
-            # Check if any allowances were reset today
-            result = await session.execute(text("""
-                SELECT COUNT(*) FROM daily_allowances WHERE date = :today
-            """), {"today": today})
-            student_count = result.scalar() or 0
-            
-            result = await session.execute(text("""
-                SELECT COUNT(*) FROM teacher_daily_allowances WHERE date = :today
-            """), {"today": today})
-            teacher_count = result.scalar() or 0
+        async with read_only_session_factory() as session:
+            # Check if any allowances were reset today (both counts in one round-trip)
+            result = await session.execute(ALLOWANCES_SET_TODAY_SQL, {"today": today})
+            student_count, teacher_count = result.one()
             
             return {
                 "date": today_str,
@@ -2077,6 +2487,37 @@ async def cron_status():
 
 # ==================== TEACHER ALLOWANCE MANAGEMENT ====================
 
+RESET_ALL_TEACHER_ALLOWANCES_SQL = text("""
+    INSERT INTO teacher_daily_allowances (teacher_id, date, base_amount, bonus_amount, total_amount, reset_at)
+    SELECT t.teacher_id, :date, amount.base_amount, 0, amount.base_amount, :now
+    FROM teachers t
+    LEFT JOIN programs p ON t.program_id = p.program_id
+    CROSS JOIN LATERAL (
+        SELECT COALESCE(CAST(:base_amount AS numeric), p.default_daily_allowance, 50) AS base_amount
+    ) amount
+    WHERE t.is_active = true
+    ON CONFLICT (teacher_id, date)
+    DO UPDATE SET base_amount = EXCLUDED.base_amount,
+                  total_amount = EXCLUDED.base_amount + teacher_daily_allowances.bonus_amount,
+                  reset_at = EXCLUDED.reset_at
+""")
+
+TEACHER_DEFAULT_ALLOWANCE_SQL = text("""
+    SELECT t.teacher_id, t.full_name, t.program_id, 
+           CAST(COALESCE(p.default_daily_allowance, 50) AS numeric) as default_allowance
+    FROM teachers t
+    LEFT JOIN programs p ON t.program_id = p.program_id
+    WHERE t.teacher_id = :teacher_id AND t.is_active = true
+""")
+
+RESET_TEACHER_ALLOWANCE_SQL = text("""
+    INSERT INTO teacher_daily_allowances (teacher_id, date, base_amount, bonus_amount, total_amount, reset_at)
+    VALUES (:teacher_id, :date, :base_amount, 0, :base_amount, :now)
+    ON CONFLICT (teacher_id, date) 
+    DO UPDATE SET base_amount = :base_amount, total_amount = :base_amount + teacher_daily_allowances.bonus_amount, reset_at = :now
+""")
+
+
 @router.post("/api/teacher-allowance/reset")
 async def reset_teacher_allowance(teacher_id: str = None, base_amount: float = None):
     """Reset allowance for a single teacher or all teachers."""
@@ -2085,37 +2526,26 @@ async def reset_teacher_allowance(teacher_id: str = None, base_amount: float = N
     
     try:
         today = date.today()
-        async with async_session_factory() as session:
+        async with async_session_factory() as session, session.begin():
             if teacher_id:
                 # Reset single teacher
                 # Get the teacher and their program's default allowance
-                result = await session.execute(text("""
-                    SELECT t.teacher_id, t.full_name, t.program_id, 
-                           COALESCE(p.default_daily_allowance, 50) as default_allowance
-                    FROM teachers t
-                    LEFT JOIN programs p ON t.program_id = p.program_id
-                    WHERE t.teacher_id = :teacher_id AND t.is_active = true
-                """), {"teacher_id": teacher_id})
+                result = await session.execute(TEACHER_DEFAULT_ALLOWANCE_SQL, {"teacher_id": teacher_id})
                 teacher = result.fetchone()
                 
                 if not teacher:
                     raise HTTPException(status_code=404, detail="Teacher not found")
                 
-                amount = Decimal(str(base_amount)) if base_amount else Decimal(str(teacher[3]))
+                # default_allowance is cast to numeric, so asyncpg already returns a Decimal
+                amount = Decimal(str(base_amount)) if base_amount else teacher[3]
                 
                 # Upsert the allowance
-                await session.execute(text("""
-                    INSERT INTO teacher_daily_allowances (allowance_id, teacher_id, date, base_amount, bonus_amount, total_amount, reset_at)
-                    VALUES (gen_random_uuid(), :teacher_id, :date, :base_amount, 0, :base_amount, :now)
-                    ON CONFLICT (teacher_id, date) 
-                    DO UPDATE SET base_amount = :base_amount, total_amount = :base_amount + teacher_daily_allowances.bonus_amount, reset_at = :now
-                """), {
+                await session.execute(RESET_TEACHER_ALLOWANCE_SQL, {
                     "teacher_id": teacher_id,
                     "date": today,
                     "base_amount": amount,
                     "now": datetime.now(timezone.utc)
                 })
-                await session.commit()
                 
                 return {
                     "success": True,
@@ -2123,32 +2553,14 @@ async def reset_teacher_allowance(teacher_id: str = None, base_amount: float = N
                     "message": f"Allowance set to {amount} SAR for {teacher[1]}"
                 }
             else:
-                # Reset all teachers
-                result = await session.execute(text("""
-                    SELECT t.teacher_id, t.full_name, COALESCE(p.default_daily_allowance, 50) as default_allowance
-                    FROM teachers t
-                    LEFT JOIN programs p ON t.program_id = p.program_id
-                    WHERE t.is_active = true
-                """))
-                teachers = result.fetchall()
-                
-                count = 0
-                for t in teachers:
-                    amount = Decimal(str(base_amount)) if base_amount else Decimal(str(t[2]))
-                    await session.execute(text("""
-                        INSERT INTO teacher_daily_allowances (allowance_id, teacher_id, date, base_amount, bonus_amount, total_amount, reset_at)
-                        VALUES (gen_random_uuid(), :teacher_id, :date, :base_amount, 0, :base_amount, :now)
-                        ON CONFLICT (teacher_id, date) 
-                        DO UPDATE SET base_amount = :base_amount, total_amount = :base_amount + teacher_daily_allowances.bonus_amount, reset_at = :now
-                    """), {
-                        "teacher_id": str(t[0]),
-                        "date": today,
-                        "base_amount": amount,
-                        "now": datetime.now(timezone.utc)
-                    })
-                    count += 1
-                
-                await session.commit()
+                # Reset all teachers in one set-based UPSERT; without an override
+                # each teacher gets their program's default
+                result = await session.execute(RESET_ALL_TEACHER_ALLOWANCES_SQL, {
+                    "date": today,
+                    "base_amount": Decimal(str(base_amount)) if base_amount else None,
+                    "now": datetime.now(timezone.utc)
+                })
+                count = result.rowcount
                 
                 return {
                     "success": True,
@@ -2163,6 +2575,27 @@ async def reset_teacher_allowance(teacher_id: str = None, base_amount: float = N
         raise HTTPException(status_code=500, detail=str(e))
 
 
+BUMP_TEACHER_ALLOWANCE_SQL = text("""
+    WITH teacher AS (
+        SELECT t.teacher_id, t.full_name, COALESCE(p.default_daily_allowance, 50) AS default_base
+        FROM teachers t
+        LEFT JOIN programs p ON t.program_id = p.program_id
+        WHERE t.teacher_id = :teacher_id AND t.is_active = true
+    ), bumped AS (
+        INSERT INTO teacher_daily_allowances (teacher_id, date, base_amount, bonus_amount, total_amount, reset_at)
+        SELECT teacher_id, :date, default_base, :bonus, default_base + CAST(:bonus AS numeric), :now
+        FROM teacher
+        ON CONFLICT (teacher_id, date)
+        DO UPDATE SET bonus_amount = teacher_daily_allowances.bonus_amount + EXCLUDED.bonus_amount,
+                      total_amount = teacher_daily_allowances.base_amount + teacher_daily_allowances.bonus_amount + EXCLUDED.bonus_amount,
+                      reset_at = EXCLUDED.reset_at
+        RETURNING total_amount
+    )
+    SELECT teacher.full_name, bumped.total_amount
+    FROM teacher, bumped
+""")
+
+
 @router.post("/api/teacher-allowance/bump")
 async def bump_teacher_allowance(teacher_id: str, bonus_amount: float):
     """Add bonus to a teacher's daily allowance."""
@@ -2173,69 +2606,24 @@ async def bump_teacher_allowance(teacher_id: str, bonus_amount: float):
         today = date.today()
         bonus = Decimal(str(bonus_amount))
         
-        async with async_session_factory() as session:
-            # Check if teacher exists
-            result = await session.execute(text("""
-                SELECT teacher_id, full_name FROM teachers WHERE teacher_id = :teacher_id AND is_active = true
-            """), {"teacher_id": teacher_id})
+        async with async_session_factory() as session, session.begin():
+            # Add to today's allowance, creating it with the program default if missing
+            result = await session.execute(BUMP_TEACHER_ALLOWANCE_SQL, {
+                "teacher_id": teacher_id,
+                "date": today,
+                "bonus": bonus,
+                "now": datetime.now(timezone.utc)
+            })
             teacher = result.fetchone()
             
             if not teacher:
                 raise HTTPException(status_code=404, detail="Teacher not found")
             
-            # Check if allowance exists for today
-            result = await session.execute(text("""
-                SELECT allowance_id, base_amount, bonus_amount, total_amount 
-                FROM teacher_daily_allowances 
-                WHERE teacher_id = :teacher_id AND date = :date
-            """), {"teacher_id": teacher_id, "date": today})
-            existing = result.fetchone()
-            
-            if existing:
-                # Update existing
-                new_bonus = Decimal(str(existing[2])) + bonus
-                new_total = Decimal(str(existing[1])) + new_bonus
-                await session.execute(text("""
-                    UPDATE teacher_daily_allowances 
-                    SET bonus_amount = :bonus, total_amount = :total, reset_at = :now
-                    WHERE teacher_id = :teacher_id AND date = :date
-                """), {
-                    "teacher_id": teacher_id,
-                    "date": today,
-                    "bonus": new_bonus,
-                    "total": new_total,
-                    "now": datetime.now(timezone.utc)
-                })
-            else:
-                # Create new with default base + bonus
-                result = await session.execute(text("""
-                    SELECT COALESCE(p.default_daily_allowance, 50) 
-                    FROM teachers t
-                    LEFT JOIN programs p ON t.program_id = p.program_id
-                    WHERE t.teacher_id = :teacher_id
-                """), {"teacher_id": teacher_id})
-                default_base = Decimal(str(result.scalar() or 50))
-                
-                await session.execute(text("""
-                    INSERT INTO teacher_daily_allowances (allowance_id, teacher_id, date, base_amount, bonus_amount, total_amount, reset_at)
-                    VALUES (gen_random_uuid(), :teacher_id, :date, :base, :bonus, :total, :now)
-                """), {
-                    "teacher_id": teacher_id,
-                    "date": today,
-                    "base": default_base,
-                    "bonus": bonus,
-                    "total": default_base + bonus,
-                    "now": datetime.now(timezone.utc)
-                })
-                new_total = default_base + bonus
-            
-            await session.commit()
-            
             return {
                 "success": True,
                 "teacher_id": teacher_id,
-                "new_total": float(new_total),
-                "message": f"Added {bonus} SAR supplement for {teacher[1]}"
+                "new_total": float(teacher.total_amount),
+                "message": f"Added {bonus} SAR supplement for {teacher.full_name}"
             }
     except HTTPException:
         raise
@@ -2247,6 +2635,27 @@ async def bump_teacher_allowance(teacher_id: str, bonus_amount: float):
 
 # ==================== DINER DASHBOARD APIs ====================
 
+STUDENT_SALES_SUMMARY_SQL = text("""
+    SELECT 
+        COUNT(*) as transaction_count,
+        COALESCE(SUM(amount), 0) as total_sales,
+        COALESCE(AVG(amount), 0) as avg_transaction,
+        COALESCE(MAX(amount), 0) as max_transaction
+    FROM store_transactions 
+    WHERE DATE(created_at) >= :start_date 
+    AND DATE(created_at) <= :end_date
+""")
+
+TEACHER_SALES_SUMMARY_SQL = text("""
+    SELECT 
+        COUNT(*) as transaction_count,
+        COALESCE(SUM(amount), 0) as total_sales
+    FROM teacher_meal_transactions 
+    WHERE DATE(created_at) >= :start_date 
+    AND DATE(created_at) <= :end_date
+""")
+
+
 @router.get("/api/diner/sales-summary")
 async def get_diner_sales_summary(period: str = "today"):
     """Get sales summary for diner dashboard."""
@@ -2270,27 +2679,11 @@ async def get_diner_sales_summary(period: str = "today"):
                 end_date = today
             
             # Get student transactions
-            result = await session.execute(text("""
-                SELECT 
-                    COUNT(*) as transaction_count,
-                    COALESCE(SUM(amount), 0) as total_sales,
-                    COALESCE(AVG(amount), 0) as avg_transaction,
-                    COALESCE(MAX(amount), 0) as max_transaction
-                FROM store_transactions 
-                WHERE DATE(created_at) >= :start_date 
-                AND DATE(created_at) <= :end_date
-            """), {"start_date": start_date, "end_date": end_date})
+            result = await session.execute(STUDENT_SALES_SUMMARY_SQL, {"start_date": start_date, "end_date": end_date})
             student_stats = result.fetchone()
             
             # Get teacher transactions
-            result = await session.execute(text("""
-                SELECT 
-                    COUNT(*) as transaction_count,
-                    COALESCE(SUM(amount), 0) as total_sales
-                FROM teacher_meal_transactions 
-                WHERE DATE(created_at) >= :start_date 
-                AND DATE(created_at) <= :end_date
-            """), {"start_date": start_date, "end_date": end_date})
+            result = await session.execute(TEACHER_SALES_SUMMARY_SQL, {"start_date": start_date, "end_date": end_date})
             teacher_stats = result.fetchone()
             
             return {
@@ -2317,6 +2710,18 @@ async def get_diner_sales_summary(period: str = "today"):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+HOURLY_BREAKDOWN_SQL = text("""
+    SELECT 
+        EXTRACT(HOUR FROM created_at) as hour,
+        COUNT(*) as transaction_count,
+        COALESCE(SUM(amount), 0) as total_sales
+    FROM store_transactions 
+    WHERE DATE(created_at) = :target_date
+    GROUP BY EXTRACT(HOUR FROM created_at)
+    ORDER BY hour
+""")
+
+
 @router.get("/api/diner/hourly-breakdown")
 async def get_hourly_breakdown(date_str: str = None):
     """Get hourly sales breakdown for a specific date."""
@@ -2326,16 +2731,7 @@ async def get_hourly_breakdown(date_str: str = None):
         target_date = datetime.strptime(date_str, "%Y-%m-%d").date() if date_str else date.today()
         
         async with async_session_factory() as session:
-            result = await session.execute(text("""
-                SELECT 
-                    EXTRACT(HOUR FROM created_at) as hour,
-                    COUNT(*) as transaction_count,
-                    COALESCE(SUM(amount), 0) as total_sales
-                FROM store_transactions 
-                WHERE DATE(created_at) = :target_date
-                GROUP BY EXTRACT(HOUR FROM created_at)
-                ORDER BY hour
-            """), {"target_date": target_date})
+            result = await session.execute(HOURLY_BREAKDOWN_SQL, {"target_date": target_date})
             rows = result.fetchall()
             
             # Create full 24-hour breakdown
@@ -2355,39 +2751,44 @@ async def get_hourly_breakdown(date_str: str = None):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+RECENT_STUDENT_TRANSACTIONS_SQL = text("""
+    SELECT 
+        st.transaction_id,
+        st.amount,
+        st.created_at,
+        s.full_name as customer_name,
+        'student' as customer_type
+    FROM store_transactions st
+    JOIN students s ON st.student_id = s.student_id
+    ORDER BY st.created_at DESC
+    LIMIT :limit
+""")
+
+RECENT_TEACHER_TRANSACTIONS_SQL = text("""
+    SELECT 
+        tmt.transaction_id,
+        tmt.amount,
+        tmt.created_at,
+        t.full_name as customer_name,
+        'teacher' as customer_type
+    FROM teacher_meal_transactions tmt
+    JOIN teachers t ON tmt.teacher_id = t.teacher_id
+    ORDER BY tmt.created_at DESC
+    LIMIT :limit
+""")
+
+
 @router.get("/api/diner/recent-transactions")
 async def get_recent_transactions(limit: int = 50):
     """Get recent transactions for diner dashboard."""
     try:
         async with async_session_factory() as session:
             # Get recent student transactions
-            result = await session.execute(text("""
-                SELECT 
-                    st.transaction_id,
-                    st.amount,
-                    st.created_at,
-                    s.full_name as customer_name,
-                    'student' as customer_type
-                FROM store_transactions st
-                JOIN students s ON st.student_id = s.student_id
-                ORDER BY st.created_at DESC
-                LIMIT :limit
-            """), {"limit": limit})
+            result = await session.execute(RECENT_STUDENT_TRANSACTIONS_SQL, {"limit": limit})
             student_txns = result.fetchall()
             
             # Get recent teacher transactions
-            result = await session.execute(text("""
-                SELECT 
-                    tmt.transaction_id,
-                    tmt.amount,
-                    tmt.created_at,
-                    t.full_name as customer_name,
-                    'teacher' as customer_type
-                FROM teacher_meal_transactions tmt
-                JOIN teachers t ON tmt.teacher_id = t.teacher_id
-                ORDER BY tmt.created_at DESC
-                LIMIT :limit
-            """), {"limit": limit})
+            result = await session.execute(RECENT_TEACHER_TRANSACTIONS_SQL, {"limit": limit})
             teacher_txns = result.fetchall()
             
             # Combine and sort
@@ -2419,6 +2820,40 @@ async def get_recent_transactions(limit: int = 50):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+EOD_STUDENT_SALES_SQL = text("""
+    SELECT 
+        COUNT(*) as txn_count,
+        COALESCE(SUM(amount), 0) as total,
+        COALESCE(MIN(amount), 0) as min_txn,
+        COALESCE(MAX(amount), 0) as max_txn,
+        COALESCE(AVG(amount), 0) as avg_txn,
+        MIN(created_at) as first_txn,
+        MAX(created_at) as last_txn
+    FROM store_transactions 
+    WHERE DATE(created_at) = :target_date
+""")
+
+EOD_TEACHER_SALES_SQL = text("""
+    SELECT 
+        COUNT(*) as txn_count,
+        COALESCE(SUM(amount), 0) as total,
+        MIN(created_at) as first_txn,
+        MAX(created_at) as last_txn
+    FROM teacher_meal_transactions 
+    WHERE DATE(created_at) = :target_date
+""")
+
+EOD_UNIQUE_STUDENTS_SQL = text("""
+    SELECT COUNT(DISTINCT student_id) FROM store_transactions 
+    WHERE DATE(created_at) = :target_date
+""")
+
+EOD_UNIQUE_TEACHERS_SQL = text("""
+    SELECT COUNT(DISTINCT teacher_id) FROM teacher_meal_transactions 
+    WHERE DATE(created_at) = :target_date
+""")
+
+
 @router.get("/api/diner/eod-report")
 async def get_eod_report(date_str: str = None):
     """Generate End of Day report for a specific date."""
@@ -2429,43 +2864,18 @@ async def get_eod_report(date_str: str = None):
         
         async with async_session_factory() as session:
             # Student sales
-            result = await session.execute(text("""
-                SELECT 
-                    COUNT(*) as txn_count,
-                    COALESCE(SUM(amount), 0) as total,
-                    COALESCE(MIN(amount), 0) as min_txn,
-                    COALESCE(MAX(amount), 0) as max_txn,
-                    COALESCE(AVG(amount), 0) as avg_txn,
-                    MIN(created_at) as first_txn,
-                    MAX(created_at) as last_txn
-                FROM store_transactions 
-                WHERE DATE(created_at) = :target_date
-            """), {"target_date": target_date})
+            result = await session.execute(EOD_STUDENT_SALES_SQL, {"target_date": target_date})
             student_stats = result.fetchone()
             
             # Teacher sales
-            result = await session.execute(text("""
-                SELECT 
-                    COUNT(*) as txn_count,
-                    COALESCE(SUM(amount), 0) as total,
-                    MIN(created_at) as first_txn,
-                    MAX(created_at) as last_txn
-                FROM teacher_meal_transactions 
-                WHERE DATE(created_at) = :target_date
-            """), {"target_date": target_date})
+            result = await session.execute(EOD_TEACHER_SALES_SQL, {"target_date": target_date})
             teacher_stats = result.fetchone()
             
             # Unique customers served
-            result = await session.execute(text("""
-                SELECT COUNT(DISTINCT student_id) FROM store_transactions 
-                WHERE DATE(created_at) = :target_date
-            """), {"target_date": target_date})
+            result = await session.execute(EOD_UNIQUE_STUDENTS_SQL, {"target_date": target_date})
             unique_students = result.scalar() or 0
             
-            result = await session.execute(text("""
-                SELECT COUNT(DISTINCT teacher_id) FROM teacher_meal_transactions 
-                WHERE DATE(created_at) = :target_date
-            """), {"target_date": target_date})
+            result = await session.execute(EOD_UNIQUE_TEACHERS_SQL, {"target_date": target_date})
             unique_teachers = result.scalar() or 0
             
             student_total = float(student_stats[1]) if student_stats else 0
@@ -2503,6 +2913,20 @@ async def get_eod_report(date_str: str = None):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+SALES_SINCE_SQL = text("""
+    SELECT COUNT(*), COALESCE(SUM(amount), 0)
+    FROM store_transactions 
+    WHERE DATE(created_at) >= :start_date
+""")
+
+SALES_BETWEEN_SQL = text("""
+    SELECT COUNT(*), COALESCE(SUM(amount), 0)
+    FROM store_transactions 
+    WHERE DATE(created_at) >= :start_date 
+    AND DATE(created_at) <= :end_date
+""")
+
+
 @router.get("/api/diner/weekly-comparison")
 async def get_weekly_comparison():
     """Compare this week's sales to last week."""
@@ -2516,20 +2940,11 @@ async def get_weekly_comparison():
         
         async with async_session_factory() as session:
             # This week
-            result = await session.execute(text("""
-                SELECT COUNT(*), COALESCE(SUM(amount), 0)
-                FROM store_transactions 
-                WHERE DATE(created_at) >= :start_date
-            """), {"start_date": this_week_start})
+            result = await session.execute(SALES_SINCE_SQL, {"start_date": this_week_start})
             this_week = result.fetchone()
             
             # Last week
-            result = await session.execute(text("""
-                SELECT COUNT(*), COALESCE(SUM(amount), 0)
-                FROM store_transactions 
-                WHERE DATE(created_at) >= :start_date 
-                AND DATE(created_at) <= :end_date
-            """), {"start_date": last_week_start, "end_date": last_week_end})
+            result = await session.execute(SALES_BETWEEN_SQL, {"start_date": last_week_start, "end_date": last_week_end})
             last_week = result.fetchone()
             
             this_week_sales = float(this_week[1]) if this_week else 0
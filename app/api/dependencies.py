@@ -2,9 +2,11 @@
 Authentication dependencies for FastAPI.
 Provides JWT token validation and role-based access control.
 """
+from datetime import datetime, timezone
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import Optional, List
+from cachetools import TTLCache
 
 from app.core.security import decode_token
 from app.schemas.api_schemas import TokenPayload
@@ -12,6 +14,10 @@ from app.schemas.api_schemas import TokenPayload
 
 security = HTTPBearer()
 
+# Validated tokens, so PWA request bursts skip re-verifying the same JWT.
+# Entries are dropped once the token's own exp passes, whatever the TTL.
+_token_cache = TTLCache(maxsize=10000, ttl=60)
+
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security)
@@ -21,6 +27,12 @@ async def get_current_user(
     Raises HTTPException if token is invalid.
     """
     token = credentials.credentials
+    current_user = _token_cache.get(token)
+    if current_user is not None:
+        if current_user.exp > datetime.now(timezone.utc):
+            return current_user
+        _token_cache.pop(token, None)
+    
     payload = decode_token(token)
     
     if not payload:
@@ -30,7 +42,9 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"}
         )
     
-    return TokenPayload(**payload)
+    current_user = TokenPayload(**payload)
+    _token_cache[token] = current_user
+    return current_user
 
 
 def require_roles(allowed_roles: List[str]):
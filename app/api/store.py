@@ -8,7 +8,7 @@ from motor.motor_asyncio import AsyncIOMotorDatabase
 from app.db.postgres import get_postgres_session
 from app.db.mongodb import get_mongodb
 from app.db.redis import get_redis, RedisClient
-from app.services.store_service import StoreService
+from app.services.store_service import StoreService, forget_balance
 from app.schemas.api_schemas import (
     StoreScanRequest, StoreScanResponse,
     StoreChargeRequest, StoreChargeResponse,
@@ -37,28 +37,10 @@ async def scan_person(
     Teacher IDs are prefixed with 'teacher:'.
     """
     service = StoreService(pg, mongo, redis)
-    person_id = request.student_id
-    
-    # Check if it's a teacher ID (prefixed with "teacher:")
-    if person_id.startswith("teacher:"):
-        teacher_id = person_id.replace("teacher:", "")
-        success, message, data = await service.scan_teacher(
-            teacher_id=teacher_id,
-            staff_user_id=current_user.user_id
-        )
-    else:
-        # Try as student first
-        success, message, data = await service.scan_student(
-            student_id=person_id,
-            staff_user_id=current_user.user_id
-        )
-        
-        # If student not found, try as teacher
-        if not success:
-            success, message, data = await service.scan_teacher(
-                teacher_id=person_id,
-                staff_user_id=current_user.user_id
-            )
+    success, message, data = await service.scan_person(
+        person_id=request.student_id,
+        staff_user_id=current_user.user_id
+    )
     
     if not success:
         raise HTTPException(
@@ -86,26 +68,13 @@ async def charge_person(
     Teacher IDs are prefixed with 'teacher:'.
     """
     service = StoreService(pg, mongo, redis)
-    person_id = request.student_id
-    
-    # Check if it's a teacher
-    if person_id.startswith("teacher:"):
-        teacher_id = person_id.replace("teacher:", "")
-        success, message, data = await service.charge_teacher(
-            staff_user_id=current_user.user_id,
-            teacher_id=teacher_id,
-            amount=request.amount,
-            location=request.location,
-            notes=request.notes
-        )
-    else:
-        success, message, data = await service.charge_student(
-            staff_user_id=current_user.user_id,
-            student_id=person_id,
-            amount=request.amount,
-            location=request.location,
-            notes=request.notes
-        )
+    success, message, data = await service.charge_person(
+        staff_user_id=current_user.user_id,
+        person_id=request.student_id,
+        amount=request.amount,
+        location=request.location,
+        notes=request.notes
+    )
     
     if not success:
         status_code = status.HTTP_400_BAD_REQUEST
@@ -113,4 +82,9 @@ async def charge_person(
             status_code = status.HTTP_404_NOT_FOUND
         raise HTTPException(status_code=status_code, detail=message)
     
+    # Commit before dropping the cached balance, so a poll in between cannot
+    # re-cache the pre-charge balance
+    await pg.commit()
+    forget_balance(data.pop("user_id"))
+    
     return StoreChargeResponse(**data)
@@ -7,17 +7,19 @@ from sqlalchemy import text
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from typing import Optional
 from pydantic import BaseModel
+import asyncio
 
 from app.db.postgres import get_postgres_session
 from app.db.mongodb import get_mongodb
 from app.db.redis import get_redis, RedisClient
 from app.services.attendance_service import AttendanceService
-from app.services.store_service import StoreService
+from app.services.store_service import StoreService, balance_cache
 from app.schemas.api_schemas import (
     AttendanceQRResponse, StoreQRResponse, StudentBalanceResponse,
     ErrorResponse, TokenPayload
 )
 from app.api.dependencies import require_student
+from app.core.validators import validate_saudi_phone
 
 
 router = APIRouter(prefix="/student", tags=["Student"])
@@ -42,6 +44,24 @@ class UpdateProfileRequest(BaseModel):
 
 # ===== Profile Endpoints =====
 
+# One row per student: the lateral lookup picks a single class (first by name)
+# instead of fanning out across every enrollment
+STUDENT_PROFILE_SQL = text("""
+    SELECT s.full_name, s.phone_number, p.name as program_name, c.name as class_name
+    FROM students s
+    LEFT JOIN programs p ON s.program_id = p.program_id
+    LEFT JOIN LATERAL (
+        SELECT cl.name
+        FROM class_enrollments ce
+        JOIN classes cl ON ce.class_id = cl.class_id
+        WHERE ce.student_id = s.student_id
+        ORDER BY cl.name
+        LIMIT 1
+    ) c ON true
+    WHERE s.user_id = :user_id
+""")
+
+
 @router.get(
     "/profile",
     response_model=StudentProfileResponse,
@@ -55,23 +75,17 @@ async def get_profile(
     """
     Get the current student's profile information.
     """
-    # Get user info from MongoDB
-    user = await mongo.users.find_one({"user_id": current_user.user_id})
+    # Email from MongoDB and student details from PostgreSQL are independent reads
+    user, result = await asyncio.gather(
+        mongo.users.find_one({"user_id": current_user.user_id}, {"email": 1}),
+        pg.execute(STUDENT_PROFILE_SQL, {"user_id": current_user.user_id})
+    )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
     
-    # Get student details from PostgreSQL
-    result = await pg.execute(text("""
-        SELECT s.full_name, s.phone_number, p.name as program_name, c.name as class_name
-        FROM students s
-        LEFT JOIN programs p ON s.program_id = p.program_id
-        LEFT JOIN class_enrollments ce ON s.student_id = ce.student_id
-        LEFT JOIN classes c ON ce.class_id = c.class_id
-        WHERE s.user_id = :user_id
-    """), {"user_id": current_user.user_id})
     row = result.fetchone()
     
     if not row:
@@ -103,33 +117,15 @@ async def update_profile(
     Update the current student's profile information.
     Students can update their name and phone number.
     """
-    # Validate phone number if provided
+    # Validate and normalize the phone number if provided
     if data.phone_number:
-        phone = data.phone_number.strip().replace(" ", "").replace("-", "")
-        if phone:
-            # Validate Saudi phone format
-            if phone.startswith("+966"):
-                digits = phone[4:]
-                if not (len(digits) == 9 and digits.isdigit() and digits[0] == "5"):
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        detail="Invalid phone: must be +966 followed by 9 digits starting with 5"
-                    )
-            elif phone.startswith("05"):
-                if not (len(phone) == 10 and phone.isdigit()):
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        detail="Invalid phone: must be 10 digits starting with 05"
-                    )
-                phone = "+966" + phone[1:]  # Normalize
-            elif phone.startswith("5") and len(phone) == 9 and phone.isdigit():
-                phone = "+966" + phone  # Normalize
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Invalid phone format. Use +966XXXXXXXXX or 05XXXXXXXX"
-                )
-            data.phone_number = phone
+        is_valid, phone = validate_saudi_phone(data.phone_number)
+        if not is_valid:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=phone
+            )
+        data.phone_number = phone
     
     # Build update fields
     update_fields = {}
@@ -150,7 +146,7 @@ async def update_profile(
     
     result = await pg.execute(text(f"""
         UPDATE students SET {set_clause} WHERE user_id = :user_id
-        RETURNING student_id
+        RETURNING full_name, phone_number
     """), update_fields)
     row = result.fetchone()
     
@@ -169,7 +165,12 @@ async def update_profile(
             {"$set": {"full_name": update_fields["full_name"]}}
         )
     
-    return {"success": True, "message": "Profile updated successfully"}
+    return {
+        "success": True,
+        "message": "Profile updated successfully",
+        "full_name": row.full_name,
+        "phone_number": row.phone_number
+    }
 
 
 @router.get(
@@ -243,6 +244,11 @@ async def get_meal_qr(
     Get QR code data for meal purchases.
     Shows current balance.
     """
+    cache_key = ("meal_qr", current_user.user_id)
+    result = balance_cache.get(cache_key)
+    if result is not None:
+        return StoreQRResponse(**result)
+    
     service = StoreService(pg, mongo, redis)
     result = await service.generate_store_qr(current_user.user_id)
     
@@ -252,6 +258,7 @@ async def get_meal_qr(
             detail="Student record not found or no allowance set"
         )
     
+    balance_cache[cache_key] = result
     return StoreQRResponse(**result)
 
 
@@ -269,6 +276,11 @@ async def get_balance(
     """
     Get the student's current balance for today.
     """
+    cache_key = ("balance", current_user.user_id)
+    balance = balance_cache.get(cache_key)
+    if balance is not None:
+        return StudentBalanceResponse(**balance)
+    
     service = StoreService(pg, mongo, redis)
     student = await service.get_student_by_user_id(current_user.user_id)
     
@@ -286,4 +298,5 @@ async def get_balance(
             detail="No allowance set for today"
         )
     
+    balance_cache[cache_key] = balance
     return StudentBalanceResponse(**balance)
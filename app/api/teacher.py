@@ -10,7 +10,7 @@ from app.db.postgres import get_postgres_session
 from app.db.mongodb import get_mongodb
 from app.db.redis import get_redis, RedisClient
 from app.services.attendance_service import AttendanceService
-from app.services.store_service import StoreService
+from app.services.store_service import StoreService, balance_cache
 from app.schemas.api_schemas import (
     StartAttendanceSessionRequest, StartAttendanceSessionResponse,
     AttendanceScanRequest, AttendanceScanResponse,
@@ -19,8 +19,9 @@ from app.schemas.api_schemas import (
     ErrorResponse, TokenPayload
 )
 from app.api.dependencies import require_teacher
+from app.core.logging import audit_log
 from app.models.postgres_models import Class
-from sqlalchemy import select
+from sqlalchemy import select, text
 from uuid import UUID
 
 
@@ -34,30 +35,45 @@ router = APIRouter(prefix="/teacher", tags=["Teacher"])
 )
 async def get_teacher_classes(
     current_user: TokenPayload = Depends(require_teacher),
-    pg: AsyncSession = Depends(get_postgres_session)
+    pg: AsyncSession = Depends(get_postgres_session),
+    redis: RedisClient = Depends(get_redis)
 ):
     """
     Get all classes assigned to the current teacher.
+    Served from Redis until a class is created or deleted for the teacher.
     """
+    # The cache is best-effort: a Redis failure falls through to PostgreSQL
+    try:
+        cached = await redis.get_teacher_classes(current_user.user_id)
+    except Exception as e:
+        audit_log.error("teacher_classes_cache_read_failed", str(e), actor_id=current_user.user_id, actor_role="teacher")
+        cached = None
+    if cached is not None:
+        return TeacherClassesResponse(classes=cached)
+    
     result = await pg.execute(
         select(Class).where(
             Class.teacher_id == UUID(current_user.user_id),
             Class.active == True
         )
     )
-    classes = result.scalars().all()
+    classes = [
+        ClassResponse(
+            class_id=str(c.class_id),
+            name=c.name,
+            program_id=str(c.program_id),
+            active=c.active
+        )
+        for c in result.scalars().all()
+    ]
     
-    return TeacherClassesResponse(
-        classes=[
-            ClassResponse(
-                class_id=str(c.class_id),
-                name=c.name,
-                program_id=str(c.program_id),
-                active=c.active
-            )
-            for c in classes
-        ]
-    )
+    try:
+        await redis.set_teacher_classes(
+            current_user.user_id, [c.model_dump() for c in classes]
+        )
+    except Exception as e:
+        audit_log.error("teacher_classes_cache_write_failed", str(e), actor_id=current_user.user_id, actor_role="teacher")
+    return TeacherClassesResponse(classes=classes)
 
 
 @router.post(
@@ -139,6 +155,11 @@ async def get_meal_qr(
     Get QR code data for teacher meal purchases.
     Shows current balance.
     """
+    cache_key = ("meal_qr", current_user.user_id)
+    result = balance_cache.get(cache_key)
+    if result is not None:
+        return TeacherMealQRResponse(**result)
+    
     service = StoreService(pg, mongo, redis)
     result = await service.generate_teacher_meal_qr(current_user.user_id)
     
@@ -148,6 +169,7 @@ async def get_meal_qr(
             detail="Teacher record not found or no meal allowance set"
         )
     
+    balance_cache[cache_key] = result
     return TeacherMealQRResponse(**result)
 
 
@@ -165,6 +187,11 @@ async def get_balance(
     """
     Get the teacher's current meal balance for today.
     """
+    cache_key = ("balance", current_user.user_id)
+    balance = balance_cache.get(cache_key)
+    if balance is not None:
+        return TeacherBalanceResponse(**balance)
+    
     service = StoreService(pg, mongo, redis)
     teacher = await service.get_teacher_by_user_id(current_user.user_id)
     
@@ -182,6 +209,7 @@ async def get_balance(
             detail="No meal allowance set for today"
         )
     
+    balance_cache[cache_key] = balance
     return TeacherBalanceResponse(**balance)
 
 @router.get("/attendance/history")
@@ -195,8 +223,6 @@ async def get_attendance_history(
     Get attendance history for teacher's classes.
     Can filter by class_id and/or date (YYYY-MM-DD format).
     """
-    from sqlalchemy import text
-    
     # Build query based on filters
     query = """
         SELECT 
@@ -248,6 +274,27 @@ async def get_attendance_history(
     }
 
 
+TEACHER_SESSION_SQL = text("""
+    SELECT asess.session_id, asess.date, c.name as class_name, c.class_id
+    FROM attendance_sessions asess
+    JOIN classes c ON asess.class_id = c.class_id
+    WHERE asess.session_id = :session_id AND c.teacher_id = :teacher_id
+""")
+
+SESSION_RECORDS_SQL = text("""
+    SELECT 
+        ar.record_id,
+        ar.scanned_at,
+        ar.status,
+        s.full_name as student_name,
+        s.student_id
+    FROM attendance_records ar
+    JOIN students s ON ar.student_id = s.student_id
+    WHERE ar.session_id = :session_id
+    ORDER BY ar.scanned_at ASC
+""")
+
+
 @router.get("/attendance/session/{session_id}")
 async def get_session_attendance(
     session_id: str,
@@ -257,33 +304,15 @@ async def get_session_attendance(
     """
     Get all attendance records for a specific session.
     """
-    from sqlalchemy import text
-    
     # Verify teacher owns this session
-    result = await pg.execute(text("""
-        SELECT asess.session_id, asess.date, c.name as class_name, c.class_id
-        FROM attendance_sessions asess
-        JOIN classes c ON asess.class_id = c.class_id
-        WHERE asess.session_id = :session_id AND c.teacher_id = :teacher_id
-    """), {"session_id": session_id, "teacher_id": current_user.user_id})
+    result = await pg.execute(TEACHER_SESSION_SQL, {"session_id": session_id, "teacher_id": current_user.user_id})
     
     session_info = result.fetchone()
     if not session_info:
         raise HTTPException(status_code=404, detail="Session not found or not authorized")
     
     # Get records
-    result = await pg.execute(text("""
-        SELECT 
-            ar.record_id,
-            ar.scanned_at,
-            ar.status,
-            s.full_name as student_name,
-            s.student_id
-        FROM attendance_records ar
-        JOIN students s ON ar.student_id = s.student_id
-        WHERE ar.session_id = :session_id
-        ORDER BY ar.scanned_at ASC
-    """), {"session_id": session_id})
+    result = await pg.execute(SESSION_RECORDS_SQL, {"session_id": session_id})
     
     records = result.fetchall()
     
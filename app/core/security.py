@@ -5,6 +5,7 @@ from datetime import datetime, timedelta, timezone
 from typing import Optional, Any
 from passlib.context import CryptContext
 from jose import jwt, JWTError
+import asyncio
 import secrets
 
 from app.core.config import settings
@@ -24,6 +25,16 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+async def hash_password_async(password: str) -> str:
+    """Hash a password in a worker thread; bcrypt would otherwise block the event loop."""
+    return await asyncio.to_thread(pwd_context.hash, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password against its hash in a worker thread."""
+    return await asyncio.to_thread(pwd_context.verify, plain_password, hashed_password)
+
+
 def create_access_token(
     subject: str,
     user_id: str,
@@ -0,0 +1,37 @@
+"""
+Input validators shared by the API routers.
+"""
+import re
+
+
+# Separators stripped from phone input before matching
+_PHONE_STRIP = str.maketrans("", "", " -")
+
+# +9665XXXXXXXX, 05XXXXXXXX or 5XXXXXXXX; the captured group is the 9-digit subscriber number
+_SAUDI_PHONE_RE = re.compile(r"\+966(5\d{8})|0(5\d{8})|(5\d{8})")
+
+
+def validate_saudi_phone(phone: str) -> tuple[bool, str]:
+    """
+    Validate Saudi Arabian phone number.
+    Accepted formats:
+    - +966XXXXXXXXX (9 digits after country code)
+    - 05XXXXXXXX (10 digits starting with 05)
+    Returns normalized format: +966XXXXXXXXX
+    """
+    if not phone or phone.strip() == "":
+        return True, ""  # Empty phone is allowed
+    
+    phone = phone.strip().translate(_PHONE_STRIP)
+    
+    match = _SAUDI_PHONE_RE.fullmatch(phone)
+    if match:
+        subscriber = match.group(1) or match.group(2) or match.group(3)
+        return True, "+966" + subscriber
+    
+    # No match - report which format was attempted
+    if phone.startswith("+966"):
+        return False, "Invalid Saudi phone: must be +966 followed by 9 digits starting with 5"
+    if phone.startswith("05"):
+        return False, "Invalid Saudi phone: must be 10 digits starting with 05"
+    return False, "Invalid Saudi phone format. Use +966XXXXXXXXX or 05XXXXXXXX"
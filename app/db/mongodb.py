@@ -65,6 +65,9 @@ class MongoDB:
         
         # Compound index for login queries
         await users.create_index([("email", 1), ("status", 1)])
+        
+        # Compound index for the admin dashboard login (email + role)
+        await users.create_index([("email", 1), ("role", 1)], name="email_role_idx")
     
     async def close(self) -> None:
         """Close MongoDB connection."""
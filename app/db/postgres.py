@@ -4,9 +4,12 @@ This is the authoritative source of truth for attendance and transactions.
 
 Supports both local PostgreSQL and Render PostgreSQL (with SSL).
 """
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from typing import AsyncGenerator
+import asyncio
 import ssl
 
 from app.core.config import settings
@@ -32,10 +35,18 @@ def _create_engine():
     # Engine configuration
     engine_options = {
         "echo": settings.DEBUG,
+        "poolclass": AsyncAdaptedQueuePool,  # Pinned explicitly; plain QueuePool blocks the event loop
         "pool_pre_ping": True,
-        "pool_size": 10,
-        "max_overflow": 20,
-        "pool_recycle": 300,  # Recycle connections every 5 minutes
+        "pool_size": 25,
+        "max_overflow": 25,
+        "pool_recycle": 1800,  # Recycle connections every 30 minutes (pre-ping catches dropped ones)
+        "pool_timeout": 5,  # Fail fast with an error instead of queueing for 30s on an exhausted pool
+        "connect_args": {
+            # asyncpg's own statement cache plus SQLAlchemy's prepared statement cache
+            "statement_cache_size": 1024,
+            "max_cached_statement_lifetime": 0,  # Statements are static; never age them out
+            "prepared_statement_cache_size": 256,
+        },
     }
     
     # For production (when DATABASE_URL is set), configure SSL
@@ -59,6 +70,21 @@ async_session_factory = async_sessionmaker(
     autoflush=False
 )
 
+# Read-only sessions for reporting queries. They share the main pool; the
+# read-only flag lets PostgreSQL (or a routing proxy) treat them accordingly.
+read_only_engine = engine.execution_options(
+    isolation_level="READ COMMITTED",
+    postgresql_readonly=True
+)
+
+read_only_session_factory = async_sessionmaker(
+    read_only_engine,
+    class_=AsyncSession,
+    expire_on_commit=False,
+    autocommit=False,
+    autoflush=False
+)
+
 
 async def get_postgres_session() -> AsyncGenerator[AsyncSession, None]:
     """
@@ -82,6 +108,19 @@ async def init_postgres() -> None:
         await conn.run_sync(Base.metadata.create_all)
 
 
+# Connections opened at startup so early requests skip connect, TLS and auth
+POOL_WARM_SIZE = 10
+
+
+async def warm_postgres_pool(size: int = POOL_WARM_SIZE) -> None:
+    """Open `size` pooled connections up front; each is checked out concurrently so they are distinct."""
+    async def touch():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    
+    await asyncio.gather(*[touch() for _ in range(size)])
+
+
 async def close_postgres() -> None:
     """Close PostgreSQL connections."""
     await engine.dispose()
@@ -10,11 +10,21 @@ import ssl
 from typing import Optional, Any, Union
 from decimal import Decimal
 import json
+import orjson
 from datetime import datetime, timezone
 
 from app.core.config import settings
 
 
+# Sorted sets indexing live keys by expiry timestamp, so active counts
+# are a ZCARD instead of a keyspace walk
+QR_TOKEN_INDEX = "qr:index"
+SESSION_INDEX = "session:index"
+
+# Teacher class lists change rarely; the class write paths invalidate them
+TEACHER_CLASSES_TTL = 3600
+
+
 class RedisClient:
     """Redis connection manager for ephemeral tokens."""
     
@@ -50,6 +60,30 @@ class RedisClient:
         if self.client:
             await self.client.close()
     
+    async def count_indexed(self, index: str) -> int:
+        """
+        Count live entries in an expiry-scored index.
+        Expired members are pruned first so the count matches the live keys.
+        """
+        now = datetime.now(timezone.utc).timestamp()
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.zremrangebyscore(index, "-inf", now)
+            pipe.zcard(index)
+            _, count = await pipe.execute()
+        return count
+    
+    # Response Cache Methods
+    async def get_cached(self, key: str) -> Optional[Any]:
+        """Retrieve a cached JSON value."""
+        data = await self.client.get(key)
+        if data:
+            return orjson.loads(data)
+        return None
+    
+    async def set_cached(self, key: str, value: Any, ttl: int) -> None:
+        """Cache a JSON-serializable value (dates and UUIDs included) for ttl seconds."""
+        await self.client.setex(key, ttl, orjson.dumps(value))
+    
     # Attendance QR Token Methods
     async def set_attendance_token(
         self,
@@ -72,11 +106,11 @@ class RedisClient:
             "expires_at": expires_at.isoformat(),
             "used": False
         }
-        await self.client.setex(
-            key,
-            settings.ATTENDANCE_QR_TTL,
-            json.dumps(value)
-        )
+        expires_ts = datetime.now(timezone.utc).timestamp() + settings.ATTENDANCE_QR_TTL
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.setex(key, settings.ATTENDANCE_QR_TTL, json.dumps(value))
+            pipe.zadd(QR_TOKEN_INDEX, {token: expires_ts})
+            await pipe.execute()
     
     async def get_attendance_token(self, token: str) -> Optional[dict[str, Any]]:
         """Retrieve an attendance token."""
@@ -102,7 +136,39 @@ class RedisClient:
     async def delete_attendance_token(self, token: str) -> None:
         """Delete an attendance token."""
         key = f"attendance:{token}"
-        await self.client.delete(key)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.delete(key)
+            pipe.zrem(QR_TOKEN_INDEX, token)
+            await pipe.execute()
+    
+    # Admin Session Methods
+    async def set_admin_session(self, token: str, email: str, ttl: int) -> None:
+        """
+        Store an admin dashboard session.
+        Key: admin_session:{token}
+        """
+        expires_ts = datetime.now(timezone.utc).timestamp() + ttl
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.setex(f"admin_session:{token}", ttl, email)
+            pipe.zadd(SESSION_INDEX, {token: expires_ts})
+            await pipe.execute()
+    
+    async def get_admin_session(self, token: str) -> Optional[str]:
+        """Retrieve the email for an admin session, if still valid."""
+        return await self.client.get(f"admin_session:{token}")
+    
+    # Teacher Class List Methods
+    async def get_teacher_classes(self, teacher_id: str) -> Optional[list]:
+        """Get a teacher's cached class list."""
+        return await self.get_cached(f"teacher:classes:{teacher_id}")
+    
+    async def set_teacher_classes(self, teacher_id: str, classes: list) -> None:
+        """Cache a teacher's class list until a class write invalidates it."""
+        await self.set_cached(f"teacher:classes:{teacher_id}", classes, TEACHER_CLASSES_TTL)
+    
+    async def delete_teacher_classes(self, *teacher_ids: str) -> None:
+        """Invalidate the cached class lists of the given teachers."""
+        await self.client.delete(*[f"teacher:classes:{teacher_id}" for teacher_id in teacher_ids])
     
     # Store Allowance Token Methods
     async def set_store_token(
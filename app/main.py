@@ -5,13 +5,14 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 from sqlalchemy import text
+import asyncio
 import sys
 import os
 
 from app.core.config import settings
-from app.db.postgres import init_postgres, close_postgres
+from app.db.postgres import init_postgres, warm_postgres_pool, close_postgres
 from app.db.mongodb import init_mongodb, close_mongodb
 from app.db.redis import init_redis, close_redis
 
@@ -21,7 +22,7 @@ from app.api.student import router as student_router
 from app.api.teacher import router as teacher_router
 from app.api.store import router as store_router
 from app.api.admin import router as admin_router
-from app.api.dashboard import router as dashboard_router
+from app.api.dashboard import router as dashboard_router, refresh_daily_stats_periodically
 
 
 def _mask_url(url: str) -> str:
@@ -63,6 +64,7 @@ async def lifespan(app: FastAPI):
     try:
         print("Connecting to PostgreSQL...")
         await init_postgres()
+        await warm_postgres_pool()
         print("✓ PostgreSQL connected")
     except Exception as e:
         print(f"✗ PostgreSQL connection failed: {e}")
@@ -87,6 +89,9 @@ async def lifespan(app: FastAPI):
         await close_mongodb()
         sys.exit(1)
     
+    # Keep the dashboard's daily_stats rollup current in the background
+    daily_stats_task = asyncio.create_task(refresh_daily_stats_periodically())
+    
     print("=" * 50)
     print("All services connected. Server ready.")
     print("=" * 50)
@@ -95,6 +100,7 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     print("Shutting down...")
+    daily_stats_task.cancel()
     await close_postgres()
     await close_mongodb()
     await close_redis()
@@ -106,7 +112,10 @@ app = FastAPI(
     title=settings.APP_NAME,
     version=settings.APP_VERSION,
     description="University Attendance and Allowance System - Phase 1",
-    lifespan=lifespan
+    lifespan=lifespan,
+    # orjson for every route; FastAPI still runs jsonable_encoder first,
+    # so Decimal, UUID and datetime values keep their current encoding
+    default_response_class=ORJSONResponse
 )
 
 # Configure CORS for PWA access
@@ -167,34 +176,32 @@ async def health_check():
     from app.db.mongodb import mongodb
     from app.db.redis import redis_client
     
-    health = {
-        "status": "healthy",
-        "databases": {}
-    }
-    
-    # Check PostgreSQL
-    try:
+    async def check_postgres():
         async with engine.connect() as conn:
             await conn.execute(text("SELECT 1"))
-        health["databases"]["postgres"] = "connected"
-    except Exception as e:
-        health["databases"]["postgres"] = f"error: {str(e)}"
-        health["status"] = "unhealthy"
     
-    # Check MongoDB
-    try:
-        await mongodb.db.command("ping")
-        health["databases"]["mongodb"] = "connected"
-    except Exception as e:
-        health["databases"]["mongodb"] = f"error: {str(e)}"
-        health["status"] = "unhealthy"
+    async def probe(check) -> str:
+        # Bounded so one hung backend cannot stall the liveness check
+        try:
+            await asyncio.wait_for(check(), timeout=2.0)
+            return "connected"
+        except asyncio.TimeoutError:
+            return "error: timed out after 2.0s"
+        except Exception as e:
+            return f"error: {str(e)}"
     
-    # Check Redis
-    try:
-        await redis_client.client.ping()
-        health["databases"]["redis"] = "connected"
-    except Exception as e:
-        health["databases"]["redis"] = f"error: {str(e)}"
+    # Check PostgreSQL, MongoDB and Redis concurrently
+    postgres, mongo, redis = await asyncio.gather(
+        probe(check_postgres),
+        probe(lambda: mongodb.db.command("ping")),
+        probe(lambda: redis_client.client.ping())
+    )
+    
+    health = {
+        "status": "healthy",
+        "databases": {"postgres": postgres, "mongodb": mongo, "redis": redis}
+    }
+    if any(state != "connected" for state in health["databases"].values()):
         health["status"] = "unhealthy"
     
     return health
@@ -4,7 +4,7 @@ These tables are the authoritative source of truth for attendance and transactio
 """
 from sqlalchemy import (
     Column, String, Boolean, DateTime, Date, ForeignKey, 
-    UniqueConstraint, Enum as SQLEnum, Text, Numeric
+    UniqueConstraint, Enum as SQLEnum, Text, Numeric, text
 )
 from sqlalchemy.dialects.postgresql import UUID as PGUUID
 from sqlalchemy.orm import relationship
@@ -91,7 +91,11 @@ class DailyAllowance(Base):
     """Daily allowance for a student."""
     __tablename__ = "daily_allowances"
     
-    allowance_id = Column(PGUUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # Server default too: the dashboard's set-based allowance INSERTs omit the id
+    allowance_id = Column(
+        PGUUID(as_uuid=True), primary_key=True, default=uuid.uuid4,
+        server_default=text("gen_random_uuid()")
+    )
     student_id = Column(PGUUID(as_uuid=True), ForeignKey("students.student_id"), nullable=False)
     date = Column(Date, nullable=False)
     base_amount = Column(Numeric(10, 2), nullable=False)
@@ -203,7 +207,11 @@ class TeacherDailyAllowance(Base):
     """Daily meal allowance for a teacher."""
     __tablename__ = "teacher_daily_allowances"
     
-    allowance_id = Column(PGUUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # Server default too: the dashboard's set-based allowance INSERTs omit the id
+    allowance_id = Column(
+        PGUUID(as_uuid=True), primary_key=True, default=uuid.uuid4,
+        server_default=text("gen_random_uuid()")
+    )
     teacher_id = Column(PGUUID(as_uuid=True), ForeignKey("teachers.teacher_id"), nullable=False)
     date = Column(Date, nullable=False)
     base_amount = Column(Numeric(10, 2), nullable=False)
@@ -15,6 +15,23 @@ from app.core.config import settings
 from app.core.logging import audit_log
 
 
+# Active programs (within date range if start/end dates set)
+ACTIVE_PROGRAM_DEFAULTS_SQL = text("""
+    SELECT program_id, name, CAST(default_daily_allowance AS numeric) 
+    FROM programs 
+    WHERE (is_active = true OR active = true)
+    AND (start_date IS NULL OR start_date <= :today)
+    AND (end_date IS NULL OR end_date >= :today)
+""")
+
+PROGRAM_DEFAULTS_SQL = text("""
+    SELECT program_id, name, CAST(default_daily_allowance AS numeric) 
+    FROM programs 
+    WHERE program_id = :program_id
+    AND (is_active = true OR active = true)
+""")
+
+
 class AllowanceService:
     """Service for allowance management operations."""
     
@@ -259,21 +276,7 @@ class AllowanceService:
         today = date.today()
         
         # Get active programs (within date range if start/end dates set)
-        query = text("""
-            SELECT program_id, name, default_daily_allowance 
-            FROM programs 
-            WHERE (is_active = true OR active = true)
-            AND (start_date IS NULL OR start_date <= :today)
-            AND (end_date IS NULL OR end_date >= :today)
-        """)
-        
-        if program_id:
-            query = text("""
-                SELECT program_id, name, default_daily_allowance 
-                FROM programs 
-                WHERE program_id = :program_id
-                AND (is_active = true OR active = true)
-            """)
+        query = PROGRAM_DEFAULTS_SQL if program_id else ACTIVE_PROGRAM_DEFAULTS_SQL
         
         params = {"today": today}
         if program_id:
@@ -288,10 +291,9 @@ class AllowanceService:
         
         for program in programs:
             prog_id, prog_name, default_allowance = program
+            # Cast to numeric in SQL, so a set value is already a Decimal
             if default_allowance is None:
                 default_allowance = Decimal(str(settings.DEFAULT_DAILY_ALLOWANCE))
-            else:
-                default_allowance = Decimal(str(default_allowance))
             
             # Reset student allowances for this program
             student_result = await self.pg.execute(
@@ -6,7 +6,7 @@ from datetime import datetime, date, timezone, timedelta
 from typing import Optional, List
 from uuid import UUID
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, text
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
 from app.models.postgres_models import (
@@ -19,6 +19,15 @@ from app.core.config import settings
 from app.core.logging import audit_log
 
 
+# The teacher must be assigned to the program the class belongs to
+TEACHER_CAN_SCAN_SQL = text("""
+    SELECT 1 FROM classes c
+    JOIN teacher_programs tp ON c.program_id = tp.program_id
+    JOIN teachers t ON tp.teacher_id = t.teacher_id
+    WHERE c.class_id = :class_id AND t.user_id = :teacher_user_id
+""")
+
+
 class AttendanceService:
     """Service for attendance operations."""
     
@@ -203,13 +212,10 @@ class AttendanceService:
         
         # Verify that the teacher is authorized to scan for this session
         # (teacher must be assigned to the same program as the class)
-        from sqlalchemy import text
-        verify_result = await self.pg.execute(text("""
-            SELECT 1 FROM classes c
-            JOIN teacher_programs tp ON c.program_id = tp.program_id
-            JOIN teachers t ON tp.teacher_id = t.teacher_id
-            WHERE c.class_id = :class_id AND t.user_id = :teacher_user_id
-        """), {"class_id": str(session.class_id), "teacher_user_id": teacher_user_id})
+        verify_result = await self.pg.execute(
+            TEACHER_CAN_SCAN_SQL,
+            {"class_id": str(session.class_id), "teacher_user_id": teacher_user_id}
+        )
         
         if not verify_result.fetchone():
             return False, "You are not authorized to scan for this class", None
@@ -7,7 +7,7 @@ from typing import Optional
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
 from app.models.mongo_models import UserDocument, UserInDB, UserRole, UserStatus, UserAuth, UserMetadata, UserAssociations
-from app.core.security import hash_password, verify_password, create_access_token
+from app.core.security import hash_password_async, verify_password_async, create_access_token
 from app.core.logging import audit_log
 
 
@@ -51,7 +51,7 @@ class AuthService:
             )
             return None
         
-        if not verify_password(password, user.auth["password_hash"]):
+        if not await verify_password_async(password, user.auth["password_hash"]):
             audit_log.log_login(user.user_id, user.role, success=False)
             return None
         
@@ -102,7 +102,7 @@ class AuthService:
         if not user:
             return False, "User not found"
         
-        if not verify_password(current_password, user.auth["password_hash"]):
+        if not await verify_password_async(current_password, user.auth["password_hash"]):
             audit_log.warning(
                 "auth.password.change_failed",
                 actor_id=user_id,
@@ -110,7 +110,7 @@ class AuthService:
             )
             return False, "Current password is incorrect"
         
-        new_hash = hash_password(new_password)
+        new_hash = await hash_password_async(new_password)
         now = datetime.now(timezone.utc)
         
         await self.users.update_one(
@@ -152,7 +152,7 @@ class AuthService:
             role=UserRole(role),
             status=UserStatus.UNINITIALISED,
             auth=UserAuth(
-                password_hash=hash_password(password),
+                password_hash=await hash_password_async(password),
                 password_last_changed=now
             ),
             associations=UserAssociations(),
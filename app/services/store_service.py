@@ -7,11 +7,12 @@ from decimal import Decimal
 from typing import Optional
 from uuid import UUID
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select, func, text
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from cachetools import TTLCache
 
 from app.models.postgres_models import (
-    Student, Program, StoreTransaction, DailyAllowance,
+    Student, StoreTransaction, DailyAllowance,
     Teacher, TeacherDailyAllowance, TeacherMealTransaction
 )
 from app.db.redis import RedisClient
@@ -19,6 +20,35 @@ from app.core.config import settings
 from app.core.logging import audit_log
 
 
+# Store QR codes carry a bare student_id, or a teacher_id behind this prefix
+TEACHER_ID_PREFIX = "teacher:"
+
+# Per-worker snapshots of the balance and meal QR reads, keyed by (endpoint, user_id).
+# The student and teacher apps poll these; a charge through this worker drops the
+# user's entries once it commits and any other worker's copy ages out within the TTL.
+balance_cache = TTLCache(maxsize=10000, ttl=2)
+
+
+def forget_balance(user_id) -> None:
+    """Drop a user's cached balance and meal QR reads."""
+    for endpoint in ("balance", "meal_qr"):
+        balance_cache.pop((endpoint, str(user_id)), None)
+
+# Student and teacher candidates for one id, with their program name, in one round trip
+PERSON_LOOKUP_SQL = text("""
+    SELECT 'student' AS kind, s.student_id AS person_id, s.full_name, s.is_active,
+           p.name AS program_name
+    FROM students s
+    LEFT JOIN programs p ON p.program_id = s.program_id
+    WHERE s.student_id = :person_id AND NOT :teacher_only
+    UNION ALL
+    SELECT 'teacher', t.teacher_id, t.full_name, t.is_active, p.name
+    FROM teachers t
+    LEFT JOIN programs p ON p.program_id = t.program_id
+    WHERE t.teacher_id = :person_id
+""")
+
+
 class StoreService:
     """Service for store operations."""
     
@@ -116,32 +146,64 @@ class StoreService:
             "balance": balance_info["remaining"]
         }
     
-    async def scan_student(self, student_id: str, staff_user_id: str) -> tuple[bool, str, Optional[dict]]:
+    async def find_person(self, person_id: str) -> Optional[dict]:
         """
-        Scan a student's QR to check their balance.
-        Returns (success, message, data).
+        Resolve a scanned id to a student or teacher.
+        Prefixed ids are teachers; bare ids are tried as a student, then as a teacher.
         """
-        student = await self.get_student_by_id(student_id)
-        if not student:
-            return False, "Student not found", None
-        
-        if not student.is_active:
-            return False, "Student account is inactive", None
+        teacher_only = person_id.startswith(TEACHER_ID_PREFIX)
+        try:
+            person_uuid = UUID(person_id.removeprefix(TEACHER_ID_PREFIX))
+        except ValueError:
+            return None
         
-        # Get program info
         result = await self.pg.execute(
-            select(Program).where(Program.program_id == student.program_id)
+            PERSON_LOOKUP_SQL,
+            {"person_id": person_uuid, "teacher_only": teacher_only}
         )
-        program = result.scalar_one_or_none()
+        rows = {row.kind: row for row in result}
+        person = rows.get("student") or rows.get("teacher")
+        return person._asdict() if person else None
+    
+    async def scan_person(self, person_id: str, staff_user_id: str) -> tuple[bool, str, Optional[dict]]:
+        """
+        Scan a student's or teacher's QR to check their balance.
+        Returns (success, message, data).
+        """
+        person = await self.find_person(person_id)
+        if not person:
+            if person_id.startswith(TEACHER_ID_PREFIX):
+                return False, "Teacher not found", None
+            return False, "Student or teacher not found", None
+        
+        if person["kind"] == "teacher":
+            if not person["is_active"]:
+                return False, "Teacher account is inactive", None
+            
+            balance_info = await self.get_teacher_balance(person["person_id"])
+            if not balance_info:
+                return False, "No meal allowance set for today", None
+            
+            return True, "Teacher found", {
+                "student_id": f"{TEACHER_ID_PREFIX}{person['person_id']}",  # Include prefix for charge routing
+                "student_name": person["full_name"],
+                "program_name": person["program_name"] or "Staff",
+                "balance": balance_info["remaining"],
+                "date": str(date.today()),
+                "is_teacher": True
+            }
+        
+        if not person["is_active"]:
+            return False, "Student account is inactive", None
         
-        balance_info = await self.get_balance(student.student_id)
+        balance_info = await self.get_balance(person["person_id"])
         if not balance_info:
             return False, "No allowance set for today", None
         
         return True, "Student found", {
-            "student_id": str(student.student_id),
-            "student_name": student.full_name,
-            "program_name": program.name if program else "Unknown",
+            "student_id": str(person["person_id"]),
+            "student_name": person["full_name"],
+            "program_name": person["program_name"] or "Unknown",
             "balance": balance_info["remaining"],
             "date": str(date.today())
         }
@@ -210,6 +272,7 @@ class StoreService:
         return True, "Transaction successful", {
             "success": True,
             "transaction_id": str(transaction.transaction_id),
+            "user_id": str(student.user_id),
             "student_id": student_id,
             "amount": amount,
             "balance_after": new_balance,
@@ -294,39 +357,6 @@ class StoreService:
             "balance": balance_info["remaining"]
         }
     
-    async def scan_teacher(self, teacher_id: str, staff_user_id: str) -> tuple[bool, str, Optional[dict]]:
-        """
-        Scan a teacher's QR to check their meal balance.
-        Returns (success, message, data).
-        """
-        teacher = await self.get_teacher_by_id(teacher_id)
-        if not teacher:
-            return False, "Teacher not found", None
-        
-        if not teacher.is_active:
-            return False, "Teacher account is inactive", None
-        
-        # Get program info if assigned
-        program = None
-        if teacher.program_id:
-            result = await self.pg.execute(
-                select(Program).where(Program.program_id == teacher.program_id)
-            )
-            program = result.scalar_one_or_none()
-        
-        balance_info = await self.get_teacher_balance(teacher.teacher_id)
-        if not balance_info:
-            return False, "No meal allowance set for today", None
-        
-        return True, "Teacher found", {
-            "student_id": f"teacher:{teacher.teacher_id}",  # Include prefix for charge routing
-            "student_name": teacher.full_name,
-            "program_name": program.name if program else "Staff",
-            "balance": balance_info["remaining"],
-            "date": str(date.today()),
-            "is_teacher": True
-        }
-    
     async def charge_teacher(
         self,
         staff_user_id: str,
@@ -383,8 +413,38 @@ class StoreService:
         return True, "Transaction successful", {
             "success": True,
             "transaction_id": str(transaction.transaction_id),
+            "user_id": str(teacher.user_id),
             "student_id": teacher_id,
             "amount": amount,
             "balance_after": new_balance,
             "message": f"Charged {amount:.2f}. Remaining balance: {new_balance:.2f}"
         }
+    
+    async def charge_person(
+        self,
+        staff_user_id: str,
+        person_id: str,
+        amount: Decimal,
+        location: Optional[str] = None,
+        notes: Optional[str] = None
+    ) -> tuple[bool, str, Optional[dict]]:
+        """
+        Charge a student's allowance, or a teacher's meal allowance for prefixed ids.
+        Returns (success, message, transaction_data); transaction_data includes the
+        charged user_id so the caller can drop cached balances once it commits.
+        """
+        if person_id.startswith(TEACHER_ID_PREFIX):
+            return await self.charge_teacher(
+                staff_user_id=staff_user_id,
+                teacher_id=person_id.removeprefix(TEACHER_ID_PREFIX),
+                amount=amount,
+                location=location,
+                notes=notes
+            )
+        return await self.charge_student(
+            staff_user_id=staff_user_id,
+            student_id=person_id,
+            amount=amount,
+            location=location,
+            notes=notes
+        )
@@ -0,0 +1,15 @@
+-- Migration: Server-side allowance_id defaults
+-- Description: Lets PostgreSQL generate allowance_id so the allowance INSERTs in
+--              /dashboard/api/allowances, /allowances/bulk, /supplements and the
+--              teacher allowance endpoints can omit the column. teacher_daily_allowances
+--              is created from the ORM model and has no server default otherwise.
+-- Date: 2026-10-17
+
+-- gen_random_uuid() is built in from PostgreSQL 13; pgcrypto provides it before that
+CREATE EXTENSION IF NOT EXISTS pgcrypto;
+
+ALTER TABLE daily_allowances
+ALTER COLUMN allowance_id SET DEFAULT gen_random_uuid();
+
+ALTER TABLE teacher_daily_allowances
+ALTER COLUMN allowance_id SET DEFAULT gen_random_uuid();
@@ -0,0 +1,37 @@
+-- Migration: Ensure allowance lookup indexes
+-- Description: Guarantees the (owner, date) unique constraints that back the allowance
+--              UPSERTs (ON CONFLICT (student_id, date) / (teacher_id, date)) and adds
+--              the date and session indexes used by /dashboard/api/allowances and the
+--              attendance listings. Safe to re-run.
+-- Date: 2026-10-17
+
+-- Unique (student_id, date); schema.sql declares it, older databases may not have it
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_student_date') THEN
+        ALTER TABLE daily_allowances
+        ADD CONSTRAINT uq_student_date UNIQUE (student_id, date);
+        RAISE NOTICE 'Added uq_student_date';
+    END IF;
+END $$;
+
+-- Unique (teacher_id, date); declared on the TeacherDailyAllowance model
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_teacher_date') THEN
+        ALTER TABLE teacher_daily_allowances
+        ADD CONSTRAINT uq_teacher_date UNIQUE (teacher_id, date);
+        RAISE NOTICE 'Added uq_teacher_date';
+    END IF;
+END $$;
+
+-- Date-filtered allowance listings
+CREATE INDEX IF NOT EXISTS idx_daily_allowances_date
+ON daily_allowances(date);
+
+CREATE INDEX IF NOT EXISTS idx_teacher_daily_allowances_date
+ON teacher_daily_allowances(date);
+
+-- Attendance records joined to their session
+CREATE INDEX IF NOT EXISTS idx_attendance_records_session_id
+ON attendance_records(session_id);
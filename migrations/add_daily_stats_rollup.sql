@@ -0,0 +1,50 @@
+-- Migration: Add daily_stats rollup view
+-- Description: Per-day transaction and attendance counters for the last 31 days, kept in a
+--              materialized view that the app refreshes every 60 seconds off the request
+--              path (app.api.dashboard.refresh_daily_stats_periodically). The dashboard
+--              stats, telemetry and trend endpoints read a handful of rows instead of
+--              counting store_transactions / attendance_records on every request, and
+--              inserts into those tables take no extra locks.
+--              Until this has run (e.g. on a database built by Base.metadata.create_all)
+--              the dashboard falls back to counting the raw tables.
+-- Date: 2026-10-17
+
+BEGIN;
+
+-- Replace the earlier trigger-maintained daily_stats table if it was applied
+DROP TRIGGER IF EXISTS trg_daily_stats_store_transactions ON store_transactions;
+DROP TRIGGER IF EXISTS trg_daily_stats_attendance_records ON attendance_records;
+DROP FUNCTION IF EXISTS daily_stats_store_transactions();
+DROP FUNCTION IF EXISTS daily_stats_attendance_records();
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'daily_stats' AND relkind = 'r') THEN
+        DROP TABLE daily_stats;
+    END IF;
+END $$;
+
+-- The dashboard reads at most 30 days back, which bounds the cost of each refresh
+CREATE MATERIALIZED VIEW IF NOT EXISTS daily_stats AS
+SELECT stat_date,
+       SUM(transaction_count)::bigint AS transaction_count,
+       SUM(transaction_total)::decimal(14, 2) AS transaction_total,
+       SUM(attendance_count)::bigint AS attendance_count
+FROM (
+    SELECT created_at::date AS stat_date, COUNT(*) AS transaction_count,
+           COALESCE(SUM(amount), 0) AS transaction_total, 0 AS attendance_count
+    FROM store_transactions
+    WHERE created_at >= CURRENT_DATE - 30
+    GROUP BY 1
+    UNION ALL
+    SELECT scanned_at::date, 0, 0, COUNT(*)
+    FROM attendance_records
+    WHERE scanned_at >= CURRENT_DATE - 30
+    GROUP BY 1
+) per_day
+GROUP BY stat_date;
+
+-- Required by REFRESH MATERIALIZED VIEW CONCURRENTLY (readers are never blocked)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_daily_stats_stat_date ON daily_stats (stat_date);
+
+COMMIT;
@@ -0,0 +1,28 @@
+-- Migration: Add partial indexes for dashboard listings and active counts
+-- Description: Small indexes that cover only the rows the dashboard actually reads
+--              (active students/teachers, non-null phone numbers) plus the ordering
+--              used by /dashboard/api/students keyset pagination
+-- Date: 2026-10-17
+--
+-- CREATE INDEX CONCURRENTLY cannot run inside a transaction block, so run this
+-- file with psql (autocommit) rather than wrapping it in BEGIN/COMMIT.
+
+-- Student listing order and keyset cursor (full_name, student_id)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_students_full_name_student_id
+ON students(full_name, student_id);
+
+-- Active student counts, overall and per program
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_students_active_program
+ON students(program_id) WHERE is_active = true;
+
+-- Active teacher counts and the active teacher_programs join
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_teachers_active
+ON teachers(teacher_id) WHERE is_active = true;
+
+-- Phone numbers are unique per student; this backs the uniqueness check in
+-- create_user and enforces it under concurrent inserts.
+-- Fails if duplicates already exist:
+--   SELECT phone_number, COUNT(*) FROM students
+--   WHERE phone_number IS NOT NULL GROUP BY phone_number HAVING COUNT(*) > 1;
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_students_phone_number_unique
+ON students(phone_number) WHERE phone_number IS NOT NULL;
@@ -0,0 +1,14 @@
+-- Migration: Add timestamp indexes for dashboard counters
+-- Description: Supports the half-open "today" / "last N days" range predicates used by
+--              /dashboard/api/stats, /dashboard/api/telemetry and /dashboard/api/trends/*
+--              when they count the raw tables. The store_transactions index matches the
+--              one schema.sql declares, so it is a no-op there.
+-- Date: 2026-10-17
+
+-- Store transactions filtered by purchase time
+CREATE INDEX IF NOT EXISTS idx_store_transactions_created_at
+ON store_transactions(created_at);
+
+-- Attendance records filtered by scan time
+CREATE INDEX IF NOT EXISTS idx_attendance_records_scanned_at
+ON attendance_records(scanned_at);
@@ -0,0 +1,11 @@
+-- Migration: Add index for per-program teacher counts
+-- Description: teacher_programs is keyed (teacher_id, program_id), which cannot serve the
+--              per-program teacher_count lookup in /dashboard/api/programs. This index
+--              leads with program_id so each count is an index-only probe.
+-- Date: 2026-10-17
+--
+-- CREATE INDEX CONCURRENTLY cannot run inside a transaction block, so run this
+-- file with psql (autocommit) rather than wrapping it in BEGIN/COMMIT.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_teacher_programs_program_teacher
+ON teacher_programs(program_id, teacher_id);
@@ -102,6 +102,7 @@ db.users.createIndex({ "email": 1 }, { unique: true });
 db.users.createIndex({ "role": 1 });
 db.users.createIndex({ "status": 1 });
 db.users.createIndex({ "email": 1, "status": 1 });
+db.users.createIndex({ "email": 1, "role": 1 }, { name: "email_role_idx" });
 
 print("Users collection created with indexes");
 
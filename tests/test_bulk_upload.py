@@ -0,0 +1,142 @@
+"""
+Bulk Upload Write Tests
+
+Tests:
+- A batch write rejected by PostgreSQL falls back to per-row writes
+- COPY failures (raw asyncpg errors) take the same fallback
+- Rows that still fail are reported and their user documents removed
+- Errors that are not database errors abort the upload
+
+PostgreSQL and MongoDB are replaced with in-memory fakes, so these run without services.
+"""
+import pytest
+from unittest.mock import patch, AsyncMock, MagicMock
+from asyncpg.exceptions import UniqueViolationError
+from sqlalchemy.exc import DBAPIError
+
+from app.api import dashboard
+
+
+class FakeTransaction:
+    """Stands in for session.begin() / session.begin_nested()."""
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeSession:
+    """Stands in for an AsyncSession; the write_batch under test does the writing."""
+    
+    def begin(self):
+        return FakeTransaction()
+    
+    def begin_nested(self):
+        return FakeTransaction()
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+def make_pending(*emails):
+    """Validated upload rows as store_bulk_users receives them."""
+    return [
+        {
+            "row": {"email": email},
+            "row_num": i + 2,
+            "email": email,
+            "user_doc": {"_id": f"user-{i}", "email": email}
+        }
+        for i, email in enumerate(emails)
+    ]
+
+
+@pytest.fixture
+def fake_mongodb():
+    """MongoDB handle whose users.delete_many can be inspected."""
+    fake = MagicMock()
+    fake.db.users.delete_many = AsyncMock()
+    with patch.object(dashboard, "mongodb", fake):
+        yield fake
+
+
+@pytest.fixture
+def fake_session_factory():
+    """Route store_bulk_users onto FakeSession."""
+    with patch.object(dashboard, "async_session_factory", FakeSession):
+        yield
+
+
+class TestBulkUploadFallback:
+    """Tests for the per-row fallback in store_bulk_users."""
+    
+    @pytest.mark.asyncio
+    async def test_copy_failure_falls_back_to_rows(self, fake_mongodb, fake_session_factory):
+        """An asyncpg error from COPY is retried row by row; only the bad row is reported."""
+        pending = make_pending("a@academy.edu", "dup@academy.edu", "c@academy.edu")
+        batch_sizes = []
+        
+        async def write_batch(session, batch):
+            batch_sizes.append(len(batch))
+            if len(batch) > 1 or batch[0]["email"] == "dup@academy.edu":
+                raise UniqueViolationError("duplicate key value violates unique constraint")
+            return {}
+        
+        errors = []
+        created = await dashboard.store_bulk_users(pending, write_batch, errors)
+        
+        assert created == 2
+        assert batch_sizes == [3, 1, 1, 1]
+        assert len(errors) == 1
+        assert errors[0]["row_num"] == 3
+        assert errors[0]["type"] == "error"
+        
+        # The failed batch and the failed row both clean up their MongoDB documents
+        deleted = [c.args[0]["_id"]["$in"] for c in fake_mongodb.db.users.delete_many.await_args_list]
+        assert deleted == [["user-0", "user-1", "user-2"], ["user-1"]]
+    
+    @pytest.mark.asyncio
+    async def test_sqlalchemy_error_falls_back_to_rows(self, fake_mongodb, fake_session_factory):
+        """A batch INSERT rejected through SQLAlchemy takes the same fallback."""
+        pending = make_pending("a@academy.edu", "b@academy.edu")
+        
+        async def write_batch(session, batch):
+            if len(batch) > 1:
+                raise DBAPIError("INSERT INTO students ...", {}, Exception("check violation"))
+            return {}
+        
+        errors = []
+        created = await dashboard.store_bulk_users(pending, write_batch, errors)
+        
+        assert created == 2
+        assert errors == []
+    
+    @pytest.mark.asyncio
+    async def test_batch_success_skips_fallback(self, fake_mongodb, fake_session_factory):
+        """A batch that writes cleanly is stored in one call."""
+        pending = make_pending("a@academy.edu", "b@academy.edu", "c@academy.edu")
+        write_batch = AsyncMock(return_value={})
+        
+        errors = []
+        created = await dashboard.store_bulk_users(pending, write_batch, errors)
+        
+        assert created == 3
+        assert write_batch.await_count == 1
+        fake_mongodb.db.users.delete_many.assert_not_awaited()
+    
+    @pytest.mark.asyncio
+    async def test_other_errors_abort_upload(self, fake_mongodb, fake_session_factory):
+        """Errors outside PostgreSQL are not retried and remove every uploaded document."""
+        pending = make_pending("a@academy.edu", "b@academy.edu")
+        write_batch = AsyncMock(side_effect=RuntimeError("mongo unavailable"))
+        
+        with pytest.raises(RuntimeError):
+            await dashboard.store_bulk_users(pending, write_batch, [])
+        
+        assert write_batch.await_count == 1
+        fake_mongodb.db.users.delete_many.assert_awaited_with({"_id": {"$in": ["user-0", "user-1"]}})
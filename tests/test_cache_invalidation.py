@@ -0,0 +1,227 @@
+"""
+Cache Invalidation Tests
+
+Tests:
+- Creating or deleting a class drops the teacher's cached class list
+- A Redis failure while invalidating does not fail the class write
+- A store charge drops the charged user's cached balance and meal QR reads after it commits
+
+PostgreSQL and Redis are replaced with in-memory fakes, so these run without services.
+"""
+import pytest
+from types import SimpleNamespace
+from decimal import Decimal
+from uuid import uuid4
+from unittest.mock import patch, AsyncMock, MagicMock
+
+from fastapi import HTTPException
+
+from app.api import dashboard, store
+from app.services.store_service import StoreService, balance_cache
+
+from tests.conftest import TEST_PROGRAM_ID, TEST_CLASS_ID, TEST_STUDENT_ID
+
+
+TEST_TEACHER_ID = "dddddddd-dddd-dddd-dddd-dddddddddddd"
+
+
+class FakeResult:
+    """Result of DELETE_CLASS_SQL: (session_count, deleted teacher_id)."""
+    
+    def __init__(self, row):
+        self.row = row
+    
+    def one(self):
+        return self.row
+
+
+class FakeSession:
+    """AsyncSession stand-in that answers every statement with the same row."""
+    
+    def __init__(self, row=None):
+        self.execute = AsyncMock(return_value=FakeResult(row))
+    
+    def begin(self):
+        return self
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+@pytest.fixture
+def fake_redis():
+    """Connected Redis client whose class-list deletes can be inspected."""
+    fake = MagicMock()
+    fake.delete_teacher_classes = AsyncMock()
+    with patch.object(dashboard, "redis_client", fake):
+        yield fake
+
+
+class TestTeacherClassesInvalidation:
+    """Tests that class writes drop the teacher app's cached class list."""
+    
+    @pytest.mark.asyncio
+    async def test_create_class_invalidates(self, fake_redis):
+        """Creating a class drops its teacher's cached list."""
+        with patch.object(dashboard, "async_session_factory", lambda: FakeSession()):
+            response = await dashboard.create_class({
+                "name": "Test Class",
+                "program_id": TEST_PROGRAM_ID,
+                "teacher_id": TEST_TEACHER_ID
+            })
+        
+        assert response["success"] is True
+        fake_redis.delete_teacher_classes.assert_awaited_once_with(TEST_TEACHER_ID)
+    
+    @pytest.mark.asyncio
+    async def test_delete_class_invalidates(self, fake_redis):
+        """Deleting a class drops the cached list of the teacher it belonged to."""
+        with patch.object(dashboard, "async_session_factory", lambda: FakeSession((0, TEST_TEACHER_ID))):
+            response = await dashboard.delete_class(TEST_CLASS_ID)
+        
+        assert response["success"] is True
+        fake_redis.delete_teacher_classes.assert_awaited_once_with(TEST_TEACHER_ID)
+    
+    @pytest.mark.asyncio
+    async def test_blocked_delete_keeps_cache(self, fake_redis):
+        """A class with attendance sessions is not deleted, so the cache stays."""
+        with patch.object(dashboard, "async_session_factory", lambda: FakeSession((3, None))):
+            with pytest.raises(dashboard.HTTPException) as exc_info:
+                await dashboard.delete_class(TEST_CLASS_ID)
+        
+        assert exc_info.value.status_code == 400
+        fake_redis.delete_teacher_classes.assert_not_awaited()
+    
+    @pytest.mark.asyncio
+    async def test_invalidation_failure_is_logged(self, fake_redis):
+        """A Redis error after the write commits is logged, not returned to the caller."""
+        fake_redis.delete_teacher_classes.side_effect = ConnectionError("redis down")
+        
+        with patch.object(dashboard, "async_session_factory", lambda: FakeSession()), \
+                patch.object(dashboard.audit_log, "error") as log_error:
+            response = await dashboard.create_class({
+                "name": "Test Class",
+                "program_id": TEST_PROGRAM_ID,
+                "teacher_id": TEST_TEACHER_ID
+            })
+        
+        assert response["success"] is True
+        assert log_error.call_args.args[0] == "teacher_classes_invalidate_failed"
+
+
+@pytest.fixture
+def seeded_balance_cache():
+    """Cached balance and meal QR reads for two users; returns their user ids."""
+    charged, other = str(uuid4()), str(uuid4())
+    balance_cache.clear()
+    for user_id in (charged, other):
+        balance_cache[("balance", user_id)] = {"remaining": 20.0}
+        balance_cache[("meal_qr", user_id)] = {"balance": 20.0}
+    yield charged, other
+    balance_cache.clear()
+
+
+def make_store_service() -> StoreService:
+    """StoreService over a session whose flush is a no-op."""
+    pg = MagicMock()
+    pg.flush = AsyncMock()
+    return StoreService(pg, MagicMock(), AsyncMock())
+
+
+def make_charge_request(person_id: str):
+    """Body of POST /store/charge."""
+    return SimpleNamespace(student_id=person_id, amount=Decimal("5"), location=None, notes=None)
+
+
+class TestBalanceCacheInvalidation:
+    """Tests that charges drop the per-worker balance cache only once committed."""
+    
+    @pytest.mark.asyncio
+    async def test_charge_invalidates_after_commit(self, seeded_balance_cache):
+        """The charged user's reads are still cached at commit time and gone afterwards."""
+        charged, other = seeded_balance_cache
+        pg = MagicMock()
+        cached_at_commit = []
+        pg.commit = AsyncMock(side_effect=lambda: cached_at_commit.append(
+            ("balance", charged) in balance_cache and ("meal_qr", charged) in balance_cache
+        ))
+        charge = AsyncMock(return_value=(True, "Transaction successful", {
+            "success": True,
+            "transaction_id": str(uuid4()),
+            "user_id": charged,
+            "student_id": TEST_STUDENT_ID,
+            "amount": Decimal("5"),
+            "balance_after": Decimal("15"),
+            "message": "Charged 5.00. Remaining balance: 15.00"
+        }))
+        
+        with patch.object(store.StoreService, "charge_person", charge):
+            response = await store.charge_person(
+                make_charge_request(TEST_STUDENT_ID),
+                current_user=SimpleNamespace(user_id=str(uuid4())),
+                pg=pg, mongo=MagicMock(), redis=MagicMock()
+            )
+        
+        assert response.success is True
+        assert cached_at_commit == [True]
+        assert ("balance", charged) not in balance_cache
+        assert ("meal_qr", charged) not in balance_cache
+        assert ("balance", other) in balance_cache
+        assert ("meal_qr", other) in balance_cache
+    
+    @pytest.mark.asyncio
+    async def test_rejected_charge_keeps_cache(self, seeded_balance_cache):
+        """A rejected charge is not committed, so the cached reads stay."""
+        charged, _ = seeded_balance_cache
+        pg = MagicMock()
+        pg.commit = AsyncMock()
+        charge = AsyncMock(return_value=(False, "Insufficient balance. Available: 2.00", None))
+        
+        with patch.object(store.StoreService, "charge_person", charge):
+            with pytest.raises(HTTPException) as exc_info:
+                await store.charge_person(
+                    make_charge_request(TEST_STUDENT_ID),
+                    current_user=SimpleNamespace(user_id=str(uuid4())),
+                    pg=pg, mongo=MagicMock(), redis=MagicMock()
+                )
+        
+        assert exc_info.value.status_code == 400
+        pg.commit.assert_not_awaited()
+        assert ("balance", charged) in balance_cache
+    
+    @pytest.mark.asyncio
+    async def test_student_charge_reports_user(self, seeded_balance_cache):
+        """The service names the charged student's user and leaves the cache to the caller."""
+        charged, _ = seeded_balance_cache
+        student = SimpleNamespace(
+            student_id=uuid4(), user_id=charged, program_id=uuid4(), is_active=True
+        )
+        service = make_store_service()
+        
+        with patch.object(service, "get_student_by_id", AsyncMock(return_value=student)), \
+                patch.object(service, "get_balance", AsyncMock(return_value={"remaining": Decimal("20")})):
+            success, _, data = await service.charge_student(str(uuid4()), str(student.student_id), Decimal("5"))
+        
+        assert success is True
+        assert data["user_id"] == charged
+        assert ("balance", charged) in balance_cache
+    
+    @pytest.mark.asyncio
+    async def test_teacher_charge_reports_user(self, seeded_balance_cache):
+        """The service names the charged teacher's user and leaves the cache to the caller."""
+        charged, _ = seeded_balance_cache
+        teacher = SimpleNamespace(
+            teacher_id=uuid4(), user_id=charged, program_id=uuid4(), is_active=True
+        )
+        service = make_store_service()
+        
+        with patch.object(service, "get_teacher_by_id", AsyncMock(return_value=teacher)), \
+                patch.object(service, "get_teacher_balance", AsyncMock(return_value={"remaining": Decimal("20")})):
+            success, _, data = await service.charge_teacher(str(uuid4()), str(teacher.teacher_id), Decimal("5"))
+        
+        assert success is True
+        assert data["user_id"] == charged
+        assert ("meal_qr", charged) in balance_cache